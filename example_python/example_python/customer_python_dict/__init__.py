@@ -1,57 +1,344 @@
-from typing import Any, Iterable, List, Optional, Tuple
+from array import array
+from collections.abc import Mapping
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Type, TypeVar, Union
+
+# 与CPython一样, 把hash当作无符号的64位整数来扰动
+_UINT64_MASK: int = (1 << 64) - 1
+_PERTURB_SHIFT: int = 5
+# 渐进式扩容的搬运要在距离下次扩容的写入次数的0.5%内完成, 让变慢的写入明显少于1%, 不影响p99
+_REHASH_WRITE_RATIO: float = 0.005
+
+
+class ProbeStats(NamedTuple):
+    """
+    哈希表的探测统计, 探测长度是查找一个已存在的key时访问index_array的次数, 1代表直接命中
+    渐进式扩容期间, 旧index_array中的数据按在旧index_array中的探测长度统计
+    """
+    length: int  # 数据量
+    capacity: int  # index_array的大小
+    load: float  # 数据量/容量
+    fill: float  # (数据量+被删除的位置)/容量, 被删除的位置同样会拉长探测
+    avg_probe_length: float
+    max_probe_length: int
+    probe_length_histogram: Dict[int, int]  # 探测长度 -> 数据量
+
+
+_CustomerDictT = TypeVar("_CustomerDictT", bound="CustomerDict")
 
 
 class CustomerDict(object):
 
-    def __init__(self):
+    def __init__(self, incremental_resize: bool = False, resize_step: int = 8):
+        """
+        incremental_resize: 是否渐进式扩容, 与redis的渐进式rehash类似, 扩容时保留旧的index_array,
+            之后每次写入数据时只搬运旧index_array中一部分位置的数据, 避免一次搬运所有数据造成的卡顿,
+            每次搬运的位置数按旧index_array的大小计算, 让搬运在距离下次扩容的前0.5%的写入内完成,
+            所以变慢的写入不到1%, p99接近一次性扩容, 只是p99.9更高(见benchmark.bench_insert_latency)
+            只对扩容有效: 整理被删除的数据会改变data_array的下标, 仍然是一次性完成,
+            耗时与剩余的数据量成正比(20万条数据约0.3s), 插入和删除交替的负载(见benchmark.bench_churn)仍会周期性卡顿
+        resize_step: 渐进式扩容时每次最少搬运的位置数
+        """
+        if resize_step < 2:
+            # 扩容后新的index_array的使用率为1/3, 要在它达到2/3之前搬运完, 每次写入至少要搬运1.5个位置
+            raise ValueError("resize step must be greater than 1")
+        self._incremental_resize: bool = incremental_resize
+        self._resize_step: int = resize_step
         self._init_seed: int = 3  # 容量因子
         self._init_length: int = 2 ** self._init_seed  # 初始化数组大小
         self._load_factor: float = 2 / 3  # 扩容因子
-        self._index_array: List[int] = [-1 for _ in range(self._init_length)]  # 存放下标的数组
-        self._data_array: List[Optional[Tuple[int, Any, Any]]] = []  # 存放数据的数组
+        self._delete_factor: float = 1 / 3  # 被删除的数据超过容量的这个比例时整理
+        self._index_array: List[int] = self._new_index_array(self._init_length)  # 存放下标的数组
+        self._clear_data()  # 存放数据的数组
         self._used_count: int = 0  # 目前用的量
         self._delete_count: int = 0  # 被标记删除的量
 
+        # 渐进式扩容时使用
+        self._old_index_array: Optional[List[int]] = None  # 还没搬运完的旧index_array
+        self._old_length: int = 0  # 旧index_array的大小
+        self._rehash_index: int = 0  # 旧index_array中下一个要搬运的位置
+        self._rehash_size: int = resize_step  # 本次扩容每次写入搬运的位置数
+
+    # 以下是存储数据的方法, 子类可以通过重写这些方法更换存储数据的结构, 见CompactCustomerDict
+    def _new_index_array(self, length: int) -> List[int]:
+        return [-1 for _ in range(length)]
+
+    def _clear_data(self) -> None:
+        self._data_array: List[Optional[Tuple[int, Any, Any]]] = []
+
+    def _append_data(self, key_hash: int, key: Any, value: Any) -> None:
+        self._data_array.append((key_hash, key, value))
+
+    def _get_hash(self, data_index: int) -> int:
+        return self._data_array[data_index][0]  # type: ignore
+
+    def _get_key(self, data_index: int) -> Any:
+        return self._data_array[data_index][1]  # type: ignore
+
+    def _get_value(self, data_index: int) -> Any:
+        return self._data_array[data_index][2]  # type: ignore
+
+    def _set_value(self, data_index: int, value: Any) -> None:
+        key_hash, key, _ = self._data_array[data_index]  # type: ignore
+        self._data_array[data_index] = (key_hash, key, value)
+
+    def _remove_data(self, data_index: int) -> None:
+        self._data_array[data_index] = None
+
+    def _iter_data(self) -> Iterator[Tuple[int, Any, Any]]:
+        """按插入顺序遍历未删除的数据, 返回(hash, key, value)"""
+        return (item for item in self._data_array if item is not None)
+
     def _create_new(self):
-        """扩容函数"""
-        self._init_seed += 1  # 增加容量因子
+        """
+        扩容函数, 数据量达到扩容因子或被删除的数据达到_delete_factor时调用
+        新的容量是能让现有数据不超过一半的最小的2的幂, 被删除的数据不计算在内,
+        所以被删除的数据较多时, 只是以原来(甚至更小)的容量整理数据, 清除被删除的数据和index_array中的-2
+        """
+        seed: int = 3
+        while 2 ** seed <= len(self) * 2:
+            seed += 1
+        if self._incremental_resize and seed > self._init_seed:
+            self._create_new_incremental()
+            return
+        # 整理需要移动数据, 下标会改变, 所以即使是渐进式扩容, 也只能一次性完成
+        self._rebuild(seed)
+
+    def _rebuild(self, seed: int) -> None:
+        """以2**seed的容量一次性重建哈希表"""
+        self._old_index_array = None
+        self._init_seed = seed
         self._init_length = 2 ** self._init_seed
-        old_data_array: List[Tuple[int, Any, Any]] = self._data_array
-        self._index_array: List[int] = [-1 for _ in range(self._init_length)]
-        self._data_array: List[Tuple[int, Any, Any]] = []
+        old_data_list: List[Tuple[int, Any, Any]] = list(self._iter_data())
+        self._index_array = self._new_index_array(self._init_length)
+        self._clear_data()
         self._used_count = 0
         self._delete_count = 0
 
         # 这里只是简单实现, 实际上只需要搬运一半的数据
-        for item in old_data_array:
-            if item is not None:
-                self.__setitem__(item[1], item[2])
+        for key_hash, key, value in old_data_list:
+            index: int = self._find_empty(self._index_array, self._init_length, key_hash)
+            self._insert(index, key_hash, key, value)
+
+    def _create_new_incremental(self) -> None:
+        """
+        渐进式扩容, 只创建新的index_array, 数据由之后的写入逐步搬运
+        data_array中的数据不需要移动, 所以搬运时只需要把下标放到新的index_array中
+        """
+        # 上一次扩容还没搬运完, 先一次性搬运完
+        while self._old_index_array is not None:
+            self._rehash_step()
+        self._old_index_array = self._index_array
+        self._old_length = self._init_length
+        self._rehash_index = 0
+        self._init_seed += 1
+        self._init_length = 2 ** self._init_seed
+        self._index_array = self._new_index_array(self._init_length)
+        # 每次搬运的位置数越大, 变慢的写入越少, 但每次变慢得越多, 这里按旧index_array的大小计算,
+        # 让变慢的写入只占距离下次扩容的写入的_REHASH_WRITE_RATIO, 数据量翻倍时变慢的写入也翻倍, 比例不变
+        rehash_write_cnt: int = int(
+            (self._init_length * self._load_factor - self._used_count) * _REHASH_WRITE_RATIO
+        )
+        self._rehash_size = max(self._resize_step, -(-self._old_length // max(rehash_write_cnt, 1)))
+
+    def _rehash_step(self) -> None:
+        """
+        把旧index_array中_rehash_size个位置的数据搬运到新的index_array
+        每次要搬运上百个位置, 所以直接在这里探测空位, 不逐个调用_find_empty
+        """
+        old_index_array: Optional[List[int]] = self._old_index_array
+        if old_index_array is None:
+            return
+        index_array: List[int] = self._index_array
+        mask: int = self._init_length - 1
+        get_hash: Callable[[int], int] = self._get_hash
+        end: int = min(self._rehash_index + self._rehash_size, self._old_length)
+        for old_index in range(self._rehash_index, end):
+            data_index: int = old_index_array[old_index]
+            if data_index < 0:
+                continue
+            key_hash: int = get_hash(data_index)
+            perturb: int = key_hash & _UINT64_MASK
+            index: int = key_hash & mask
+            while index_array[index] >= 0:
+                perturb >>= _PERTURB_SHIFT
+                index = ((5 * index) + perturb + 1) & mask  # 与_get_next相同
+            index_array[index] = data_index
+            # 搬运后标记为删除, 而不是-1, 以免打断旧index_array中其他数据的探测链
+            old_index_array[old_index] = -2
+        self._rehash_index = end
+        if end == self._old_length:
+            self._old_index_array = None
+
+    def _get_next(self, index: int, perturb: int, mask: int):
+        """
+        如果下标对应的值冲突了, 需要计算下一跳的下标
+        与CPython一样, 每一跳都加上右移后的hash(perturb), 让hash的高位也参与探测,
+        否则低位相同的key(如步长为2的幂的整数)会落在同一条探测链上. perturb变为0后, 5*index+1会遍历所有下标
+        """
+        return ((5*index) + perturb + 1) & mask
 
-    def _get_next(self, index: int):
-        """如果下标对应的值冲突了, 需要计算下一跳的下标"""
-        return ((5*index) + 1) % self._init_length
+    def _find_empty(self, index_array: List[int], length: int, key_hash: int) -> int:
+        """找到key_hash可以放新数据的位置(-1或-2), 调用者需要确保key不在index_array中"""
+        mask: int = length - 1
+        perturb: int = key_hash & _UINT64_MASK
+        index: int = key_hash & mask
+        while index_array[index] >= 0:
+            perturb >>= _PERTURB_SHIFT
+            index = self._get_next(index, perturb, mask)
+        return index
 
-    def _core(self, key: Any, default_value: Optional[Any] = None) -> Tuple[int, Any, int]:
-        """获取数据或者得到可以放新数据的方法, 返回值是index_array的索引, 数据, data_array的索引"""
-        index: int = hash(key) % (self._init_length - 1)
+    def _probe(self, index_array: List[int], length: int, key: Any, key_hash: int) -> Tuple[int, int]:
+        """
+        在index_array中查找key, 返回值是index_array的索引, data_array的索引(-1代表没有找到)
+        没有找到时, index_array的索引是可以放新数据的位置, 优先复用探测过程中遇到的第一个被删除的位置
+        """
+        mask: int = length - 1
+        perturb: int = key_hash & _UINT64_MASK
+        index: int = key_hash & mask
+        free_index: int = -1
         while True:
-            data_index: int = self._index_array[index]
+            data_index: int = index_array[index]
             # 如果是-1则代表没有数据
             if data_index == -1:
+                if free_index != -1:
+                    index = free_index
                 break
             # 如果是-2则代表之前有数据则不过被删除了
             elif data_index == -2:
-                index = self._get_next(index)
+                if free_index == -1:
+                    free_index = index
+                perturb >>= _PERTURB_SHIFT
+                index = self._get_next(index, perturb, mask)
                 continue
 
-            _, new_key, default_value = self._data_array[data_index]
-            # 判断是不是对应的key
-            if key != new_key:
-                index = self._get_next(index)
-            else:
-                break
+            # 判断是不是对应的key, hash不同的key一定不相等, 不需要再比较key
+            if self._get_hash(data_index) == key_hash:
+                new_key: Any = self._get_key(data_index)
+                if new_key is key or new_key == key:
+                    break
+            perturb >>= _PERTURB_SHIFT
+            index = self._get_next(index, perturb, mask)
+        return index, data_index
+
+    def _core(
+            self, key: Any, default_value: Optional[Any] = None, key_hash: Optional[int] = None
+    ) -> Tuple[int, Any, int]:
+        """
+        获取数据或者得到可以放新数据的方法, 返回值是index_array的索引, 数据, data_array的索引
+        渐进式扩容期间, 新的index_array中没有的key还要到旧的index_array中查找, 此时index_array的索引仍是新的index_array的
+        """
+        if key_hash is None:
+            key_hash = hash(key)
+        index, data_index = self._probe(self._index_array, self._init_length, key, key_hash)
+        if data_index == -1 and self._old_index_array is not None:
+            _, data_index = self._probe(self._old_index_array, self._old_length, key, key_hash)
+        if data_index != -1:
+            default_value = self._get_value(data_index)
         return index, default_value, data_index
 
+    def _insert(self, index: int, key_hash: int, key: Any, value: Any) -> None:
+        """把新数据放到index_array的index处"""
+        self._index_array[index] = self._used_count
+        self._append_data(key_hash, key, value)
+        self._used_count += 1
+
+    def _reserve(self, cnt: int) -> None:
+        """确保再插入cnt条数据也不需要扩容, 需要时按最终的数据量一次性重建, 而不是多次翻倍"""
+        if (self._used_count + cnt) / self._init_length <= self._load_factor:
+            return
+        seed: int = 3
+        while (len(self) + cnt) / 2 ** seed > self._load_factor:
+            seed += 1
+        self._rebuild(seed)
+
+    def _bulk_insert(self, data_iter: Iterable[Tuple[int, Any, Any]]) -> None:
+        """
+        批量插入(hash, key, value), 调用者需要先通过_reserve预留足够的容量,
+        插入时不再检查是否需要扩容, 也不做渐进式扩容的搬运
+        """
+        for key_hash, key, value in data_iter:
+            index, _, data_index = self._core(key, key_hash=key_hash)
+            if data_index != -1:
+                self._set_value(data_index, value)
+            else:
+                self._insert(index, key_hash, key, value)
+
+    @classmethod
+    def from_items(
+            cls: Type[_CustomerDictT], items: Iterable[Tuple[Any, Any]], **kwargs: Any
+    ) -> _CustomerDictT:
+        """通过(key, value)创建, 按数据量一次性分配好容量, kwargs与__init__相同"""
+        customer_dict: _CustomerDictT = cls(**kwargs)
+        customer_dict.update(items)
+        return customer_dict
+
+    def update(self, other: Union["CustomerDict", Mapping, Iterable[Tuple[Any, Any]]]) -> None:
+        """批量插入, other是CustomerDict时直接使用它保存的hash, 不需要重新计算"""
+        if isinstance(other, CustomerDict):
+            self._reserve(len(other))
+            self._bulk_insert(list(other._iter_data()) if other is self else other._iter_data())
+            return
+        item_list: Collection[Tuple[Any, Any]]
+        if isinstance(other, Mapping):
+            item_list = other.items()
+        elif isinstance(other, (list, tuple)):
+            item_list = other
+        else:
+            item_list = list(other)
+        self._reserve(len(item_list))
+        self._bulk_insert((hash(key), key, value) for key, value in item_list)
+
+    def merge(self: _CustomerDictT, other: "CustomerDict") -> _CustomerDictT:
+        """合并为新的CustomerDict, 相同的key使用other的value, 两边的hash都不需要重新计算"""
+        customer_dict: _CustomerDictT = self.__class__(
+            incremental_resize=self._incremental_resize, resize_step=self._resize_step
+        )
+        customer_dict._reserve(len(self) + len(other))
+        customer_dict._bulk_insert(self._iter_data())
+        customer_dict._bulk_insert(other._iter_data())
+        return customer_dict
+
+    def _get_probe_length(self, index_array: List[int], length: int, key_hash: int, data_index: int) -> int:
+        """查找data_index对应的数据时访问index_array的次数"""
+        mask: int = length - 1
+        perturb: int = key_hash & _UINT64_MASK
+        index: int = key_hash & mask
+        probe_length: int = 1
+        while index_array[index] != data_index:
+            perturb >>= _PERTURB_SHIFT
+            index = self._get_next(index, perturb, mask)
+            probe_length += 1
+        return probe_length
+
+    def probe_stats(self) -> ProbeStats:
+        """统计每个key的探测长度, 需要遍历整个哈希表, 只用于观察哈希表的状态"""
+        histogram: Dict[int, int] = {}
+        tombstone_cnt: int = 0
+        table_list: List[Tuple[List[int], int]] = [(self._index_array, self._init_length)]
+        if self._old_index_array is not None:
+            table_list.append((self._old_index_array, self._old_length))
+        for index_array, length in table_list:
+            for data_index in index_array:
+                # 旧index_array中被删除的位置大多是已经搬运走的数据, 不影响新数据的探测
+                if data_index == -2 and index_array is self._index_array:
+                    tombstone_cnt += 1
+                elif data_index >= 0:
+                    probe_length: int = self._get_probe_length(
+                        index_array, length, self._get_hash(data_index), data_index
+                    )
+                    histogram[probe_length] = histogram.get(probe_length, 0) + 1
+
+        cnt: int = sum(histogram.values())
+        return ProbeStats(
+            length=cnt,
+            capacity=self._init_length,
+            load=cnt / self._init_length,
+            fill=(cnt + tombstone_cnt) / self._init_length,
+            avg_probe_length=sum(k * v for k, v in histogram.items()) / cnt if cnt else 0.0,
+            max_probe_length=max(histogram) if histogram else 0,
+            probe_length_histogram=dict(sorted(histogram.items())),
+        )
+
     def __getitem__(self, key: Any) -> Any:
         _, value, data_index = self._core(key)
         if data_index == -1:
@@ -59,60 +346,136 @@ class CustomerDict(object):
         return value
 
     def __setitem__(self, key: Any, value: Any) -> None:
+        if self._old_index_array is not None:
+            self._rehash_step()
         if (self._used_count / self._init_length) > self._load_factor:
             self._create_new()
-        index, _, _ = self._core(key)
-
-        self._index_array[index] = self._used_count
-        self._data_array.append((hash(key), key, value))
-        self._used_count += 1
+        key_hash: int = hash(key)
+        index, _, data_index = self._core(key, key_hash=key_hash)
+        # key已经存在, 只需要更新value
+        if data_index != -1:
+            self._set_value(data_index, value)
+            return
+        self._insert(index, key_hash, key, value)
 
     def __delitem__(self, key: Any) -> None:
-        index, _, data_index = self._core(key)
+        if self._old_index_array is not None:
+            self._rehash_step()
+        key_hash: int = hash(key)
+        index_array: List[int] = self._index_array
+        index, data_index = self._probe(index_array, self._init_length, key, key_hash)
+        if data_index == -1 and self._old_index_array is not None:
+            index_array = self._old_index_array
+            index, data_index = self._probe(index_array, self._old_length, key, key_hash)
         if data_index == -1:
             raise KeyError(key)
-        self._index_array[index] = -2
-        self._data_array[data_index] = None
+        index_array[index] = -2
+        self._remove_data(data_index)
         self._delete_count += 1
+        # 只删除不插入时数据量不会达到扩容因子, 需要按被删除的数据量触发整理, 否则容量与数据数组都不会缩小
+        if self._delete_count / self._init_length > self._delete_factor:
+            self._create_new()
 
     def __len__(self) -> int:
         return self._used_count - self._delete_count
 
-    def __iter__(self) -> Iterable:
-        return iter(self._data_array)
-    
+    def __iter__(self) -> Iterator:
+        return (item[1] for item in self._iter_data())
+
     def __str__(self) -> str:
-        return str({item[1]: item[2] for item in self._data_array if item is not None})
+        return str({item[1]: item[2] for item in self._iter_data()})
 
     def keys(self) -> List[Any]:
-        return [item[1] for item in self._data_array if item is not None]
+        return [item[1] for item in self._iter_data()]
 
     def values(self) -> List[Any]:
-        return [item[2] for item in self._data_array if item is not None]
+        return [item[2] for item in self._iter_data()]
 
     def items(self) -> List[Tuple[Any, Any]]:
-        return [(item[1], item[2]) for item in self._data_array if item is not None]
+        return [(item[1], item[2]) for item in self._iter_data()]
+
+
+# 标记被删除的key
+_DUMMY: Any = object()
+
+
+class CompactCustomerDict(CustomerDict):
+    """
+    紧凑存储的CustomerDict, 与CPython的dict类似:
+        index_array是按容量选择元素大小(int8/int16/int32/int64)的array, 而不是存放int对象的list
+        hash, key, value分别存放在array('q')和两个list中, 插入数据时不需要创建tuple
+    每条数据的开销从一个tuple(约64字节)加一个int对象和list的指针, 降到约为8(hash)+8(key指针)+8(value指针)字节,
+    再加上index_array中1~8字节的下标
+    """
+
+    @staticmethod
+    def _get_index_typecode(length: int) -> str:
+        # 下标的最大值小于length, 另外还需要存放-1和-2
+        if length <= 2 ** 7:
+            return "b"
+        elif length <= 2 ** 15:
+            return "h"
+        elif length <= 2 ** 31:
+            return "i"
+        return "q"
+
+    def _new_index_array(self, length: int) -> array:  # type: ignore
+        return array(self._get_index_typecode(length), [-1]) * length
+
+    def _clear_data(self) -> None:
+        self._hash_array: array = array("q")
+        self._key_array: List[Any] = []
+        self._value_array: List[Any] = []
+
+    def _append_data(self, key_hash: int, key: Any, value: Any) -> None:
+        self._hash_array.append(key_hash)
+        self._key_array.append(key)
+        self._value_array.append(value)
+
+    def _get_hash(self, data_index: int) -> int:
+        return self._hash_array[data_index]
+
+    def _get_key(self, data_index: int) -> Any:
+        return self._key_array[data_index]
+
+    def _get_value(self, data_index: int) -> Any:
+        return self._value_array[data_index]
+
+    def _set_value(self, data_index: int, value: Any) -> None:
+        self._value_array[data_index] = value
+
+    def _remove_data(self, data_index: int) -> None:
+        self._key_array[data_index] = _DUMMY
+        self._value_array[data_index] = None
+
+    def _iter_data(self) -> Iterator[Tuple[int, Any, Any]]:
+        return (
+            item for item in zip(self._hash_array, self._key_array, self._value_array) if item[1] is not _DUMMY
+        )
 
 
 if __name__ == '__main__':
-    customer_dict: CustomerDict = CustomerDict()
-    customer_dict["demo_1"] = "a"
-    customer_dict["demo_2"] = "b"
-    assert len(customer_dict) == 2
-
-    del customer_dict["demo_1"]
-    del customer_dict["demo_2"]
-    assert len(customer_dict) == 0
-
-    for i in range(30):
-        customer_dict[i] = i
-    assert len(customer_dict) == 30
-
-    customer_dict_value_list: List[Any] = customer_dict.values()
-    for i in range(30):
-        assert i == customer_dict[i]
-
-    for i in range(30):
-        assert customer_dict[i] == i
-        del customer_dict[i]
-    assert len(customer_dict) == 0
+    for customer_dict_class, incremental_resize in (
+        (CustomerDict, False), (CompactCustomerDict, False), (CustomerDict, True), (CompactCustomerDict, True)
+    ):
+        customer_dict: CustomerDict = customer_dict_class(incremental_resize=incremental_resize)
+        customer_dict["demo_1"] = "a"
+        customer_dict["demo_2"] = "b"
+        assert len(customer_dict) == 2
+
+        del customer_dict["demo_1"]
+        del customer_dict["demo_2"]
+        assert len(customer_dict) == 0
+
+        for i in range(30):
+            customer_dict[i] = i
+        assert len(customer_dict) == 30
+
+        customer_dict_value_list: List[Any] = customer_dict.values()
+        for i in range(30):
+            assert i == customer_dict[i]
+
+        for i in range(30):
+            assert customer_dict[i] == i
+            del customer_dict[i]
+        assert len(customer_dict) == 0
@@ -1,124 +1,81 @@
 import asyncio
-import logging
-import random
 from contextvars import ContextVar
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from uuid import uuid1
 
 from redis.asyncio import Redis
 from redis.asyncio.lock import LockError, LockNotOwnedError
 
-_lock_ctx: ContextVar[dict] = ContextVar("lock_ctx", default={})
+from .core import AcquireLoop, LuaScriptMixin, Manager
+from .telemetry import LockKindMetrics
+from .watch_dog import ExtendCommand
 
 
-class Proxy(object):
-    def __init__(self, name: str, manager: "Manager") -> None:
-        self.name = name
-        self._manager = manager
-        self._task: Optional[asyncio.Task] = None
-
-    async def run(self) -> None:
-        while True:
-            result: Optional[List[bytes]] = await self._manager.client.blpop([self.name], self._manager.timeout)
-            if result is None:
-                continue
-            listen_name = result[1].decode()
-            if listen_name not in self._manager.listener_dict:
-                logging.error(f"{listen_name} not in listener_dict")
-                continue
-
-            while True:
-                if self._manager.listener_dict[listen_name].empty():
-                    break
-                f = await self._manager.listener_dict[listen_name].get()
-                if f.done():
-                    continue
-                f.set_result(True)
-                break
-
-    def start(self) -> None:
-        if self._task:
-            raise RuntimeError(f"{self.name} already started")
-        self._task = asyncio.create_task(self.run())
-
-    def stop(self) -> None:
-        if not self._task or self._task.done():
-            raise RuntimeError(f"{self.name} not started")
-        self._task.cancel()
-
-
-class Manager(object):
-    def __init__(self, client: Redis, proxy_num: int = 8, timeout: int = 5):
-        self._proxy_num = proxy_num
-        self._proxies: List[Proxy] = [Proxy(str(i), self) for i in range(proxy_num)]
-
-        self.client = client
-        self.timeout = timeout
-        self.listener_dict: Dict[str, asyncio.Queue[asyncio.Future]] = {}
-
-    def listen(self, lock_name: str) -> asyncio.Future:
-        if lock_name not in self.listener_dict:
-            self.listener_dict[lock_name] = asyncio.Queue()
-
-        f = asyncio.Future()
-        self.listener_dict[lock_name].put_nowait(f)
-        return f
-
-    def empty(self, lock_name: str) -> bool:
-        if lock_name not in self.listener_dict:
-            return True
-        return self.listener_dict[lock_name].empty()
+class HeldLock(object):
+    """A lock held by the current task, nested acquisitions only bump the depth in process"""
+
+    def __init__(self, token: str, acquired_time: float) -> None:
+        self.token: str = token
+        self.depth: int = 1
+        self.acquired_time: float = acquired_time
 
-    def start(self) -> None:
-        for proxy in self._proxies:
-            proxy.start()
 
-    def stop(self) -> None:
-        for proxy in self._proxies:
-            proxy.stop()
+# (task id, {lock name: HeldLock}) of the current task
+_lock_ctx: ContextVar[Optional[Tuple[int, Dict[str, HeldLock]]]] = ContextVar("lock_ctx", default=None)
+
+
+def get_held_lock_dict() -> Dict[str, HeldLock]:
+    """
+    The locks held by the current task.
+    A child task inherits the context of its parent, but must not inherit the locks, so the dict is bound to the task
+    """
+    task_id: int = id(asyncio.current_task())
+    ctx: Optional[Tuple[int, Dict[str, HeldLock]]] = _lock_ctx.get()
+    if ctx is None or ctx[0] != task_id:
+        ctx = (task_id, {})
+        _lock_ctx.set(ctx)
+    return ctx[1]
 
-    def get_random_proxy_name(self) -> str:
-        return self._proxies[random.randint(0, len(self._proxies) - 1)].name
 
+class AllowNestedLock(LuaScriptMixin):
+    metrics_kind: str = "nested_lock"
 
-class AllowNestedLock(object):
     def __init__(
             self,
             client: Redis,
             manager: Manager,
             name: str,
             timeout: int = 9,
+            blocking_timeout: Optional[float] = None,
     ) -> None:
+        """
+        timeout: the expiration time(second) of the lock, it is extended by the watch dog while the lock is held
+        blocking_timeout: the maximum time(second) the outermost acquisition waits for the lock,
+            None means wait forever
+        """
         self._name = name
+        self._key: str = manager.key_layout.get_lock_key(name)
         self._manager = manager
         self._client = client
         self._timeout = timeout
+        self._blocking_timeout = blocking_timeout
+        self._metrics: LockKindMetrics = manager.metrics.get_kind(self.metrics_kind)
         self.register_scripts()
 
-    def register_scripts(self):
-        cls = self.__class__
-        client = self._client
-        if cls.lua_release is None:
-            cls.lua_release = client.register_script(cls.LUA_RELEASE_SCRIPT)
-        if cls.lua_extend is None:
-            cls.lua_extend = client.register_script(cls.LUA_EXTEND_SCRIPT)
-        if cls.lua_acquire is None:
-            cls.lua_acquire = client.register_script(cls.LUA_ACQUIRE_SCRIPT)
-
     async def __aenter__(self):
         if await self.acquire():
-            ctx_dict = _lock_ctx.get()
-            if "watch_dog" not in ctx_dict:
-                ctx_dict["watch_dog"] = id(self)
-                self._cancel_watch_dog()
-                self._watch_dog = asyncio.create_task(self._watch(self._token))
+            held_lock: HeldLock = get_held_lock_dict()[self._name]
+            if held_lock.depth == 1:
+                # the watch dog runs in another task, so it can not get the token from the context
+                self._watch_token = held_lock.token
+                self._manager.watch_dog.add(self)
             return self
         raise LockError("Unable to acquire lock within the time specified")
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        if _lock_ctx.get().get("watch_dog", 0) == id(self):
-            self._cancel_watch_dog()
-            _lock_ctx.get().pop("watch_dog", None)
+        held_lock: Optional[HeldLock] = get_held_lock_dict().get(self._name)
+        if held_lock and held_lock.depth == 1:
+            self._manager.watch_dog.remove(self)
         await self._release()
 
     #########
@@ -130,70 +87,56 @@ class AllowNestedLock(object):
 
     @property
     def _token(self) -> Optional[str]:
-        token: Optional[str] = _lock_ctx.get().get("token", None)
-        if token:
-            token += ":" + str(id(asyncio.current_task()))
-        return token
-
-    @_token.setter
-    def _token(self, token: Optional[str]) -> None:
-        ctx_dict = _lock_ctx.get()
-        if token:
-            token = token.split(":")[0]
-        ctx_dict["token"] = token
+        held_lock: Optional[HeldLock] = get_held_lock_dict().get(self._name)
+        return held_lock.token if held_lock else None
 
     ###########
     # acquire #
     ###########
     lua_acquire = None
     # KEYS[1] - lock name
+    # KEYS[2] - proxy name
     # ARGV[1] - token
-    # ARGV[2] - proxy name
-    # ARGV[3] - milliseconds
+    # ARGV[2] - milliseconds
     # return nil if the locks time was reacquired, otherwise ttl(millisecond)
     LUA_ACQUIRE_SCRIPT = """
     if (redis.call('exists', KEYS[1]) == 0) then
         redis.call('hincrby', KEYS[1], ARGV[1], 1);
-        redis.call('pexpire', KEYS[1], ARGV[3]);
-        redis.call('hset', KEYS[1], 'proxy_name', ARGV[2])
-        redis.call('del', ARGV[2]);
+        redis.call('pexpire', KEYS[1], ARGV[2]);
         return nil;
     end ;
     if (redis.call('hexists', KEYS[1], ARGV[1]) == 1) then
         redis.call('hincrby', KEYS[1], ARGV[1], 1);
-        redis.call('pexpire', KEYS[1], ARGV[3]);
+        redis.call('pexpire', KEYS[1], ARGV[2]);
         return nil;
     end ;
     return redis.call('pttl', KEYS[1])
     """
 
     async def acquire(self) -> bool:
-        if not self._token:
-            token = self._new_token()
-        else:
-            token = self._token
-        proxy_name = self._manager.get_random_proxy_name()
-
-        listener: Optional[asyncio.Future] = None
-        ttl: Optional[int] = self._timeout
-
-        while True:
-            if listener or self._manager.empty(self._name):
-                ttl = await self._do_acquire(token, proxy_name)
-                if not ttl:
-                    self._token = token
-                    if listener and not listener.done():
-                        listener.set_result(True)
-                    return True
-            if not listener or listener.done():
-                listener = self._manager.listen(self._name)
-            ttl = ttl / 3 if (ttl / 3) < 1 else 1
-            await asyncio.wait([listener], timeout=ttl)
-
-    async def _do_acquire(self, token: str, proxy_name: str) -> Optional[int]:
+        held_lock_dict: Dict[str, HeldLock] = get_held_lock_dict()
+        held_lock: Optional[HeldLock] = held_lock_dict.get(self._name)
+        if held_lock:
+            # nested acquisition of the same task, only the outermost acquisition touches redis
+            held_lock.depth += 1
+            self._metrics.reentry_cnt += 1
+            return True
+
+        start_time: float = self._manager.time()
+        deadline: Optional[float] = None
+        if self._blocking_timeout is not None:
+            deadline = start_time + self._blocking_timeout
+        token: str = self._new_token()
+        acquire_loop: AcquireLoop = await self._manager.acquire(self._key, lambda: self._do_acquire(token), deadline)
+        if acquire_loop.acquired:
+            held_lock_dict[self._name] = HeldLock(token, self._manager.time())
+        self._metrics.on_acquire(self._manager.time() - start_time, acquire_loop.attempt, acquire_loop.acquired)
+        return acquire_loop.acquired
+
+    async def _do_acquire(self, token: str) -> Optional[int]:
         timeout = int(self._timeout * 1000)
         return await self.lua_acquire(
-            keys=[self._name], args=[token, proxy_name, timeout], client=self._client
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token, timeout], client=self._client
         )
 
     ###########
@@ -201,6 +144,7 @@ class AllowNestedLock(object):
     ###########
     lua_release = None
     # KEYS[1] - lock name
+    # KEYS[2] - proxy name
     # ARGV[1] - token
     # return 1 if the lock was released, otherwise 0
     LUA_RELEASE_SCRIPT = """
@@ -211,37 +155,38 @@ class AllowNestedLock(object):
     if (counter > 0) then
         return 0;
     else
-        local proxy_name = redis.call('hget', KEYS[1], 'proxy_name')
         redis.call('del', KEYS[1]);
-        
-        redis.call('del', proxy_name);
-        redis.call('lpush', proxy_name, KEYS[1])
-        redis.call('expire', proxy_name, 3)
+
+        redis.call('lpush', KEYS[2], KEYS[1])
+        redis.call('expire', KEYS[2], 3)
         return 1;
     end ;
     return nil;
     """
 
     async def _release(self) -> None:
-        token = self._token
-        if token is None:
+        held_lock_dict: Dict[str, HeldLock] = get_held_lock_dict()
+        held_lock: Optional[HeldLock] = held_lock_dict.get(self._name)
+        if held_lock is None:
             raise LockError("Cannot release an unlocked lock")
+        held_lock.depth -= 1
+        if held_lock.depth > 0:
+            return
 
-        result: Optional[int] = await self._do_release(token)
-        if result != 0:
-            self._token = None
+        held_lock_dict.pop(self._name, None)
+        result: Optional[int] = await self._do_release(held_lock.token)
+        self._metrics.on_release(self._manager.time() - held_lock.acquired_time, result is not None)
         if result is None:
             raise LockNotOwnedError("Cannot release a lock that's no longer owned")
 
     async def _do_release(self, token: str) -> Optional[int]:
         return await self.lua_release(
-            keys=[self._name], args=[token], client=self._client
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token], client=self._client
         )
 
     #############
     # watch dog #
     #############
-    _watch_dog: Optional[asyncio.Future]
     lua_extend = None
     # KEYS[1] - lock name
     # ARGV[1] - token
@@ -262,33 +207,20 @@ class AllowNestedLock(object):
     return 1
     """
 
-    async def _watch(self, token: str) -> None:
-        while True:
-            if not await self._extend(token):
-                logging.error(f"Failed to extend the lock:{self._name}")
-            await asyncio.sleep(self._timeout / 3)
+    def _get_watch_interval(self) -> float:
+        return self._timeout / 3
 
-    def _cancel_watch_dog(self) -> None:
-        _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-        if _old_watch_dog and not _old_watch_dog.cancelled():
-            _old_watch_dog.cancel()
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(self.lua_extend, [self._key], [self._watch_token, int(self._timeout * 1000)])]
 
     async def _extend(self, token: str) -> bool:
         if self._timeout is None:
             raise LockError("Cannot extend a lock with no timeout")
         timeout = int(self._timeout * 1000)
         return bool(await self.lua_extend(
-            keys=[self._name], args=[token, timeout], client=self._client,
+            keys=[self._key], args=[token, timeout], client=self._client,
         ))
 
-    def __del__(self) -> None:
-        try:
-            _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-            if _old_watch_dog and not _old_watch_dog.cancelled():
-                _old_watch_dog.cancel()
-        except Exception:
-            pass
-
 
 async def print_info(cnt: int) -> None:
     print(f"Task:{id(asyncio.current_task())}, run cnt:{cnt}")
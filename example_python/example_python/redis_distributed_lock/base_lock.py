@@ -1,149 +1,63 @@
 import asyncio
-import logging
-import random
-from typing import Dict, Optional, List
-from uuid import uuid1
+from typing import Dict, Optional, List, Sequence, Tuple
 
 from redis.asyncio import Redis
 from redis.asyncio.lock import LockError, LockNotOwnedError
 
+from .core import AcquireLoop, LuaScriptMixin, Manager, TokenMixin
+from .telemetry import LockKindMetrics
+from .watch_dog import ExtendCommand
 
-class Proxy(object):
-    def __init__(self, name: str, manager: "Manager") -> None:
-        self.name = name
-        self._manager = manager
-        self._task: Optional[asyncio.Task] = None
-
-    async def run(self) -> None:
-        while True:
-            result: Optional[List[bytes]] = await self._manager.client.blpop([self.name], self._manager.timeout)
-            if result is None:
-                continue
-            listen_name = result[1].decode()
-            if listen_name not in self._manager.listener_dict:
-                logging.error(f"{listen_name} not in listener_dict")
-                continue
-
-            while True:
-                if self._manager.listener_dict[listen_name].empty():
-                    self._manager.listener_dict.pop(listen_name, None)
-                    break
-                f = await self._manager.listener_dict[listen_name].get()
-                if f.done():
-                    continue
-                f.set_result(True)
-                break
-
-    def start(self) -> None:
-        if self._task:
-            raise RuntimeError(f"{self.name} already started")
-        self._task = asyncio.create_task(self.run())
-
-    def stop(self) -> None:
-        if not self._task or self._task.done():
-            raise RuntimeError(f"{self.name} not started")
-        self._task.cancel()
-
-
-class Manager(object):
-    def __init__(self, client: Redis, proxy_num: int = 8, timeout: int = 5):
-        self._proxy_num = proxy_num
-        self._proxies: List[Proxy] = [Proxy(str(i), self) for i in range(proxy_num)]
-
-        self.client = client
-        self.timeout = timeout
-        self.listener_dict: Dict[str, asyncio.Queue[asyncio.Future]] = {}
-
-    def listen(self, lock_name: str) -> asyncio.Future:
-        if lock_name not in self.listener_dict:
-            self.listener_dict[lock_name] = asyncio.Queue()
 
-        f = asyncio.Future()
-        self.listener_dict[lock_name].put_nowait(f)
-        return f
+class BaseLock(LuaScriptMixin, TokenMixin):
+    metrics_kind: str = "lock"
 
-    def empty(self, lock_name: str) -> bool:
-        if lock_name not in self.listener_dict:
-            return True
-        return self.listener_dict[lock_name].empty()
-
-    def start(self) -> None:
-        for proxy in self._proxies:
-            proxy.start()
-
-    def stop(self) -> None:
-        for proxy in self._proxies:
-            proxy.stop()
-
-    def get_random_proxy_name(self) -> str:
-        return self._proxies[random.randint(0, len(self._proxies) - 1)].name
-
-
-class BaseLock(object):
     def __init__(
             self,
             client: Redis,
             manager: Manager,
             name: str,
             timeout: int = 9,
+            blocking_timeout: Optional[float] = None,
     ) -> None:
+        """
+        timeout: the expiration time(second) of the lock, it is extended by the watch dog while the lock is held
+        blocking_timeout: the maximum time(second) to wait for the lock, None means wait forever
+        """
         self._name = name
+        self._key: str = manager.key_layout.get_lock_key(name)
         self._manager = manager
         self._client = client
         self._timeout = timeout
+        self._blocking_timeout = blocking_timeout
+        self._metrics: LockKindMetrics = manager.metrics.get_kind(self.metrics_kind)
+        self._retry_cnt: int = 0
+        self._acquired_time: float = 0.0
         self.register_scripts()
 
-    def register_scripts(self):
-        cls = self.__class__
-        client = self._client
-        if cls.lua_release is None:
-            cls.lua_release = client.register_script(cls.LUA_RELEASE_SCRIPT)
-        if cls.lua_extend is None:
-            cls.lua_extend = client.register_script(cls.LUA_EXTEND_SCRIPT)
-        if cls.lua_acquire is None:
-            cls.lua_acquire = client.register_script(cls.LUA_ACQUIRE_SCRIPT)
-
     async def __aenter__(self):
         if await self.acquire():
-            self._cancel_watch_dog()
-            self._watch_dog = asyncio.create_task(self._watch())
+            self._manager.watch_dog.add(self)
             return self
         raise LockError("Unable to acquire lock within the time specified")
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        self._cancel_watch_dog()
+        self._manager.watch_dog.remove(self)
         await self._release()
 
-    #########
-    # token #
-    #########
-    @staticmethod
-    def _new_token() -> str:
-        return str(uuid1().hex) + str(id(asyncio.current_task()))
-
-    @property
-    def _token(self) -> Optional[str]:
-        return getattr(self, "_token_var", None)
-
-    @_token.setter
-    def _token(self, token: Optional[str]) -> None:
-        self._token_var = token
-
     ###########
     # acquire #
     ###########
     lua_acquire = None
     # KEYS[1] - lock name
+    # KEYS[2] - proxy name
     # ARGV[1] - token
-    # ARGV[2] - proxy name
-    # ARGV[3] - milliseconds
+    # ARGV[2] - milliseconds
     # return nil if the locks time was reacquired, otherwise ttl(millisecond)
     LUA_ACQUIRE_SCRIPT = """
     if (redis.call('exists', KEYS[1]) == 0) then
         redis.call('hset', KEYS[1], ARGV[1], 0);
-        redis.call('pexpire', KEYS[1], ARGV[3]);
-        redis.call('hset', KEYS[1], 'proxy_name', ARGV[2]);
-        redis.call('del', ARGV[2]);
+        redis.call('pexpire', KEYS[1], ARGV[2]);
         return nil;
     end ;
     return redis.call('pttl', KEYS[1]);
@@ -152,28 +66,49 @@ class BaseLock(object):
     async def acquire(self) -> bool:
         if self._token:
             raise LockError("Lock already acquired")
-        token = self._new_token()
-        proxy_name = self._manager.get_random_proxy_name()
-        listener: Optional[asyncio.Future] = None
-        ttl: Optional[int] = self._timeout
-
-        while True:
-            if listener or self._manager.empty(self._name):
-                ttl = await self._do_acquire(token, proxy_name)
-                if not ttl:
-                    self._token = token
-                    if listener and not listener.done():
-                        listener.set_result(True)
-                    return True
-            if not listener or listener.done():
-                listener = self._manager.listen(self._name)
-            ttl = ttl / 3 if (ttl / 3) < 1 else 1
-            await asyncio.wait([listener], timeout=ttl)
-
-    async def _do_acquire(self, token: str, proxy_name: str) -> Optional[int]:
+        start_time: float = self._manager.time()
+        self._retry_cnt = 0
+        result: bool = await self._acquire_local_first()
+        self._acquired_time = self._manager.time()
+        self._metrics.on_acquire(self._acquired_time - start_time, self._retry_cnt, result)
+        return result
+
+    async def _acquire_local_first(self) -> bool:
+        deadline: Optional[float] = self._get_deadline()
+        if not self._manager.local_queue:
+            return await self._acquire(self._new_token(), deadline)
+        try:
+            token: Optional[str] = await self._manager.local_acquire(self._name, self._blocking_timeout)
+        except asyncio.TimeoutError:
+            return False
+        if token:
+            self._token = token
+            return True
+        try:
+            result: bool = await self._acquire(self._new_token(), deadline)
+        except BaseException:
+            self._manager.local_release(self._name)
+            raise
+        if not result:
+            self._manager.local_release(self._name)
+        return result
+
+    def _get_deadline(self) -> Optional[float]:
+        if self._blocking_timeout is None:
+            return None
+        return self._manager.time() + self._blocking_timeout
+
+    async def _acquire(self, token: str, deadline: Optional[float]) -> bool:
+        acquire_loop: AcquireLoop = await self._manager.acquire(self._key, lambda: self._do_acquire(token), deadline)
+        self._retry_cnt += acquire_loop.attempt
+        if acquire_loop.acquired:
+            self._token = token
+        return acquire_loop.acquired
+
+    async def _do_acquire(self, token: str) -> Optional[int]:
         timeout = int(self._timeout * 1000)
         return await self.lua_acquire(
-            keys=[self._name], args=[token, proxy_name, timeout], client=self._client
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token, timeout], client=self._client
         )
 
     ###########
@@ -181,19 +116,18 @@ class BaseLock(object):
     ###########
     lua_release = None
     # KEYS[1] - lock name
+    # KEYS[2] - proxy name
     # ARGV[1] - token
     # return 1 if the lock was released, otherwise 0
     LUA_RELEASE_SCRIPT = """
     if (redis.call('hexists', KEYS[1], ARGV[1]) == 0) then
         return nil;
     end ;
-    local proxy_name = redis.call('hget', KEYS[1], 'proxy_name')
-    
+
     redis.call('del', KEYS[1]);
-    redis.call('del', proxy_name);
-    redis.call('lpush', proxy_name, KEYS[1])
-    redis.call('expire', proxy_name, 3)
-    
+    redis.call('lpush', KEYS[2], KEYS[1])
+    redis.call('expire', KEYS[2], 3)
+
     return 1;
     """
 
@@ -201,8 +135,18 @@ class BaseLock(object):
         token = self._token
         if token is None:
             raise LockError("Cannot release an unlocked lock")
+        local_queue: bool = self._manager.local_queue
+        if local_queue and self._manager.local_handoff(self._name, token, self._do_release):
+            self._token = None
+            self._metrics.on_release(self._manager.time() - self._acquired_time, True)
+            return
 
-        result: Optional[int] = await self._do_release(token)
+        try:
+            result: Optional[int] = await self._do_release(token)
+        finally:
+            if local_queue:
+                self._manager.local_release(self._name)
+        self._metrics.on_release(self._manager.time() - self._acquired_time, result is not None)
         if result != 0:
             self._token = None
         if result is None:
@@ -210,13 +154,12 @@ class BaseLock(object):
 
     async def _do_release(self, token: str) -> Optional[int]:
         return await self.lua_release(
-            keys=[self._name], args=[token], client=self._client
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token], client=self._client
         )
 
     #############
     # watch dog #
     #############
-    _watch_dog: Optional[asyncio.Future]
     lua_extend = None
     # KEYS[1] - lock name
     # ARGV[1] - token
@@ -237,16 +180,11 @@ class BaseLock(object):
     return 1
     """
 
-    async def _watch(self) -> None:
-        while True:
-            if not await self._extend():
-                logging.error(f"Failed to extend the lock:{self._name}")
-            await asyncio.sleep(self._timeout / 3)
+    def _get_watch_interval(self) -> float:
+        return self._timeout / 3
 
-    def _cancel_watch_dog(self) -> None:
-        _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-        if _old_watch_dog and not _old_watch_dog.cancelled():
-            _old_watch_dog.cancel()
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(self.lua_extend, [self._key], [self._token, int(self._timeout * 1000)])]
 
     async def _extend(self) -> bool:
         token = self._token
@@ -256,16 +194,182 @@ class BaseLock(object):
             raise LockError("Cannot extend a lock with no timeout")
         timeout = int(self._timeout * 1000)
         return bool(await self.lua_extend(
-            keys=[self._name], args=[token, timeout], client=self._client,
+            keys=[self._key], args=[token, timeout], client=self._client,
         ))
 
-    def __del__(self) -> None:
+
+class MultiLock(BaseLock):
+    """
+    Lock many names at once, e.g. all SKUs of an order.
+
+    All names are tried in one pipelined round trip. Names are held in sorted order: after each try only the
+    acquired names before the first contended name are kept, the others are given back, and the lock waits for
+    the first contended name. Since every MultiLock walks the names in the same order, two batches can not deadlock.
+    Release gives back all the names with a single script call, or one call per slot on Redis Cluster.
+    """
+    metrics_kind = "multi_lock"
+
+    def __init__(
+            self,
+            client: Redis,
+            manager: Manager,
+            names: Sequence[str],
+            timeout: int = 9,
+            blocking_timeout: Optional[float] = None,
+    ) -> None:
+        self._names: List[str] = sorted(set(names))
+        if not self._names:
+            raise ValueError("names must not be empty")
+        super().__init__(
+            client, manager, ",".join(self._names), timeout=timeout, blocking_timeout=blocking_timeout
+        )
+        self._keys: List[str] = [manager.key_layout.get_lock_key(name) for name in self._names]
+
+    ###########
+    # acquire #
+    ###########
+    async def _acquire(self, token: str, deadline: Optional[float]) -> bool:
+        acquired_list: List[str] = []
+        pending_list: List[str] = self._keys
+        attempt: int = 0
+
         try:
-            _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-            if _old_watch_dog and not _old_watch_dog.cancelled():
-                _old_watch_dog.cancel()
-        except Exception:
-            pass
+            while True:
+                extend_result_list, ttl_list = await self._do_multi_acquire(acquired_list, pending_list, token)
+                if not all(extend_result_list):
+                    # some of the held names have expired, give back everything and start over
+                    await self._do_multi_release(acquired_list + [
+                        key for key, ttl in zip(pending_list, ttl_list) if not ttl
+                    ], token)
+                    acquired_list, pending_list = [], self._keys
+                    continue
+
+                index: int = next((i for i, ttl in enumerate(ttl_list) if ttl), -1)
+                if index == -1:
+                    self._token = token
+                    return True
+
+                acquired_list = acquired_list + pending_list[:index]
+                release_list: List[str] = [
+                    key for key, ttl in zip(pending_list[index + 1:], ttl_list[index + 1:]) if not ttl
+                ]
+                if release_list:
+                    await self._do_multi_release(release_list, token)
+                pending_list = pending_list[index:]
+
+                remaining: Optional[float] = None
+                if deadline is not None:
+                    remaining = deadline - self._manager.time()
+                    if remaining <= 0:
+                        return False
+                pttl: Optional[float] = ttl_list[index] / 1000 if ttl_list[index] > 0 else None
+                delay: float = self._manager.retry_policy.get_delay(attempt, pttl, remaining)
+                attempt += 1
+                self._retry_cnt += 1
+
+                listener: asyncio.Future = self._manager.listen(pending_list[0])
+                try:
+                    await asyncio.wait([listener], timeout=delay)
+                except BaseException:
+                    self._manager.give_up(pending_list[0], listener)
+                    raise
+                if not listener.done():
+                    listener.cancel()
+        finally:
+            if self._token != token and acquired_list:
+                await self._do_multi_release(acquired_list, token)
+
+    async def _do_multi_acquire(
+            self, acquired_list: List[str], pending_list: List[str], token: str
+    ) -> Tuple[List[int], List[Optional[int]]]:
+        """extend the held names and try the pending names in one round trip"""
+        timeout = int(self._timeout * 1000)
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key in acquired_list:
+                await self.lua_extend(keys=[key], args=[token, timeout], client=pipe)
+            for key in pending_list:
+                await self.lua_acquire(
+                    keys=[key, self._manager.get_proxy_name(key)], args=[token, timeout], client=pipe
+                )
+            result_list: list = await pipe.execute()
+        return result_list[:len(acquired_list)], result_list[len(acquired_list):]
+
+    ###########
+    # release #
+    ###########
+    lua_multi_release = None
+    # KEYS[1..n] - lock names
+    # KEYS[n+1..2n] - proxy name of each lock name
+    # ARGV[1] - token
+    # return 1 if all the locks were released, otherwise nil
+    #
+    # The names of the same proxy list are pushed to it with a single lpush
+    LUA_MULTI_RELEASE_SCRIPT = """
+    local result = 1;
+    local proxy_dict = {};
+    local proxy_list = {};
+    local n = #KEYS / 2;
+    for i = 1, n do
+        local key = KEYS[i];
+        if (redis.call('hexists', key, ARGV[1]) == 0) then
+            result = nil;
+        else
+            local proxy_name = KEYS[n + i];
+            redis.call('del', key);
+            if (proxy_dict[proxy_name] == nil) then
+                proxy_dict[proxy_name] = {};
+                table.insert(proxy_list, proxy_name);
+            end ;
+            table.insert(proxy_dict[proxy_name], key);
+        end ;
+    end ;
+    for _, proxy_name in ipairs(proxy_list) do
+        redis.call('lpush', proxy_name, unpack(proxy_dict[proxy_name]));
+        redis.call('expire', proxy_name, 3);
+    end ;
+    return result;
+    """
+
+    async def _do_release(self, token: str) -> Optional[int]:
+        return await self._do_multi_release(self._keys, token)
+
+    async def _do_multi_release(self, key_list: List[str], token: str) -> Optional[int]:
+        if not key_list:
+            return 1
+        # a script can only touch the keys of one slot
+        slot_dict: Dict[int, List[str]] = {}
+        for key in key_list:
+            slot_dict.setdefault(self._manager.key_layout.get_slot(key), []).append(key)
+        if len(slot_dict) == 1:
+            return await self.lua_multi_release(
+                keys=key_list + [self._manager.get_proxy_name(key) for key in key_list], args=[token],
+                client=self._client
+            )
+        async with self._client.pipeline(transaction=False) as pipe:
+            for slot_key_list in slot_dict.values():
+                await self.lua_multi_release(
+                    keys=slot_key_list + [self._manager.get_proxy_name(key) for key in slot_key_list], args=[token],
+                    client=pipe
+                )
+            result_list: list = await pipe.execute()
+        return 1 if all(result_list) else None
+
+    #############
+    # watch dog #
+    #############
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        timeout = int(self._timeout * 1000)
+        return [(self.lua_extend, [key], [self._token, timeout]) for key in self._keys]
+
+    async def _extend(self) -> bool:
+        token = self._token
+        if token is None:
+            raise LockError("Cannot extend an unlocked lock")
+        timeout = int(self._timeout * 1000)
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key in self._keys:
+                await self.lua_extend(keys=[key], args=[token, timeout], client=pipe)
+            return all(await pipe.execute())
 
 
 async def print_info(cnt: int) -> None:
@@ -279,11 +383,23 @@ async def demo(manager: Manager, client: Redis) -> None:
         await asyncio.sleep(1)
 
 
+async def multi_demo(manager: Manager, client: Redis, names: List[str]) -> None:
+    await print_info(0)
+    async with MultiLock(client, manager, names, timeout=1):
+        await print_info(1)
+        await asyncio.sleep(1)
+
+
 async def main():
     _redis = Redis()
     manager = Manager(client=_redis)
     manager.start()
     await asyncio.gather(*[demo(manager, _redis) for _ in range(3)])
+    await asyncio.gather(
+        multi_demo(manager, _redis, ["demo_1", "demo_2", "demo_3"]),
+        multi_demo(manager, _redis, ["demo_3", "demo_2"]),
+        multi_demo(manager, _redis, ["demo_2", "demo_4"]),
+    )
     manager.stop()
 
 
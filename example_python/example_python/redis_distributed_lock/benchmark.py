@@ -0,0 +1,270 @@
+"""
+Benchmarks for redis_distributed_lock, they need a local redis-server.
+
+    python -m example_python.redis_distributed_lock.benchmark
+"""
+import asyncio
+import multiprocessing
+import time
+from typing import Callable, Dict, List, Tuple
+
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
+
+from . import rw_lock
+from .base_lock import BaseLock
+from .core import PHASE_FAIR, READER_PREFERRING, WRITER_PREFERRING, Manager
+from .retry_policy import ExponentialBackoffPolicy, FixedRetryPolicy, RetryPolicy
+from .telemetry import LockMetrics
+
+
+def percentile(data: List[float], p: float) -> float:
+    if not data:
+        return 0.0
+    data = sorted(data)
+    return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+
+def print_latency(title: str, latency_list: List[float]) -> None:
+    print(
+        f"{title} cnt:{len(latency_list)}"
+        f" p50:{percentile(latency_list, 50) * 1000:.3f}ms"
+        f" p90:{percentile(latency_list, 90) * 1000:.3f}ms"
+        f" p99:{percentile(latency_list, 99) * 1000:.3f}ms"
+        f" max:{percentile(latency_list, 100) * 1000:.3f}ms"
+    )
+
+
+async def client_count(client: Redis) -> int:
+    return len(await client.client_list())
+
+
+async def command_count(client: Redis) -> int:
+    return int((await client.info("stats"))["total_commands_processed"])
+
+
+##########
+# wakeup #
+##########
+async def bench_wakeup(client: Redis, share_connection: bool, proxy_num: int = 8, waiter_num: int = 100) -> None:
+    """
+    Compare the connections held by the proxies and the time from a release to the next waiter acquiring the lock.
+    The waiters do not queue in the process(local_queue=False), so that every wakeup is notified by redis
+    through a proxy, as if the waiters were in different processes
+    """
+    before_cnt: int = await client_count(client)
+    manager = Manager(client=client, proxy_num=proxy_num, share_connection=share_connection, local_queue=False)
+    manager.start()
+    # let every proxy park in BLPOP
+    await asyncio.sleep(0.5)
+    proxy_conn_cnt: int = await client_count(client) - before_cnt
+
+    release_ts_list: List[float] = []
+    acquire_ts_list: List[float] = []
+
+    async def _run() -> None:
+        async with BaseLock(client, manager, "bench_wakeup", timeout=9):
+            acquire_ts_list.append(time.perf_counter())
+            release_ts_list.append(time.perf_counter())
+
+    await asyncio.gather(*[_run() for _ in range(waiter_num)])
+    manager.stop()
+    # acquire[n + 1] is always woken up by release[n]
+    latency_list: List[float] = [
+        acquire_ts - release_ts for release_ts, acquire_ts in zip(release_ts_list, acquire_ts_list[1:])
+    ]
+    print(f"share_connection:{share_connection} proxy_num:{proxy_num} proxy connections:{proxy_conn_cnt}")
+    print_latency("    wakeup latency", latency_list)
+
+
+##############
+# local lock #
+##############
+async def bench_local_lock(client: Redis, max_local_handoff: int, task_num: int = 200) -> None:
+    """Redis commands sent while many coroutines of one process contend for the same lock"""
+    manager = Manager(client=client, max_local_handoff=max_local_handoff)
+    manager.start()
+
+    async def _run() -> None:
+        async with BaseLock(client, manager, "bench_local_lock", timeout=9):
+            await asyncio.sleep(0.001)
+
+    before_cnt: int = await command_count(client)
+    s_t: float = time.perf_counter()
+    await asyncio.gather(*[_run() for _ in range(task_num)])
+    cost: float = time.perf_counter() - s_t
+    cmd_cnt: int = await command_count(client) - before_cnt
+    manager.stop()
+    print(
+        f"max_local_handoff:{max_local_handoff} tasks:{task_num} cost:{cost:.3f}s"
+        f" redis commands:{cmd_cnt} ops/sec:{cmd_cnt / cost:.0f}"
+    )
+
+
+##############
+# contention #
+##############
+RETRY_POLICY_DICT: Dict[str, Callable[[], RetryPolicy]] = {
+    "fixed": FixedRetryPolicy,
+    "exponential_backoff": ExponentialBackoffPolicy,
+}
+
+
+async def _contention(policy_name: str, task_num: int, loop_num: int) -> List[float]:
+    client = Redis()
+    manager = Manager(client=client, retry_policy=RETRY_POLICY_DICT[policy_name]())
+    manager.start()
+    latency_list: List[float] = []
+
+    async def _run() -> None:
+        for _ in range(loop_num):
+            s_t: float = time.perf_counter()
+            async with BaseLock(client, manager, "bench_contention", timeout=9):
+                latency_list.append(time.perf_counter() - s_t)
+
+    await asyncio.gather(*[_run() for _ in range(task_num)])
+    manager.stop()
+    return latency_list
+
+
+def _contention_worker(args: Tuple[str, int, int]) -> List[float]:
+    return asyncio.run(_contention(*args))
+
+
+def bench_contention(policy_name: str, process_num: int = 4, task_num: int = 50, loop_num: int = 5) -> None:
+    """N coroutines x M processes contend for the same lock"""
+    client = SyncRedis()
+    before_cnt: int = int(client.info("stats")["total_commands_processed"])
+    s_t: float = time.perf_counter()
+    with multiprocessing.Pool(process_num) as pool:
+        result_list: List[List[float]] = pool.map(
+            _contention_worker, [(policy_name, task_num, loop_num)] * process_num
+        )
+    cost: float = time.perf_counter() - s_t
+    cmd_cnt: int = int(client.info("stats")["total_commands_processed"]) - before_cnt
+    print(
+        f"policy:{policy_name} processes:{process_num} tasks:{task_num} loops:{loop_num}"
+        f" cost:{cost:.3f}s redis ops/sec:{cmd_cnt / cost:.0f}"
+    )
+    print_latency("    acquire latency", [latency for latency_list in result_list for latency in latency_list])
+
+
+#############
+# read lock #
+#############
+async def bench_read_lock(client: Redis, reader_num: int, loop_num: int = 200) -> None:
+    """The cost of extend and release of a read lock should not grow with the number of readers"""
+    manager = Manager(client=client)
+    manager.start()
+    reader_list: List[rw_lock.ReadLock] = []
+    for _ in range(reader_num):
+        reader: rw_lock.ReadLock = rw_lock.ReadLock(client, manager, "bench_read_lock", timeout=9)
+        await reader.acquire()
+        reader_list.append(reader)
+
+    extend_latency_list: List[float] = []
+    release_latency_list: List[float] = []
+    for _ in range(loop_num):
+        reader = rw_lock.ReadLock(client, manager, "bench_read_lock", timeout=9)
+        await reader.acquire()
+        s_t: float = time.perf_counter()
+        await reader._extend()
+        extend_latency_list.append(time.perf_counter() - s_t)
+        s_t = time.perf_counter()
+        await reader._release()
+        release_latency_list.append(time.perf_counter() - s_t)
+
+    for reader in reader_list:
+        await reader._release()
+    manager.stop()
+    print(f"readers:{reader_num}")
+    print_latency("    extend latency", extend_latency_list)
+    print_latency("    release latency", release_latency_list)
+
+
+#############
+# rw policy #
+#############
+async def bench_rw_policy(
+        client: Redis,
+        rw_policy: str,
+        reader_num: int = 40,
+        writer_num: int = 4,
+        duration: float = 3,
+        hold_time: float = 0.005,
+) -> None:
+    """Read bursts and writers contend for the same lock, report the throughput and latency of each side"""
+    manager = Manager(client=client, rw_policy=rw_policy)
+    manager.start()
+    latency_dict: Dict[str, List[float]] = {"read": [], "write": []}
+    end_ts: float = time.perf_counter() + duration
+
+    async def _run(lock_class: type) -> None:
+        while time.perf_counter() < end_ts:
+            s_t: float = time.perf_counter()
+            async with lock_class(client, manager, "bench_rw_policy", timeout=9):
+                latency_dict[lock_class.mode].append(time.perf_counter() - s_t)
+                await asyncio.sleep(hold_time)
+
+    s_t: float = time.perf_counter()
+    await asyncio.gather(
+        *[_run(rw_lock.ReadLock) for _ in range(reader_num)],
+        *[_run(rw_lock.WriteLock) for _ in range(writer_num)],
+    )
+    cost: float = time.perf_counter() - s_t
+    manager.stop()
+    print(f"rw_policy:{rw_policy} readers:{reader_num} writers:{writer_num} cost:{cost:.3f}s")
+    for mode, latency_list in latency_dict.items():
+        print_latency(f"    {mode} ops/sec:{len(latency_list) / cost:.0f} acquire latency", latency_list)
+
+
+#############
+# telemetry #
+#############
+def bench_telemetry(loop_num: int = 1000000) -> None:
+    """
+    The overhead of the metrics hooks of one acquire and release, it should stay below 1us.
+    The cost of the loop that builds the arguments is measured alone and subtracted
+    """
+    kind_metrics = LockMetrics().get_kind("lock")
+    s_t: float = time.perf_counter()
+    for i in range(loop_num):
+        (i % 1000) / 100000, i % 3
+    loop_cost: float = time.perf_counter() - s_t
+    s_t = time.perf_counter()
+    for i in range(loop_num):
+        kind_metrics.on_acquire((i % 1000) / 100000, i % 3, True)
+    acquire_cost: float = time.perf_counter() - s_t - loop_cost
+    s_t = time.perf_counter()
+    for i in range(loop_num):
+        kind_metrics.on_release((i % 1000) / 10000, True)
+    release_cost: float = time.perf_counter() - s_t - loop_cost
+    print(
+        f"on_acquire:{acquire_cost / loop_num * 1000000:.3f}us"
+        f" on_release:{release_cost / loop_num * 1000000:.3f}us"
+    )
+
+
+async def main() -> None:
+    client = Redis()
+    print("-----wakeup-----")
+    await bench_wakeup(client, share_connection=False)
+    await bench_wakeup(client, share_connection=True)
+    print("-----local lock-----")
+    await bench_local_lock(client, max_local_handoff=0)
+    await bench_local_lock(client, max_local_handoff=16)
+    print("-----read lock-----")
+    for reader_num in (10, 100, 1000):
+        await bench_read_lock(client, reader_num)
+    print("-----rw policy-----")
+    for rw_policy in (READER_PREFERRING, WRITER_PREFERRING, PHASE_FAIR):
+        await bench_rw_policy(client, rw_policy)
+
+
+if __name__ == '__main__':
+    print("-----telemetry-----")
+    bench_telemetry()
+    asyncio.run(main())
+    print("-----contention-----")
+    for _policy_name in RETRY_POLICY_DICT:
+        bench_contention(_policy_name)
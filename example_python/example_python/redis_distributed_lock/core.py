@@ -0,0 +1,556 @@
+"""
+The lock engine shared by every lock kind of this package.
+
+A process runs one Manager, the proxies BLPOP the release notifications of all the locks over the same
+connections, and the waiters of every lock kind are queued in the same waiter table.
+"""
+import asyncio
+import itertools
+import logging
+from binascii import crc32
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional, List, Tuple
+from uuid import uuid1
+
+from redis.asyncio import Redis
+from redis.crc import REDIS_CLUSTER_HASH_SLOTS, key_slot
+
+from .retry_policy import ExponentialBackoffPolicy, RetryPolicy
+from .telemetry import LockMetrics
+from .watch_dog import WatchDogScheduler
+
+# Fairness policies between the readers and the other waiters of a lock name,
+# every client of the same lock name must use the same policy
+# readers join a read lock even if writers are waiting, writers may starve
+READER_PREFERRING: str = "reader"
+# a waiting writer blocks new readers and is woken up before the readers
+WRITER_PREFERRING: str = "writer"
+# read phases and write phases alternate: the readers that waited during a write phase are all admitted
+# before the next writer, and a waiting writer blocks the readers that arrive after the read phase
+PHASE_FAIR: str = "phase"
+
+# the waiters in read mode share the lock and are woken up together, a waiter in any other mode is exclusive
+READ_MODE: str = "read"
+
+
+class LuaScriptMixin(object):
+    """
+    Register every `LUA_{NAME}_SCRIPT` attribute of the lock class as `lua_{name}`,
+    once per class, with the client of the first lock created.
+    A subclass that overrides a script gets its own registration.
+    """
+    _client: Redis
+
+    def register_scripts(self) -> None:
+        cls = self.__class__
+        if cls.__dict__.get("_script_registered"):
+            return
+        for attr in dir(cls):
+            if not (attr.startswith("LUA_") and attr.endswith("_SCRIPT")):
+                continue
+            script: Optional[str] = getattr(cls, attr)
+            if script is not None:
+                setattr(cls, "lua_" + attr[4:-7].lower(), self._client.register_script(script))
+        cls._script_registered = True
+
+
+class TokenMixin(object):
+    """The token of the lock held by this object, it is unique per acquire and task"""
+
+    @staticmethod
+    def _new_token() -> str:
+        return str(uuid1().hex) + str(id(asyncio.current_task()))
+
+    @property
+    def _token(self) -> Optional[str]:
+        return getattr(self, "_token_var", None)
+
+    @_token.setter
+    def _token(self, token: Optional[str]) -> None:
+        self._token_var = token
+
+
+class AcquireLoop(object):
+    """
+    The wait and retry loop of an acquire, shared by all the lock kinds.
+
+    It only makes the decisions, the caller runs the acquire script and waits for the listener, so the same
+    loop serves the asyncio locks(Manager.acquire) and the sync locks(SyncManager.acquire):
+
+        try:
+            while True:
+                if acquire_loop.should_try() and acquire_loop.on_result(do_acquire()):
+                    return True
+                delay = acquire_loop.get_delay()
+                if delay is None:
+                    return False
+                wait(acquire_loop.listener, delay)
+        finally:
+            acquire_loop.close()
+    """
+
+    def __init__(self, manager: "Manager", lock_name: str, lock_mode: str, deadline: Optional[float]) -> None:
+        self._manager = manager
+        self._lock_name = lock_name
+        self._lock_mode = lock_mode
+        self._deadline = deadline
+        self._pttl: Optional[float] = None
+        self.listener: Optional[Any] = None
+        self.acquired: bool = False
+        # how many times the waiter has slept
+        self.attempt: int = 0
+
+    def should_try(self) -> bool:
+        """the waiters of this process queue in the waiter table, only the first or a woken waiter tries redis"""
+        return self.listener is not None or self._manager.empty(self._lock_name)
+
+    def on_result(self, ttl: Optional[int]) -> bool:
+        """ttl is the result of the acquire script, None if the lock was acquired, otherwise its ttl(millisecond)"""
+        if ttl is None:
+            self.acquired = True
+            if self.listener is not None and not self.listener.done():
+                # leave the waiter table
+                self._manager.give_up(self._lock_name, self.listener)
+            return True
+        self._pttl = ttl / 1000 if ttl > 0 else None
+        return False
+
+    def get_delay(self) -> Optional[float]:
+        """how long(second) to wait for a wakeup before the next try, None if the deadline has passed"""
+        remaining: Optional[float] = None
+        if self._deadline is not None:
+            remaining = self._deadline - self._manager.time()
+            if remaining <= 0:
+                return None
+        if self.listener is None or self.listener.done():
+            self.listener = self._manager.listen(self._lock_name, self._lock_mode)
+        delay: float = self._manager.retry_policy.get_delay(self.attempt, self._pttl, remaining)
+        self.attempt += 1
+        return delay
+
+    def close(self) -> None:
+        """the waiter that did not get the lock(failed, timed out or cancelled) passes on the wakeup it got"""
+        if not self.acquired:
+            self._manager.give_up(self._lock_name, self.listener)
+
+
+class KeyLayout(object):
+    """
+    Where the keys of the locks live.
+
+    Every key a script touches is passed in KEYS: the lock key, its sub keys and the proxy list
+    that the release is notified to. The proxy list of a lock key is always the same,
+    so that a holder can release the lock without reading where it was acquired.
+
+    A proxy list is shared by the locks and semaphores of many names, so the scripts only push to it
+    and never delete it, otherwise the pending notifications of the other names would be lost.
+    """
+
+    def __init__(self, proxy_names: List[str]) -> None:
+        self.proxy_names: List[str] = proxy_names
+
+    def get_lock_key(self, name: str) -> str:
+        return name
+
+    def get_sub_key(self, lock_key: str, suffix: str) -> str:
+        return f"{lock_key}:{suffix}"
+
+    def get_slot(self, key: str) -> int:
+        """keys of different slots can not be passed to the same script"""
+        return 0
+
+    def get_proxy_name(self, lock_key: str) -> str:
+        return self.proxy_names[crc32(lock_key.encode()) % len(self.proxy_names)]
+
+
+class ClusterKeyLayout(KeyLayout):
+    """
+    The key layout of Redis Cluster.
+
+    The keys of a lock share the hash tag `{name}`, so they are all in the slot of the lock name,
+    e.g. `{name}`, `{name}:readers`. The release of a lock is notified to the proxy list of its slot,
+    which carries a hash tag of the same slot, so a script only touches the keys of one slot
+    and the locks are spread over the cluster nodes like any other key.
+    """
+
+    def __init__(self) -> None:
+        super().__init__([])
+        # a hash tag of every slot, found lazily by hashing "0", "1", "2"...
+        self._slot_tag_list: List[Optional[str]] = [None] * REDIS_CLUSTER_HASH_SLOTS
+        self._tag_iter: Iterator[int] = itertools.count()
+
+    def get_lock_key(self, name: str) -> str:
+        return f"{{{name}}}"
+
+    def get_slot(self, key: str) -> int:
+        return key_slot(key.encode())
+
+    def _get_slot_tag(self, slot: int) -> str:
+        while self._slot_tag_list[slot] is None:
+            tag: str = str(next(self._tag_iter))
+            tag_slot: int = key_slot(tag.encode())
+            if self._slot_tag_list[tag_slot] is None:
+                self._slot_tag_list[tag_slot] = tag
+        return self._slot_tag_list[slot]
+
+    def get_proxy_name(self, lock_key: str) -> str:
+        return f"{{{self._get_slot_tag(self.get_slot(lock_key))}}}:proxy"
+
+
+class Proxy(object):
+    def __init__(
+            self,
+            name: str,
+            manager: "Manager",
+            listen_names: Optional[List[str]] = None,
+            stop_when_idle: bool = False,
+    ) -> None:
+        self.name = name
+        # A proxy can BLPOP several lists over a single connection,
+        # by default it only listens to the list with the same name as itself
+        self.listen_names: List[str] = listen_names or [name]
+        # stop once nobody of this process waits for a lock notified to this proxy
+        self.stop_when_idle = stop_when_idle
+        self._manager = manager
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        while True:
+            result: Optional[List[bytes]] = await self._manager.client.blpop(
+                self.listen_names, self._manager.timeout
+            )
+            if result is None:
+                if self.stop_when_idle and self._manager.on_proxy_idle(self):
+                    break
+                continue
+            self._manager.wakeup(result[1].decode())
+
+    def start(self) -> None:
+        if self._task:
+            raise RuntimeError(f"{self.name} already started")
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if not self._task or self._task.done():
+            raise RuntimeError(f"{self.name} not started")
+        self._task.cancel()
+
+
+class LocalSlot(object):
+    """The in-process state of a lock name"""
+
+    def __init__(self) -> None:
+        self.lock: asyncio.Lock = asyncio.Lock()
+        # holder and waiters of this process
+        self.ref_cnt: int = 0
+        # the redis token handed over to the next local waiter
+        self.token: Optional[str] = None
+        self.release_callback: Optional[Callable[[str], Awaitable[Any]]] = None
+        # number of consecutive handovers without releasing the lock in redis
+        self.handoff_cnt: int = 0
+
+
+class WaiterQueue(object):
+    """The waiters of a lock name in this process, in arrival order"""
+
+    def __init__(self) -> None:
+        self.waiter_deque: Deque[Tuple[str, asyncio.Future]] = deque()
+        # number of readers in waiter_deque, while it is 0 a wakeup only looks at the head of the queue
+        self.reader_cnt: int = 0
+        # PHASE_FAIR: the mode of the waiters woken up last time
+        self.last_wakeup_mode: str = ""
+
+    def append(self, lock_mode: str, f: asyncio.Future) -> None:
+        self.waiter_deque.append((lock_mode, f))
+        if lock_mode == READ_MODE:
+            self.reader_cnt += 1
+
+    def pop_done(self) -> None:
+        """drop the waiters at the head of the queue that are no longer waiting"""
+        while self.waiter_deque and self.waiter_deque[0][1].done():
+            lock_mode, _ = self.waiter_deque.popleft()
+            if lock_mode == READ_MODE:
+                self.reader_cnt -= 1
+
+    def compact(self) -> None:
+        self.waiter_deque = deque((lock_mode, f) for lock_mode, f in self.waiter_deque if not f.done())
+        self.reader_cnt = sum(1 for lock_mode, _ in self.waiter_deque if lock_mode == READ_MODE)
+
+
+class Manager(object):
+    def __init__(
+            self,
+            client: Redis,
+            proxy_num: int = 8,
+            timeout: int = 5,
+            share_connection: bool = False,
+            max_local_handoff: int = 0,
+            local_queue: bool = True,
+            retry_policy: Optional[RetryPolicy] = None,
+            rw_policy: str = WRITER_PREFERRING,
+            phase_window: float = 0.1,
+            cluster: bool = False,
+            metrics: Optional[LockMetrics] = None,
+    ):
+        """
+        client: redis client
+        proxy_num: number of proxy lists that the release notifications are spread over
+        timeout: BLPOP timeout(second) of each proxy
+        share_connection: if True, a single proxy listens to all proxy lists with one multi-key BLPOP,
+            so that the process only holds one blocking connection instead of `proxy_num` connections
+        max_local_handoff: how many times in a row a released lock may be handed over to a waiter of the same
+            process without releasing it in redis, 0 means the lock is always released in redis
+        local_queue: if True, only one waiter of each lock name in this process competes in redis and the others
+            queue in the process(see local_acquire), if False every waiter waits for the release notified by redis,
+            e.g. to measure the proxies, max_local_handoff is ignored then
+        retry_policy: how long the waiters sleep between two acquire attempts if no wakeup arrives,
+            default is exponential backoff with full jitter
+        rw_policy: fairness policy between the readers and the writers, see PHASE_FAIR etc.
+        phase_window: in PHASE_FAIR, how long(second) a read phase stays open for the waiting readers to join
+        cluster: use ClusterKeyLayout for Redis Cluster, the client should be a RedisCluster.
+            The proxy lists are per slot, the proxy of a slot is started when a waiter of the slot comes
+            and stops after a BLPOP timeout without waiters, proxy_num and share_connection are ignored
+        metrics: where the locks of this manager record their metrics, export it with a MetricsSink
+        """
+        if rw_policy not in (READER_PREFERRING, WRITER_PREFERRING, PHASE_FAIR):
+            raise ValueError(f"Not support rw_policy:{rw_policy}")
+        self._proxy_num = proxy_num
+        self._proxy_names: List[str] = [str(i) for i in range(proxy_num)]
+        self._proxies: List[Proxy] = []
+        # cluster: proxy name -> the running proxy of the slot
+        self._slot_proxy_dict: Dict[str, Proxy] = {}
+        self._started: bool = False
+        self.cluster = cluster
+        if cluster:
+            self.key_layout: KeyLayout = ClusterKeyLayout()
+        else:
+            self.key_layout = KeyLayout(self._proxy_names)
+            if share_connection:
+                self._proxies = [Proxy("shared", self, self._proxy_names)]
+            else:
+                self._proxies = [Proxy(name, self) for name in self._proxy_names]
+
+        self.client = client
+        self.timeout = timeout
+        self.listener_dict: Dict[str, WaiterQueue] = {}
+        self.max_local_handoff = max_local_handoff
+        self.local_queue = local_queue
+        self.retry_policy: RetryPolicy = retry_policy or ExponentialBackoffPolicy()
+        self.rw_policy = rw_policy
+        self.phase_window = phase_window
+        # renew all the locks held by this process
+        self.watch_dog: WatchDogScheduler = self._new_watch_dog()
+        self.local_slot_dict: Dict[str, LocalSlot] = {}
+        self.metrics: LockMetrics = metrics or LockMetrics()
+        self.metrics.register_gauge("watch_dog_held", lambda: self.watch_dog.held_cnt)
+        self.metrics.register_counter("watch_dog_renewed_total", lambda: self.watch_dog.renewed_cnt)
+        self.metrics.register_counter("watch_dog_failed_total", lambda: self.watch_dog.failed_cnt)
+
+    def _new_watch_dog(self) -> WatchDogScheduler:
+        return WatchDogScheduler(self.client)
+
+    def time(self) -> float:
+        """
+        The clock(second) of the locks of this manager, it is the clock of the event loop,
+        so the locks follow the virtual clock of a simulated loop(see simulator.py)
+        """
+        return asyncio.get_running_loop().time()
+
+    ##############
+    # local lock #
+    ##############
+    async def local_acquire(self, lock_name: str, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Only one waiter of each lock name in this process competes in redis, the others queue here.
+        return the token if the lock was handed over by the previous local holder,
+        raise asyncio.TimeoutError if the local lock can not be acquired within timeout(second)
+        """
+        slot: Optional[LocalSlot] = self.local_slot_dict.get(lock_name)
+        if slot is None:
+            slot = self.local_slot_dict[lock_name] = LocalSlot()
+        slot.ref_cnt += 1
+        try:
+            await asyncio.wait_for(slot.lock.acquire(), timeout)
+        except BaseException:
+            self._unref_local_slot(lock_name, slot)
+            raise
+        token, slot.token = slot.token, None
+        return token
+
+    def local_handoff(self, lock_name: str, token: str, release_callback: Callable[[str], Awaitable[Any]]) -> bool:
+        """
+        Try to hand the lock over to the next local waiter, return True if the lock must not be released in redis.
+        release_callback is used to release the token in redis if the waiter is gone before it takes the token
+        """
+        slot: LocalSlot = self.local_slot_dict[lock_name]
+        if slot.ref_cnt <= 1 or slot.handoff_cnt >= self.max_local_handoff:
+            slot.handoff_cnt = 0
+            return False
+        slot.handoff_cnt += 1
+        self.metrics.local_handoff_cnt += 1
+        slot.token = token
+        slot.release_callback = release_callback
+        slot.lock.release()
+        self._unref_local_slot(lock_name, slot)
+        return True
+
+    def local_release(self, lock_name: str) -> None:
+        slot: LocalSlot = self.local_slot_dict[lock_name]
+        slot.lock.release()
+        self._unref_local_slot(lock_name, slot)
+
+    def _unref_local_slot(self, lock_name: str, slot: LocalSlot) -> None:
+        slot.ref_cnt -= 1
+        if slot.ref_cnt > 0:
+            return
+        self.local_slot_dict.pop(lock_name, None)
+        if slot.token and slot.release_callback:
+            # all local waiters were cancelled after the handover
+            asyncio.create_task(slot.release_callback(slot.token))
+
+    ###########
+    # acquire #
+    ###########
+    async def acquire(
+            self,
+            lock_name: str,
+            do_acquire: Callable[[], Awaitable[Optional[int]]],
+            deadline: Optional[float],
+            lock_mode: str = "",
+    ) -> AcquireLoop:
+        """
+        Run do_acquire until it returns None(acquired) or the deadline passes, and wait for a wakeup
+        between two tries, see AcquireLoop. Check `acquired` and `attempt` of the returned loop
+        """
+        acquire_loop: AcquireLoop = AcquireLoop(self, lock_name, lock_mode, deadline)
+        try:
+            while True:
+                if acquire_loop.should_try() and acquire_loop.on_result(await do_acquire()):
+                    return acquire_loop
+                delay: Optional[float] = acquire_loop.get_delay()
+                if delay is None:
+                    return acquire_loop
+                await asyncio.wait([acquire_loop.listener], timeout=delay)
+        finally:
+            acquire_loop.close()
+
+    ############
+    # listener #
+    ############
+    def listen(self, lock_name: str, lock_mode: str = "") -> asyncio.Future:
+        """
+        lock_mode: READ_MODE for the waiters that share the lock,
+            any other mode(e.g. "write") waits for the lock exclusively
+        """
+        if lock_name not in self.listener_dict:
+            self.listener_dict[lock_name] = WaiterQueue()
+            if self.cluster and self._started:
+                self._start_slot_proxy(self.key_layout.get_proxy_name(lock_name))
+
+        f = asyncio.Future()
+        self.listener_dict[lock_name].append(lock_mode, f)
+        return f
+
+    def wakeup(self, lock_name: str) -> None:
+        """
+        Wake up the waiters of the lock after it was released.
+        Without readers only the first waiter that is still waiting is woken up,
+        otherwise either the first exclusive waiter or all the readers, according to rw_policy
+        """
+        waiter_queue: Optional[WaiterQueue] = self.listener_dict.get(lock_name)
+        if waiter_queue is None:
+            self.metrics.wakeup_orphan_cnt += 1
+            logging.error(f"{lock_name} not in listener_dict")
+            return
+
+        waiter_queue.pop_done()
+        if not waiter_queue.waiter_deque:
+            self.listener_dict.pop(lock_name, None)
+            self.metrics.wakeup_missed_cnt += 1
+            return
+        if not waiter_queue.reader_cnt:
+            _, f = waiter_queue.waiter_deque.popleft()
+            f.set_result(True)
+            self.metrics.wakeup_delivered_cnt += 1
+            return
+
+        reader_list: List[asyncio.Future] = [
+            f for lock_mode, f in waiter_queue.waiter_deque if lock_mode == READ_MODE and not f.done()
+        ]
+        writer: Optional[asyncio.Future] = next(
+            (f for lock_mode, f in waiter_queue.waiter_deque if lock_mode != READ_MODE and not f.done()), None
+        )
+        if self.rw_policy == READER_PREFERRING:
+            wakeup_read = bool(reader_list)
+        elif self.rw_policy == WRITER_PREFERRING:
+            wakeup_read = writer is None
+        else:
+            wakeup_read = writer is None or (bool(reader_list) and waiter_queue.last_wakeup_mode != READ_MODE)
+
+        if wakeup_read:
+            for f in reader_list:
+                f.set_result(True)
+            self.metrics.wakeup_delivered_cnt += len(reader_list)
+            waiter_queue.last_wakeup_mode = READ_MODE
+        else:
+            writer.set_result(True)
+            self.metrics.wakeup_delivered_cnt += 1
+            waiter_queue.last_wakeup_mode = "write"
+        waiter_queue.compact()
+
+    def give_up(self, lock_name: str, listener: Optional[asyncio.Future]) -> None:
+        """the waiter stops waiting, pass the wakeup it may have received to the next waiter"""
+        if listener is None:
+            return
+        if not listener.done():
+            listener.cancel()
+            waiter_queue: Optional[WaiterQueue] = self.listener_dict.get(lock_name)
+            if waiter_queue:
+                waiter_queue.pop_done()
+                if not waiter_queue.waiter_deque:
+                    self.listener_dict.pop(lock_name, None)
+        elif not listener.cancelled() and not self.empty(lock_name):
+            self.wakeup(lock_name)
+
+    def empty(self, lock_name: str) -> bool:
+        waiter_queue: Optional[WaiterQueue] = self.listener_dict.get(lock_name)
+        return waiter_queue is None or not waiter_queue.waiter_deque
+
+    #########
+    # proxy #
+    #########
+    def get_proxy_name(self, lock_key: str) -> str:
+        """the proxy list that the release of the lock is notified to"""
+        return self.key_layout.get_proxy_name(lock_key)
+
+    def _start_slot_proxy(self, proxy_name: str) -> None:
+        if proxy_name in self._slot_proxy_dict:
+            return
+        proxy: Proxy = Proxy(proxy_name, self, stop_when_idle=True)
+        self._slot_proxy_dict[proxy_name] = proxy
+        proxy.start()
+
+    def on_proxy_idle(self, proxy: Proxy) -> bool:
+        """return True if the proxy of a slot can stop, since no waiter of this process listens to it"""
+        for lock_name in self.listener_dict:
+            if self.key_layout.get_proxy_name(lock_name) == proxy.name:
+                return False
+        self._slot_proxy_dict.pop(proxy.name, None)
+        return True
+
+    def start(self) -> None:
+        self._started = True
+        for proxy in self._proxies:
+            proxy.start()
+        for lock_name in self.listener_dict:
+            self._start_slot_proxy(self.key_layout.get_proxy_name(lock_name))
+        self.watch_dog.start()
+
+    def stop(self) -> None:
+        self._started = False
+        for proxy in self._proxies:
+            proxy.stop()
+        for proxy in self._slot_proxy_dict.values():
+            proxy.stop()
+        self._slot_proxy_dict.clear()
+        self.watch_dog.stop()
@@ -0,0 +1,252 @@
+import asyncio
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.asyncio.lock import LockError, LockNotOwnedError
+
+from .core import AcquireLoop, LuaScriptMixin, Manager
+from .telemetry import LockKindMetrics
+
+
+class LeaseLock(LuaScriptMixin):
+    """
+    A lock held for a lease instead of being kept alive by the watch dog.
+
+    Every acquire gets a fencing token from a counter incremented inside the acquire script, so the tokens of
+    a lock name only grow. A holder passes its token along with its writes, and the downstream rejects a token
+    smaller than the largest one it has seen(see check_fencing_token), so a holder whose lease expired while it
+    was paused can not overwrite the work of the next holder.
+
+    The lease is renewed optimistically: the lock remembers when the lease ends locally, `ensure` only touches
+    redis when less than renew_ratio of the lease is left, so a short critical section costs an acquire and a
+    release, with neither a watch dog task nor a timer.
+
+    data struct
+    {lock name}: {"token": {fencing token}}
+    {lock name}:fencing: {the last fencing token}, never expires
+    """
+    metrics_kind: str = "lease_lock"
+
+    def __init__(
+            self,
+            client: Redis,
+            manager: Manager,
+            name: str,
+            lease_time: float = 3,
+            blocking_timeout: Optional[float] = None,
+            renew_ratio: float = 0.5,
+    ) -> None:
+        """
+        lease_time: how long(second) the lock is held after an acquire or a renewal
+        blocking_timeout: the maximum time(second) to wait for the lock, None means wait forever
+        renew_ratio: `ensure` renews the lease once less than lease_time * renew_ratio is left
+        """
+        self._name = name
+        self._key: str = manager.key_layout.get_lock_key(name)
+        self._fencing_key: str = manager.key_layout.get_sub_key(self._key, "fencing")
+        self._manager = manager
+        self._client = client
+        self._lease_time = lease_time
+        self._blocking_timeout = blocking_timeout
+        self._renew_ratio = renew_ratio
+        self._metrics: LockKindMetrics = manager.metrics.get_kind(self.metrics_kind)
+        self._acquired_time: float = 0.0
+        # the local end of the lease, it is computed from the time the request was sent,
+        # so it never ends later than the lease in redis(clock drift aside)
+        self._lease_deadline: float = 0.0
+        self.fencing_token: Optional[int] = None
+        self.register_scripts()
+
+    async def __aenter__(self):
+        if await self.acquire():
+            return self
+        raise LockError("Unable to acquire lock within the time specified")
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.release()
+
+    #########
+    # lease #
+    #########
+    def remaining(self) -> float:
+        """the remaining time(second) of the lease, checked locally"""
+        if self.fencing_token is None:
+            return 0.0
+        return max(self._lease_deadline - self._manager.time(), 0.0)
+
+    def is_valid(self) -> bool:
+        return self.remaining() > 0
+
+    ###########
+    # acquire #
+    ###########
+    lua_acquire = None
+    # KEYS[1] - lock name
+    # KEYS[2] - fencing counter name
+    # KEYS[3] - proxy name
+    # ARGV[1] - milliseconds
+    # return {fencing token, 0} if the lock was acquired, otherwise {0, ttl(millisecond)}
+    LUA_ACQUIRE_SCRIPT = """
+    if (redis.call('exists', KEYS[1]) == 0) then
+        local token = redis.call('incr', KEYS[2]);
+        redis.call('hset', KEYS[1], 'token', token);
+        redis.call('pexpire', KEYS[1], ARGV[1]);
+        return {token, 0};
+    end ;
+    return {0, redis.call('pttl', KEYS[1])};
+    """
+
+    async def acquire(self) -> bool:
+        if self.fencing_token is not None:
+            raise LockError("Lock already acquired")
+        start_time: float = self._manager.time()
+        deadline: Optional[float] = None
+        if self._blocking_timeout is not None:
+            deadline = start_time + self._blocking_timeout
+        acquire_loop: AcquireLoop = await self._manager.acquire(self._key, self._do_acquire, deadline)
+        self._acquired_time = self._manager.time()
+        self._metrics.on_acquire(self._acquired_time - start_time, acquire_loop.attempt, acquire_loop.acquired)
+        return acquire_loop.acquired
+
+    async def _do_acquire(self) -> Optional[int]:
+        """return None if the lock was acquired, otherwise its ttl(millisecond)"""
+        send_time: float = self._manager.time()
+        token, ttl = await self.lua_acquire(
+            keys=[self._key, self._fencing_key, self._manager.get_proxy_name(self._key)],
+            args=[int(self._lease_time * 1000)],
+            client=self._client,
+        )
+        if not token:
+            return ttl
+        self.fencing_token = token
+        self._lease_deadline = send_time + self._lease_time
+        return None
+
+    #########
+    # renew #
+    #########
+    lua_renew = None
+    # KEYS[1] - lock name
+    # ARGV[1] - fencing token
+    # ARGV[2] - milliseconds
+    # return 1 if the lease was renewed, otherwise 0
+    LUA_RENEW_SCRIPT = """
+    if (redis.call('hget', KEYS[1], 'token') ~= ARGV[1]) then
+        return 0;
+    end ;
+    redis.call('pexpire', KEYS[1], ARGV[2]);
+    return 1;
+    """
+
+    async def renew(self) -> bool:
+        """renew the lease now, return False if the lease was already lost"""
+        token: Optional[int] = self.fencing_token
+        if token is None:
+            raise LockError("Cannot renew an unlocked lock")
+        send_time: float = self._manager.time()
+        result: int = await self.lua_renew(
+            keys=[self._key], args=[token, int(self._lease_time * 1000)], client=self._client
+        )
+        if not result:
+            self._lease_deadline = 0.0
+            return False
+        self._lease_deadline = send_time + self._lease_time
+        return True
+
+    async def ensure(self) -> bool:
+        """
+        Make sure the lease is still held before doing the next piece of work,
+        only call redis if the lease is about to end
+        """
+        remaining: float = self.remaining()
+        if remaining <= 0:
+            return False
+        if remaining > self._lease_time * self._renew_ratio:
+            return True
+        return await self.renew()
+
+    ###########
+    # release #
+    ###########
+    lua_release = None
+    # KEYS[1] - lock name
+    # KEYS[2] - proxy name
+    # ARGV[1] - fencing token
+    # return 1 if the lock was released, otherwise nil
+    LUA_RELEASE_SCRIPT = """
+    if (redis.call('hget', KEYS[1], 'token') ~= ARGV[1]) then
+        return nil;
+    end ;
+
+    redis.call('del', KEYS[1]);
+    redis.call('lpush', KEYS[2], KEYS[1])
+    redis.call('expire', KEYS[2], 3)
+
+    return 1;
+    """
+
+    async def release(self) -> None:
+        token: Optional[int] = self.fencing_token
+        if token is None:
+            raise LockError("Cannot release an unlocked lock")
+        self.fencing_token = None
+        self._lease_deadline = 0.0
+        result: Optional[int] = await self.lua_release(
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token], client=self._client
+        )
+        self._metrics.on_release(self._manager.time() - self._acquired_time, result is not None)
+        if result is None:
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+    ###########
+    # fencing #
+    ###########
+    lua_check_fencing_token = None
+    # KEYS[1] - the fencing key of the resource, holds the largest fencing token seen by the resource
+    # ARGV[1] - fencing token
+    # return 1 if the token is not stale, otherwise 0
+    LUA_CHECK_FENCING_TOKEN_SCRIPT = """
+    local last_token = tonumber(redis.call('get', KEYS[1]) or '0');
+    if (tonumber(ARGV[1]) < last_token) then
+        return 0;
+    end ;
+    redis.call('set', KEYS[1], ARGV[1]);
+    return 1;
+    """
+
+    async def check_fencing_token(self, resource_name: str) -> bool:
+        """
+        Record the token of this lock on a resource kept in redis and tell whether the token is stale,
+        a write guarded by a stale token must be dropped.
+        A downstream outside redis does the same check with `fencing_token` and its own storage.
+        """
+        token: Optional[int] = self.fencing_token
+        if token is None:
+            raise LockError("Cannot check the fencing token of an unlocked lock")
+        return bool(await self.lua_check_fencing_token(
+            keys=[f"{resource_name}:fencing_token"], args=[token], client=self._client
+        ))
+
+
+async def demo(manager: Manager, client: Redis) -> None:
+    async with LeaseLock(client, manager, "demo", lease_time=1) as lock:
+        print(f"Task:{id(asyncio.current_task())}, fencing token:{lock.fencing_token}")
+        for _ in range(3):
+            await asyncio.sleep(0.3)
+            if not await lock.ensure():
+                print("lease lost")
+                return
+        if await lock.check_fencing_token("demo_resource"):
+            print(f"write with fencing token:{lock.fencing_token}")
+
+
+async def main():
+    _redis = Redis()
+    manager = Manager(client=_redis)
+    manager.start()
+    await asyncio.gather(*[demo(manager, _redis) for _ in range(3)])
+    manager.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+import random
+from typing import Optional
+
+
+class RetryPolicy(object):
+    """Decide how long a waiter sleeps before it tries to acquire the lock in redis again.
+
+    A waiter is normally woken up by the proxy when the lock is released, the retry delay is the fallback
+    for a missed wakeup, e.g. the release notification was popped by a proxy of another process.
+    """
+
+    def get_delay(self, attempt: int, pttl: Optional[float], remaining: Optional[float]) -> float:
+        """
+        attempt: how many times the waiter has already slept, starting at 0
+        pttl: the remaining time(second) of the lock returned by the acquire script, None if unknown
+        remaining: the remaining time(second) before blocking_timeout, None if the waiter blocks forever
+        """
+        raise NotImplementedError()
+
+
+class FixedRetryPolicy(RetryPolicy):
+    """Retry every `interval` seconds, or at a third of the lock's remaining time if it is shorter"""
+
+    def __init__(self, interval: float = 1) -> None:
+        self.interval = interval
+
+    def get_delay(self, attempt: int, pttl: Optional[float], remaining: Optional[float]) -> float:
+        delay: float = self.interval
+        if pttl is not None and (pttl / 3) < delay:
+            delay = pttl / 3
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return delay
+
+
+class ExponentialBackoffPolicy(RetryPolicy):
+    """Exponential backoff with full jitter, capped by the lock's remaining time and the deadline.
+
+    The jitter keeps the waiters of all processes from hitting redis in lockstep after a missed wakeup,
+    and since the lock can not be free before it expires (unless a release is notified), there is no point
+    in sleeping past its pttl, nor in polling much earlier than that.
+    """
+
+    def __init__(self, base: float = 0.01, cap: float = 1, multiplier: float = 2, jitter: bool = True) -> None:
+        self.base = base
+        self.cap = cap
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def get_delay(self, attempt: int, pttl: Optional[float], remaining: Optional[float]) -> float:
+        # limit the exponent, the delay is capped anyway
+        delay: float = min(self.cap, self.base * self.multiplier ** min(attempt, 64))
+        if pttl is not None and pttl < delay:
+            delay = pttl
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return max(delay, 0)
@@ -1,91 +1,16 @@
 import asyncio
-import logging
-import random
 import time
-from collections import deque
-from typing import Dict, Optional, List, Tuple, Deque
-from uuid import uuid1
+from typing import Optional, List
 
 from redis.asyncio import Redis
 from redis.asyncio.lock import LockError, LockNotOwnedError
 
+from .core import AcquireLoop, LuaScriptMixin, Manager, TokenMixin
+from .telemetry import LockKindMetrics
+from .watch_dog import ExtendCommand
 
-class Proxy(object):
-    def __init__(self, name: str, manager: "Manager") -> None:
-        self.name = name
-        self._manager = manager
-        self._task: Optional[asyncio.Task] = None
-
-    async def run(self) -> None:
-        while True:
-            result: Optional[List[bytes]] = await self._manager.client.blpop([self.name], self._manager.timeout)
-            if result is None:
-                continue
-            listen_name = result[1].decode()
-            if listen_name not in self._manager.listener_dict:
-                logging.error(f"{listen_name} not in listener_dict")
-                continue
-            listener = self._manager.listener_dict[listen_name]
-            while True:
-                if not len(listener):
-                    self._manager.listener_dict.pop(listen_name, None)
-                    break
-                lock_mode, f = listener.popleft()
-                if f.done():
-                    continue
-
-                f.set_result(True)
-                if lock_mode == "read" and listener and listener[0][0] == "read":
-                    continue
-                else:
-                    break
-
-    def start(self) -> None:
-        if self._task:
-            raise RuntimeError(f"{self.name} already started")
-        self._task = asyncio.create_task(self.run())
-
-    def stop(self) -> None:
-        if not self._task or self._task.done():
-            raise RuntimeError(f"{self.name} not started")
-        self._task.cancel()
-
-
-class Manager(object):
-    def __init__(self, client: Redis, proxy_num: int = 8, timeout: int = 5):
-        self._proxy_num = proxy_num
-        self._proxies: List[Proxy] = [Proxy(str(i), self) for i in range(proxy_num)]
-
-        self.client = client
-        self.timeout = timeout
-        self.listener_dict: Dict[str, Deque[Tuple[str, asyncio.Future]]] = {}
-
-    def listen(self, lock_name: str, lock_mode: str) -> asyncio.Future:
-        if lock_name not in self.listener_dict:
-            self.listener_dict[lock_name] = deque()
-
-        f = asyncio.Future()
-        self.listener_dict[lock_name].append((lock_mode, f))
-        return f
-
-    def empty(self, lock_name: str) -> bool:
-        if lock_name not in self.listener_dict:
-            return True
-        return len(self.listener_dict[lock_name]) == 0
-
-    def start(self) -> None:
-        for proxy in self._proxies:
-            proxy.start()
-
-    def stop(self) -> None:
-        for proxy in self._proxies:
-            proxy.stop()
-
-    def get_random_proxy_name(self) -> str:
-        return self._proxies[random.randint(0, len(self._proxies) - 1)].name
-
-
-class RwLock(object):
+
+class RwLock(LuaScriptMixin, TokenMixin):
     mode: str = ""
     lua_acquire = None
     lua_release = None
@@ -98,48 +23,35 @@ class RwLock(object):
             manager: Manager,
             name: str,
             timeout: int = 9,
+            blocking_timeout: Optional[float] = None,
     ) -> None:
+        """
+        timeout: the expiration time(second) of the lock, it is extended by the watch dog while the lock is held
+        blocking_timeout: the maximum time(second) to wait for the lock, None means wait forever
+        """
         self._name = name
+        self._key: str = manager.key_layout.get_lock_key(name)
         self._manager = manager
         self._client = client
         self._timeout = timeout
+        self._blocking_timeout = blocking_timeout
+        # one kind per mode, e.g. "read"
+        self._metrics: LockKindMetrics = manager.metrics.get_kind(self.mode)
+        self._acquired_time: float = 0.0
         self.register_scripts()
 
-    def register_scripts(self):
-        cls = self.__class__
-        client = self._client
-        if cls.lua_release is None:
-            cls.lua_release = client.register_script(cls.LUA_RELEASE_SCRIPT)
-        if cls.lua_extend is None:
-            cls.lua_extend = client.register_script(cls.LUA_EXTEND_SCRIPT)
-        if cls.lua_acquire is None:
-            cls.lua_acquire = client.register_script(cls.LUA_ACQUIRE_SCRIPT)
-
     async def __aenter__(self):
         if await self.acquire():
-            self._cancel_watch_dog()
-            self._watch_dog = asyncio.create_task(self._watch())
+            self._manager.watch_dog.add(self)
             return self
         raise LockError("Unable to acquire lock within the time specified")
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        self._cancel_watch_dog()
+        self._manager.watch_dog.remove(self)
         await self._release()
 
-    #########
-    # token #
-    #########
-    @staticmethod
-    def _new_token() -> str:
-        return str(uuid1().hex) + str(id(asyncio.current_task()))
-
-    @property
-    def _token(self) -> Optional[str]:
-        return getattr(self, "_token_var", None)
-
-    @_token.setter
-    def _token(self, token: Optional[str]) -> None:
-        self._token_var = token
+    def _get_sub_key(self, suffix: str) -> str:
+        return self._manager.key_layout.get_sub_key(self._key, suffix)
 
     ###########
     # release #
@@ -152,6 +64,7 @@ class RwLock(object):
         result: Optional[int] = await self._do_release(token)
         if result != 0:
             self._token = None
+            self._metrics.on_release(self._manager.time() - self._acquired_time, result is not None)
         if result is None:
             raise LockNotOwnedError("Cannot release a lock that's no longer owned")
 
@@ -164,68 +77,37 @@ class RwLock(object):
     async def acquire(self) -> bool:
         if self._token:
             raise LockError("Lock already acquired")
-        token = self._new_token()
-        proxy_name = self._manager.get_random_proxy_name()
-        listener: Optional[asyncio.Future] = None
-        ttl: Optional[int] = self._timeout
-
-        while True:
-            if listener or self._manager.empty(self._name):
-                ttl = await self._do_acquire(token, proxy_name)
-                if not ttl:
-                    self._token = token
-                    if listener and not listener.done():
-                        listener.set_result(True)
-                    return True
-            if not listener or listener.done():
-                listener = self._manager.listen(self._name, self.mode)
-
-            ttl = ttl / 3 if (ttl / 3) < 1 else 1
-            await asyncio.wait([listener])
-
-    async def _do_acquire(self, token: str, proxy_name: str) -> Optional[int]:
+        start_time: float = self._manager.time()
+        deadline: Optional[float] = None
+        if self._blocking_timeout is not None:
+            deadline = start_time + self._blocking_timeout
+        token: str = self._new_token()
+        acquire_loop: AcquireLoop = await self._manager.acquire(
+            self._key, lambda: self._do_acquire(token), deadline, self.mode
+        )
+        if acquire_loop.acquired:
+            self._token = token
+        self._acquired_time = self._manager.time()
+        self._metrics.on_acquire(self._acquired_time - start_time, acquire_loop.attempt, acquire_loop.acquired)
+        return acquire_loop.acquired
+
+    async def _do_acquire(self, token: str) -> Optional[int]:
         raise NotImplementedError()
 
     #############
     # watch dog #
     #############
-    _watch_dog: Optional[asyncio.Future]
     lua_extend = None
-    # KEYS[1] - lock name
-    # KEYS[2] - write&read lock prefix       {lock name}
-    # ARGV[1] - token
-    # ARGV[2] - additional milliseconds
-    # return 1 if the locks time was extended, otherwise 0
-    LUA_EXTEND_SCRIPT = """
-    local counter = redis.call('hget', KEYS[1], ARGV[1]);
-    if (counter ~= false) then
-        redis.call('pexpire', KEYS[1], ARGV[2]);
-        if (redis.call('hlen', KEYS[1]) > 1) then
-            local keys = redis.call('hkeys', KEYS[1]);
-            for n, key in ipairs(keys) do
-                counter = tonumber(redis.call('hget', KEYS[1], key));
-                if type(counter) == 'number' then
-                    for i=counter, 1, -1 do
-                        redis.call('pexpire', KEYS[2] .. ':' .. key .. ':rwlock_timeout:' .. i, ARGV[2]);
-                    end;
-                end;
-            end;
-        end;
-        return 1;
-    end;
-    return 0;
-    """
+    LUA_EXTEND_SCRIPT = None
+
+    def _get_watch_interval(self) -> float:
+        return self._timeout / 3
 
-    async def _watch(self) -> None:
-        while True:
-            if not await self._extend():
-                logging.error(f"Failed to extend the lock:{self._name}")
-            await asyncio.sleep(self._timeout / 3)
+    def _get_extend_keys(self) -> List[str]:
+        raise NotImplementedError()
 
-    def _cancel_watch_dog(self) -> None:
-        _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-        if _old_watch_dog and not _old_watch_dog.cancelled():
-            _old_watch_dog.cancel()
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(self.lua_extend, self._get_extend_keys(), [self._token, int(self._timeout * 1000)])]
 
     async def _extend(self) -> bool:
         token = self._token
@@ -235,86 +117,99 @@ class RwLock(object):
             raise LockError("Cannot extend a lock with no timeout")
         timeout = int(self._timeout * 1000)
         return bool(await self.lua_extend(
-            keys=[self._name, self._name], args=[token, timeout], client=self._client,
+            keys=self._get_extend_keys(), args=[token, timeout], client=self._client,
         ))
 
-    def __del__(self) -> None:
-        try:
-            _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
-            if _old_watch_dog and not _old_watch_dog.cancelled():
-                _old_watch_dog.cancel()
-        except Exception:
-            pass
-
 
 class ReadLock(RwLock):
     mode = "read"
+    # The readers are kept in a sorted set scored by their expiration time(millisecond, redis server time),
+    # so that release and extend cost O(log n) instead of walking every reader and every reentry.
+    #
+    # data struct
+    # {lock name}: {
+    #    "mode": "read",
+    #    "{uuid}{id}": 1                    # reentry counter of the reader
+    # }
+    # {lock name}:readers: {"{uuid}{id}": expiration time}
+    #
+    # The lock and the readers live as long as the last reader.
+    LUA_NOW_MS = """
+    local now = redis.call('time');
+    local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000);
+    """
+
     ###########
     # acquire #
     ###########
     lua_acquire = None
     # KEYS[1] - lock name
-    # KEYS[2] - owner's rw lock name      {lock name}:{uuid}:{id}:rwlock_timeout
-    # KEYS[3] - write lock name           {lock name}:write
+    # KEYS[2] - readers name              {lock name}:readers
+    # KEYS[3] - write lock name           {lock name}:write           set while a writer is waiting
+    # KEYS[4] - read wait name            {lock name}:read_wait       set while a reader is waiting(phase fair)
+    # KEYS[5] - read phase name           {lock name}:read_phase      set while a read phase is open(phase fair)
+    # KEYS[6] - proxy name
     # ARGV[1] - token
-    # ARGV[2] - proxy name
-    # ARGV[3] - milliseconds
+    # ARGV[2] - milliseconds
+    # ARGV[3] - rw policy
     # return nil if the locks time was reacquired, otherwise ttl(millisecond)
-    #
-    # data struct
-    # {lock name}: {
-    #    "mode": "read",
-    #    "proxy": "{proxy name}"
-    #    "{uuid}:{id}": 1
-    # }
-    # {lock name}:{uuid}:{id}:rwlock_timeout:1 1
-    LUA_ACQUIRE_SCRIPT = """
+    LUA_ACQUIRE_SCRIPT = LUA_NOW_MS + """
     local mode = redis.call('hget', KEYS[1], 'mode');
-    local wait_write = redis.call('exists', KEYS[3]);
+    local blocked = (mode == 'write');
+    if (not blocked) and (ARGV[3] ~= 'reader') and (redis.call('exists', KEYS[3]) == 1) then
+        blocked = (ARGV[3] == 'writer') or (redis.call('exists', KEYS[5]) == 0);
+    end;
+    if blocked then
+        if (ARGV[3] == 'phase') then
+            redis.call('set', KEYS[4], 1, 'px', ARGV[2]);
+        end;
+        local ttl = redis.call('pttl', KEYS[1]);
+        if (ttl < 0) then
+            ttl = redis.call('pttl', KEYS[3]);
+        end;
+        return ttl;
+    end;
+
     if (mode == false) then
         redis.call('hset', KEYS[1], 'mode', 'read');
-        redis.call('hset', KEYS[1], ARGV[1], 1);
-        redis.call('set', KEYS[2] .. ':1', 1);
-        redis.call('pexpire', KEYS[2] .. ':1', ARGV[3]);
-        redis.call('pexpire', KEYS[1], ARGV[3]);
-        
-        redis.call('hset', KEYS[1], 'proxy_name', ARGV[2])
-        redis.call('del', ARGV[2]);
-        return nil;
+        redis.call('del', KEYS[2]);
     end;
-    if (mode == 'read') and (wait_write == 0)then
-        local ind = redis.call('hincrby', KEYS[1], ARGV[1], 1);
-        local key = KEYS[2] .. ':' .. ind;
-        redis.call('set', key, 1);
-        redis.call('pexpire', key, ARGV[3]);
-        redis.call('pexpire', KEYS[1], ARGV[3]);
-        return nil;
+    redis.call('hincrby', KEYS[1], ARGV[1], 1);
+    redis.call('zadd', KEYS[2], now_ms + tonumber(ARGV[2]), ARGV[1]);
+    if (redis.call('pttl', KEYS[1]) < tonumber(ARGV[2])) then
+        redis.call('pexpire', KEYS[1], ARGV[2]);
+        redis.call('pexpire', KEYS[2], ARGV[2]);
     end;
-    return redis.call('pttl', KEYS[1])
+    return nil;
     """
 
-    async def _do_acquire(self, token: str, proxy_name: str) -> Optional[int]:
+    async def _do_acquire(self, token: str) -> Optional[int]:
         timeout = int(self._timeout * 1000)
-        result = await self.lua_acquire(
-            keys=[self._name, f"{self._name}:{token}:rwlock_timeout", f"{self._name}:write"],
-            args=[token, proxy_name, timeout],
+        return await self.lua_acquire(
+            keys=[
+                self._key,
+                self._get_sub_key("readers"),
+                self._get_sub_key("write"),
+                self._get_sub_key("read_wait"),
+                self._get_sub_key("read_phase"),
+                self._manager.get_proxy_name(self._key),
+            ],
+            args=[token, timeout, self._manager.rw_policy],
             client=self._client
         )
-        if result:
-            result = result / 1000
-        return result
 
     ###########
     # release #
     ###########
     lua_release = None
     # KEYS[1] - lock name
-    # KEYS[2] - owner's rw lock name      {lock name}:{uuid}:{id}:rwlock_timeout
-    # KEYS[3] - rw lock name prefix       {lock name}
+    # KEYS[2] - readers name              {lock name}:readers
+    # KEYS[3] - read phase name           {lock name}:read_phase
+    # KEYS[4] - read wait name            {lock name}:read_wait
+    # KEYS[5] - proxy name
     # ARGV[1] - token
-    # ARGV[2] - milliseconds
-    # return 1 if the lock was released, otherwise 0
-    LUA_RELEASE_SCRIPT = """
+    # return 1 if the reader was released, 0 if it is still held by the reader(reentry), otherwise nil
+    LUA_RELEASE_SCRIPT = LUA_NOW_MS + """
     local mode = redis.call('hget', KEYS[1], 'mode');
     if (mode ~= 'read') then
         return nil;
@@ -322,43 +217,74 @@ class ReadLock(RwLock):
     if (redis.call('hexists', KEYS[1], ARGV[1]) == 0) then
         return nil;
     end ;
-    
+
     local counter = redis.call('hincrby', KEYS[1], ARGV[1], -1);
-    if (counter == 0) then
-        redis.call('hdel', KEYS[1], ARGV[1]);
+    if (counter > 0) then
+        return 0;
     end;
-    redis.call('del', KEYS[2] .. ':' .. (counter+1));
-    if (redis.call('hlen', KEYS[1]) > 1) then
-        local maxRemainTime = -3;
-        local keys = redis.call('hkeys', KEYS[1]);
-        for n, key in ipairs(keys) do
-            counter = tonumber(redis.call('hget', KEYS[1], key));
-            if type(counter) == 'number' then
-                for i=counter, 1, -1 do
-                    local remainTime = redis.call('pttl', KEYS[3] .. ':' .. key .. ':rwlock_timeout:' .. i);
-                    maxRemainTime = math.max(remainTime, maxRemainTime);
-                end;
-            end;
-        end;
-        if maxRemainTime > 0 then
-            redis.call('pexpire', KEYS[1], maxRemainTime);
-            return 0;
-        end;
+    redis.call('hdel', KEYS[1], ARGV[1]);
+    redis.call('zrem', KEYS[2], ARGV[1]);
+    -- drop the readers that expired without releasing
+    redis.call('zremrangebyscore', KEYS[2], '-inf', now_ms);
+    local last_reader = redis.call('zrange', KEYS[2], -1, -1, 'withscores');
+    if (last_reader[1] ~= nil) then
+        local remain_time = tonumber(last_reader[2]) - now_ms;
+        redis.call('pexpire', KEYS[1], remain_time);
+        redis.call('pexpire', KEYS[2], remain_time);
+        return 1;
     end;
-    
-    local proxy_name = redis.call('hget', KEYS[1], 'proxy_name')
-    redis.call('lpush', proxy_name, KEYS[1]);
-    redis.call('expire', proxy_name, 3)
+
+    redis.call('lpush', KEYS[5], KEYS[1]);
+    redis.call('expire', KEYS[5], 3)
     redis.call('del', KEYS[1]);
+    redis.call('del', KEYS[2]);
+    -- the read phase is over, the readers still waiting wait for the next write phase
+    redis.call('del', KEYS[3]);
+    redis.call('del', KEYS[4]);
     return 1;
     """
 
     async def _do_release(self, token: str) -> Optional[int]:
         return await self.lua_release(
-            keys=[self._name, f"{self._name}:{token}:rwlock_timeout", self._name],
-            args=[token, self._timeout], client=self._client
+            keys=[
+                self._key,
+                self._get_sub_key("readers"),
+                self._get_sub_key("read_phase"),
+                self._get_sub_key("read_wait"),
+                self._manager.get_proxy_name(self._key),
+            ],
+            args=[token],
+            client=self._client
         )
 
+    #############
+    # watch dog #
+    #############
+    lua_extend = None
+    # KEYS[1] - lock name
+    # KEYS[2] - readers name              {lock name}:readers
+    # ARGV[1] - token
+    # ARGV[2] - additional milliseconds
+    # return 1 if the locks time was extended, otherwise 0
+    LUA_EXTEND_SCRIPT = LUA_NOW_MS + """
+    if (redis.call('hexists', KEYS[1], ARGV[1]) == 0) then
+        return 0;
+    end;
+    local expire_at = redis.call('zscore', KEYS[2], ARGV[1]);
+    if (expire_at == false) or (tonumber(expire_at) < now_ms) then
+        return 0;
+    end;
+    redis.call('zadd', KEYS[2], now_ms + tonumber(ARGV[2]), ARGV[1]);
+    if (redis.call('pttl', KEYS[1]) < tonumber(ARGV[2])) then
+        redis.call('pexpire', KEYS[1], ARGV[2]);
+        redis.call('pexpire', KEYS[2], ARGV[2]);
+    end;
+    return 1;
+    """
+
+    def _get_extend_keys(self) -> List[str]:
+        return [self._key, self._get_sub_key("readers")]
+
 
 class WriteLock(RwLock):
     mode = "write"
@@ -367,46 +293,60 @@ class WriteLock(RwLock):
     ###########
     lua_acquire = None
     # KEYS[1] - lock name
-    # KEYS[2] - write lock name           {lock name}:write
+    # KEYS[2] - write lock name           {lock name}:write           set while a writer is waiting
+    # KEYS[3] - read wait name            {lock name}:read_wait       set while a reader is waiting(phase fair)
+    # KEYS[4] - read phase name           {lock name}:read_phase      set while a read phase is open(phase fair)
+    # KEYS[5] - proxy name
     # ARGV[1] - token
-    # ARGV[2] - proxy name
-    # ARGV[3] - milliseconds
+    # ARGV[2] - milliseconds
+    # ARGV[3] - rw policy
+    # ARGV[4] - read phase window(millisecond)
     # return nil if the locks time was reacquired, otherwise ttl(millisecond)
     #
     # data struct
     # {lock name}: {
-    #    "mode": "read",
-    #    "proxy": "{proxy name}"
-    #    "{uuid}:{id}": 1
+    #    "mode": "write",
+    #    "{uuid}{id}": 1
     # }
     LUA_ACQUIRE_SCRIPT = """
     local mode = redis.call('hget', KEYS[1], 'mode');
+    if (mode == false) and (ARGV[3] == 'phase') then
+        if (redis.call('exists', KEYS[3]) == 1) then
+            -- readers waited during the last write phase, let them in first
+            redis.call('del', KEYS[3]);
+            redis.call('set', KEYS[4], 1, 'px', ARGV[4]);
+        end;
+        if (redis.call('exists', KEYS[4]) == 1) then
+            redis.call('set', KEYS[2], 'wait_write', 'px', ARGV[2]);
+            return redis.call('pttl', KEYS[4]);
+        end;
+    end;
     if (mode == false) then
         redis.call('hset', KEYS[1], 'mode', 'write');
         redis.call('hset', KEYS[1], ARGV[1], 1);
-        redis.call('pexpire', KEYS[1], ARGV[3]);
-        
-        redis.call('hset', KEYS[1], 'proxy_name', ARGV[2])
-        redis.call('del', ARGV[2]);
+        redis.call('pexpire', KEYS[1], ARGV[2]);
         return nil;
     end;
-    if (mode == 'read') then
-        redis.call('set', KEYS[2], 'wait_write');
+    if (ARGV[3] ~= 'reader') then
+        redis.call('set', KEYS[2], 'wait_write', 'px', ARGV[2]);
     end;
-    
+
     return redis.call('pttl', KEYS[1])
     """
 
-    async def _do_acquire(self, token: str, proxy_name: str) -> Optional[int]:
+    async def _do_acquire(self, token: str) -> Optional[int]:
         timeout = int(self._timeout * 1000)
-        result = await self.lua_acquire(
-            keys=[self._name, f"{self._name}:write"],
-            args=[token, proxy_name, timeout],
+        return await self.lua_acquire(
+            keys=[
+                self._key,
+                self._get_sub_key("write"),
+                self._get_sub_key("read_wait"),
+                self._get_sub_key("read_phase"),
+                self._manager.get_proxy_name(self._key),
+            ],
+            args=[token, timeout, self._manager.rw_policy, int(self._manager.phase_window * 1000)],
             client=self._client
         )
-        if result:
-            result = result / 1000
-        return result
 
     ###########
     # release #
@@ -414,6 +354,7 @@ class WriteLock(RwLock):
     lua_release = None
     # KEYS[1] - lock name
     # KEYS[2] - write lock name           {lock name}:write
+    # KEYS[3] - proxy name
     # ARGV[1] - token                     {uuid}:{id}
     # return 1 if the lock was released, otherwise 0
     LUA_RELEASE_SCRIPT = """
@@ -424,20 +365,42 @@ class WriteLock(RwLock):
     if (redis.call('hexists', KEYS[1], ARGV[1]) == 0) then
         return nil;
     end ;
-    
-    local proxy_name = redis.call('hget', KEYS[1], 'proxy_name')
-    redis.call('lpush', proxy_name, KEYS[1]);
-    redis.call('expire', proxy_name, 3)
+
+    redis.call('lpush', KEYS[3], KEYS[1]);
+    redis.call('expire', KEYS[3], 3)
     redis.call('del', KEYS[1]);
-    redis.call('del', KEYS[2]); 
+    redis.call('del', KEYS[2]);
     return 1;
     """
 
     async def _do_release(self, token: str) -> Optional[int]:
         return await self.lua_release(
-            keys=[self._name, f"{self._name}:write"], args=[token], client=self._client
+            keys=[self._key, self._get_sub_key("write"), self._manager.get_proxy_name(self._key)], args=[token],
+            client=self._client
         )
 
+    #############
+    # watch dog #
+    #############
+    lua_extend = None
+    # KEYS[1] - lock name
+    # ARGV[1] - token
+    # ARGV[2] - additional milliseconds
+    # return 1 if the locks time was extended, otherwise 0
+    LUA_EXTEND_SCRIPT = """
+    if (redis.call('hget', KEYS[1], 'mode') ~= 'write') then
+        return 0;
+    end;
+    if (redis.call('hexists', KEYS[1], ARGV[1]) == 0) then
+        return 0;
+    end;
+    redis.call('pexpire', KEYS[1], ARGV[2]);
+    return 1;
+    """
+
+    def _get_extend_keys(self) -> List[str]:
+        return [self._key]
+
 
 async def run_read(manager: Manager, client: Redis) -> None:
     print(f"Timestamp:{time.time()} Task:{id(asyncio.current_task())}, wait read")
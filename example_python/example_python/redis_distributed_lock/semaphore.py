@@ -0,0 +1,204 @@
+import asyncio
+from typing import List, Optional
+
+from redis.asyncio import Redis
+from redis.asyncio.lock import LockError, LockNotOwnedError
+
+from .core import AcquireLoop, LuaScriptMixin, Manager, TokenMixin
+from .telemetry import LockKindMetrics
+from .watch_dog import ExtendCommand
+
+
+class Semaphore(LuaScriptMixin, TokenMixin):
+    """
+    A counting lock, at most `permits` holders across all processes, e.g. 32 concurrent calls to a downstream.
+
+    The permits are kept in a sorted set scored by their expiration time(millisecond, redis server time),
+    a holder that dies without releasing only blocks its permit until it expires, the watch dog renews the
+    permits of the living holders. Every permit given back(released, or found expired by an acquire) is
+    notified to the proxy once, and a notification wakes up a single waiter, so as many waiters are woken
+    up as permits are given back.
+
+    data struct
+    {lock name}: {"{uuid}{id}": expiration time}
+
+    Every client of the same name must use the same permits.
+    """
+    metrics_kind: str = "semaphore"
+    LUA_NOW_MS = """
+    local now = redis.call('time');
+    local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000);
+    """
+
+    def __init__(
+            self,
+            client: Redis,
+            manager: Manager,
+            name: str,
+            permits: int,
+            timeout: int = 9,
+            blocking_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        permits: the maximum number of holders
+        timeout: the expiration time(second) of a permit, it is extended by the watch dog while the permit is held
+        blocking_timeout: the maximum time(second) to wait for a permit, None means wait forever
+        """
+        if permits < 1:
+            raise ValueError("permits must be greater than 0")
+        self._name = name
+        self._key: str = manager.key_layout.get_lock_key(name)
+        self._manager = manager
+        self._client = client
+        self._permits = permits
+        self._timeout = timeout
+        self._blocking_timeout = blocking_timeout
+        self._metrics: LockKindMetrics = manager.metrics.get_kind(self.metrics_kind)
+        self._acquired_time: float = 0.0
+        self.register_scripts()
+
+    async def __aenter__(self):
+        if await self.acquire():
+            self._manager.watch_dog.add(self)
+            return self
+        raise LockError("Unable to acquire semaphore within the time specified")
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._manager.watch_dog.remove(self)
+        await self._release()
+
+    ###########
+    # acquire #
+    ###########
+    lua_acquire = None
+    # KEYS[1] - lock name
+    # KEYS[2] - proxy name
+    # ARGV[1] - token
+    # ARGV[2] - milliseconds
+    # ARGV[3] - permits
+    # return nil if a permit was acquired, otherwise the time(millisecond) before the first permit expires
+    LUA_ACQUIRE_SCRIPT = LUA_NOW_MS + """
+    local expired_cnt = redis.call('zremrangebyscore', KEYS[1], '-inf', now_ms);
+    if (redis.call('zcard', KEYS[1]) < tonumber(ARGV[3])) then
+        redis.call('zadd', KEYS[1], now_ms + tonumber(ARGV[2]), ARGV[1]);
+        if (redis.call('pttl', KEYS[1]) < tonumber(ARGV[2])) then
+            redis.call('pexpire', KEYS[1], ARGV[2]);
+        end;
+        -- this waiter takes one of the expired permits, the others are notified to the other waiters
+        if (expired_cnt > 1) then
+            for i = 2, expired_cnt do
+                redis.call('lpush', KEYS[2], KEYS[1]);
+            end;
+            redis.call('expire', KEYS[2], 3);
+        end;
+        return nil;
+    end;
+    local first_permit = redis.call('zrange', KEYS[1], 0, 0, 'withscores');
+    return tonumber(first_permit[2]) - now_ms;
+    """
+
+    async def acquire(self) -> bool:
+        if self._token:
+            raise LockError("Semaphore already acquired")
+        start_time: float = self._manager.time()
+        deadline: Optional[float] = None
+        if self._blocking_timeout is not None:
+            deadline = start_time + self._blocking_timeout
+        token: str = self._new_token()
+        acquire_loop: AcquireLoop = await self._manager.acquire(self._key, lambda: self._do_acquire(token), deadline)
+        if acquire_loop.acquired:
+            self._token = token
+        self._acquired_time = self._manager.time()
+        self._metrics.on_acquire(self._acquired_time - start_time, acquire_loop.attempt, acquire_loop.acquired)
+        return acquire_loop.acquired
+
+    async def _do_acquire(self, token: str) -> Optional[int]:
+        timeout = int(self._timeout * 1000)
+        return await self.lua_acquire(
+            keys=[self._key, self._manager.get_proxy_name(self._key)],
+            args=[token, timeout, self._permits],
+            client=self._client
+        )
+
+    ###########
+    # release #
+    ###########
+    lua_release = None
+    # KEYS[1] - lock name
+    # KEYS[2] - proxy name
+    # ARGV[1] - token
+    # return 1 if the permit was released, otherwise nil
+    LUA_RELEASE_SCRIPT = """
+    if (redis.call('zrem', KEYS[1], ARGV[1]) == 0) then
+        return nil;
+    end;
+    redis.call('lpush', KEYS[2], KEYS[1]);
+    redis.call('expire', KEYS[2], 3);
+    return 1;
+    """
+
+    async def _release(self) -> None:
+        token = self._token
+        if token is None:
+            raise LockError("Cannot release an unlocked semaphore")
+        self._token = None
+        result: Optional[int] = await self._do_release(token)
+        self._metrics.on_release(self._manager.time() - self._acquired_time, result is not None)
+        if result is None:
+            raise LockNotOwnedError("Cannot release a permit that's no longer owned")
+
+    async def _do_release(self, token: str) -> Optional[int]:
+        return await self.lua_release(
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token], client=self._client
+        )
+
+    #############
+    # watch dog #
+    #############
+    lua_extend = None
+    # KEYS[1] - lock name
+    # ARGV[1] - token
+    # ARGV[2] - additional milliseconds
+    # return 1 if the permit was extended, otherwise 0
+    LUA_EXTEND_SCRIPT = LUA_NOW_MS + """
+    local expire_at = redis.call('zscore', KEYS[1], ARGV[1]);
+    if (expire_at == false) or (tonumber(expire_at) < now_ms) then
+        return 0;
+    end;
+    redis.call('zadd', KEYS[1], now_ms + tonumber(ARGV[2]), ARGV[1]);
+    if (redis.call('pttl', KEYS[1]) < tonumber(ARGV[2])) then
+        redis.call('pexpire', KEYS[1], ARGV[2]);
+    end;
+    return 1;
+    """
+
+    def _get_watch_interval(self) -> float:
+        return self._timeout / 3
+
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(self.lua_extend, [self._key], [self._token, int(self._timeout * 1000)])]
+
+    async def _extend(self) -> bool:
+        token = self._token
+        if token is None:
+            raise LockError("Cannot extend an unlocked semaphore")
+        timeout = int(self._timeout * 1000)
+        return bool(await self.lua_extend(keys=[self._key], args=[token, timeout], client=self._client))
+
+
+async def demo(manager: Manager, client: Redis) -> None:
+    async with Semaphore(client, manager, "demo", permits=2, timeout=1):
+        print(f"Task:{id(asyncio.current_task())}, run")
+        await asyncio.sleep(1)
+
+
+async def main():
+    _redis = Redis()
+    manager = Manager(client=_redis)
+    manager.start()
+    await asyncio.gather(*[demo(manager, _redis) for _ in range(5)])
+    manager.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,783 @@
+"""
+A deterministic simulator of the locks, it needs neither a redis-server nor real sleeps.
+
+The locks run unchanged on top of:
+    VirtualClockLoop: an event loop whose clock only moves forward when every task waits,
+        it jumps to the next timer instead of sleeping, so a minute of contention runs in a few seconds
+    SimRedisServer: an in-memory keyspace with the commands used by the lock scripts
+        (hset/hincrby/pexpire/pttl/lpush/blpop/zadd...), keys expire on the clock of the loop
+    SimRedis: the client of a simulated process, every call costs a round trip of virtual time
+
+The Lua scripts can not run without redis, every script has a stand-in written with the commands of
+SimRedisServer line by line(see `sim_script`), it is looked up by the sha1 of the script, so the locks
+call `evalsha` as they do against redis. Only the scripts of BaseLock, ReadLock, WriteLock
+and Semaphore are simulated.
+
+On top of it, `run_scenario` replays a contention scenario with thousands of clients spread over several
+processes, and injects faults:
+    loss_rate: the chance that a release notification popped by a proxy never reaches it
+    clock_drift: how much faster(>0) or slower(<0) the clock of redis runs than the clocks of the processes,
+        e.g. 0.5 means the locks expire after 2/3 of their timeout as seen by the holders
+It reports the throughput, the fairness between the clients, the wake latency and the safety violations.
+The same seed always gives the same result.
+
+    python -m example_python.redis_distributed_lock.simulator
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import selectors
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple, Union
+
+from redis.asyncio.lock import LockNotOwnedError
+from redis.connection import Encoder
+from redis.commands.core import AsyncScript
+
+from .base_lock import BaseLock
+from .benchmark import print_latency
+from .core import READ_MODE, WRITER_PREFERRING, Manager
+from .retry_policy import RetryPolicy
+from .rw_lock import ReadLock, WriteLock
+from .semaphore import Semaphore
+from .telemetry import LockMetrics
+
+
+#################
+# virtual clock #
+#################
+class VirtualClockSelector(selectors.BaseSelector):
+    """No file is ever ready, a select moves the virtual clock forward by its timeout instead of sleeping"""
+
+    def __init__(self) -> None:
+        self._key_dict: Dict[int, selectors.SelectorKey] = {}
+        self.now: float = 0.0
+
+    @staticmethod
+    def _get_fd(fileobj: Any) -> int:
+        return fileobj if isinstance(fileobj, int) else fileobj.fileno()
+
+    def register(self, fileobj: Any, events: int, data: Any = None) -> selectors.SelectorKey:
+        key: selectors.SelectorKey = selectors.SelectorKey(fileobj, self._get_fd(fileobj), events, data)
+        self._key_dict[key.fd] = key
+        return key
+
+    def unregister(self, fileobj: Any) -> selectors.SelectorKey:
+        return self._key_dict.pop(self._get_fd(fileobj))
+
+    def select(self, timeout: Optional[float] = None) -> List[Tuple[selectors.SelectorKey, int]]:
+        if timeout is None:
+            raise RuntimeError("Deadlock, every task waits without a timeout")
+        self.now += timeout
+        return []
+
+    def close(self) -> None:
+        self._key_dict.clear()
+
+    def get_map(self) -> Mapping[int, selectors.SelectorKey]:
+        return self._key_dict
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):  # type: ignore
+    """An event loop on a virtual clock starting at 0, it does not support sockets or threads"""
+
+    def __init__(self) -> None:
+        self._virtual_selector: VirtualClockSelector = VirtualClockSelector()
+        super().__init__(self._virtual_selector)
+
+    def time(self) -> float:
+        return self._virtual_selector.now
+
+
+#########
+# redis #
+#########
+# a simulated script, (server, keys, args) -> result
+ScriptFunc = Callable[["SimRedisServer", List[str], List[str]], Any]
+_script_dict: Dict[str, ScriptFunc] = {}
+
+
+def sim_script(script: str) -> Callable[[ScriptFunc], ScriptFunc]:
+    """register the stand-in of a Lua script, it runs when the sha1 of the script is called"""
+    def wrapper(func: ScriptFunc) -> ScriptFunc:
+        _script_dict[hashlib.sha1(script.encode()).hexdigest()] = func
+        return func
+    return wrapper
+
+
+class SimRedisServer(object):
+    """
+    The keyspace shared by all the simulated processes.
+    Like redis, the values are strings, a key expires when its expire time(millisecond) has passed
+    """
+
+    def __init__(self, clock_drift: float = 0.0, loss_rate: float = 0.0, seed: int = 0) -> None:
+        self.clock_drift = clock_drift
+        self.loss_rate = loss_rate
+        self._random: random.Random = random.Random(seed)
+        self._data_dict: Dict[str, Any] = {}
+        self._expire_dict: Dict[str, int] = {}
+        # list name -> the BLPOP calls blocked on it, in arrival order
+        self._blpop_dict: Dict[str, Deque[asyncio.Future]] = {}
+
+        # metrics
+        self.command_cnt: int = 0
+        self.lost_cnt: int = 0
+
+    def now_ms(self) -> int:
+        return int(asyncio.get_running_loop().time() * (1 + self.clock_drift) * 1000)
+
+    def _get(self, key: str) -> Any:
+        expire_time: Optional[int] = self._expire_dict.get(key)
+        if expire_time is not None and expire_time < self.now_ms():
+            self.delete(key)
+        return self._data_dict.get(key)
+
+    ##########
+    # common #
+    ##########
+    def exists(self, key: str) -> int:
+        return int(self._get(key) is not None)
+
+    def delete(self, key: str) -> int:
+        self._expire_dict.pop(key, None)
+        return int(self._data_dict.pop(key, None) is not None)
+
+    def pexpire(self, key: str, ms: Union[int, str]) -> int:
+        if self._get(key) is None:
+            return 0
+        self._expire_dict[key] = self.now_ms() + int(ms)
+        return 1
+
+    def expire(self, key: str, seconds: Union[int, str]) -> int:
+        return self.pexpire(key, int(seconds) * 1000)
+
+    def pttl(self, key: str) -> int:
+        if self._get(key) is None:
+            return -2
+        expire_time: Optional[int] = self._expire_dict.get(key)
+        return -1 if expire_time is None else expire_time - self.now_ms()
+
+    def set(self, key: str, value: Any, px: Optional[Union[int, str]] = None) -> None:
+        self.delete(key)
+        self._data_dict[key] = str(value)
+        if px is not None:
+            self.pexpire(key, px)
+
+    ########
+    # hash #
+    ########
+    def _get_hash(self, key: str) -> Dict[str, str]:
+        value: Optional[Dict[str, str]] = self._get(key)
+        if value is None:
+            value = self._data_dict[key] = {}
+        return value
+
+    def hget(self, key: str, field: str) -> Optional[str]:
+        return (self._get(key) or {}).get(field)
+
+    def hexists(self, key: str, field: str) -> int:
+        return int(field in (self._get(key) or {}))
+
+    def hset(self, key: str, field: str, value: Any) -> None:
+        self._get_hash(key)[field] = str(value)
+
+    def hincrby(self, key: str, field: str, increment: int) -> int:
+        hash_dict: Dict[str, str] = self._get_hash(key)
+        value: int = int(hash_dict.get(field, 0)) + increment
+        hash_dict[field] = str(value)
+        return value
+
+    def hdel(self, key: str, field: str) -> int:
+        hash_dict: Optional[Dict[str, str]] = self._get(key)
+        if not hash_dict or hash_dict.pop(field, None) is None:
+            return 0
+        if not hash_dict:
+            self.delete(key)
+        return 1
+
+    ########
+    # list #
+    ########
+    def lpush(self, key: str, *value_tuple: str) -> int:
+        value_deque: Optional[Deque[str]] = self._get(key)
+        if value_deque is None:
+            value_deque = self._data_dict[key] = deque()
+        for value in value_tuple:
+            value_deque.appendleft(value)
+        length: int = len(value_deque)
+        self._serve_blpop(key)
+        return length
+
+    def lpop(self, key: str) -> Optional[str]:
+        value_deque: Optional[Deque[str]] = self._get(key)
+        if not value_deque:
+            return None
+        value: str = value_deque.popleft()
+        if not value_deque:
+            self.delete(key)
+        return value
+
+    def _serve_blpop(self, key: str) -> None:
+        f_deque: Optional[Deque[asyncio.Future]] = self._blpop_dict.get(key)
+        while f_deque and self.exists(key):
+            f: asyncio.Future = f_deque.popleft()
+            if f.done():
+                continue
+            value: Optional[str] = self.lpop(key)
+            if self._random.random() < self.loss_rate:
+                # the reply is lost on the way, the proxy keeps blocking
+                self.lost_cnt += 1
+                f_deque.appendleft(f)
+                continue
+            f.set_result([key.encode(), value.encode()])  # type: ignore
+        if not f_deque:
+            self._blpop_dict.pop(key, None)
+
+    async def blpop(self, key_list: List[str], timeout: float) -> Optional[List[bytes]]:
+        for key in key_list:
+            value: Optional[str] = self.lpop(key)
+            if value is not None:
+                return [key.encode(), value.encode()]
+        f: asyncio.Future = asyncio.get_running_loop().create_future()
+        for key in key_list:
+            self._blpop_dict.setdefault(key, deque()).append(f)
+        try:
+            return await asyncio.wait_for(f, timeout or None)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            for key in key_list:
+                f_deque: Optional[Deque[asyncio.Future]] = self._blpop_dict.get(key)
+                if f_deque and f in f_deque:
+                    f_deque.remove(f)
+                    if not f_deque:
+                        self._blpop_dict.pop(key, None)
+
+    ##############
+    # sorted set #
+    ##############
+    def zadd(self, key: str, score: float, member: str) -> None:
+        value: Optional[Dict[str, float]] = self._get(key)
+        if value is None:
+            value = self._data_dict[key] = {}
+        value[member] = float(score)
+
+    def zscore(self, key: str, member: str) -> Optional[float]:
+        return (self._get(key) or {}).get(member)
+
+    def zrem(self, key: str, member: str) -> int:
+        value: Optional[Dict[str, float]] = self._get(key)
+        if not value or value.pop(member, None) is None:
+            return 0
+        if not value:
+            self.delete(key)
+        return 1
+
+    def zremrangebyscore(self, key: str, min_score: float, max_score: float) -> int:
+        value: Optional[Dict[str, float]] = self._get(key)
+        if not value:
+            return 0
+        member_list: List[str] = [member for member, score in value.items() if min_score <= score <= max_score]
+        for member in member_list:
+            self.zrem(key, member)
+        return len(member_list)
+
+    def zcard(self, key: str) -> int:
+        return len(self._get(key) or {})
+
+    def zrange_withscores(self, key: str) -> List[Tuple[str, float]]:
+        return sorted((self._get(key) or {}).items(), key=lambda item: (item[1], item[0]))
+
+    ##########
+    # script #
+    ##########
+    def evalsha(self, sha: str, keys: List[str], args: List[str]) -> Any:
+        self.command_cnt += 1
+        func: Optional[ScriptFunc] = _script_dict.get(sha)
+        if func is None:
+            raise NotImplementedError(f"The script {sha} is not simulated, register it with sim_script")
+        return func(self, keys, args)
+
+
+class SimPipeline(object):
+    def __init__(self, client: "SimRedis") -> None:
+        self._client = client
+        self._command_list: List[Tuple[str, List[str], List[str]]] = []
+
+    async def __aenter__(self) -> "SimPipeline":
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self._command_list = []
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args: Any) -> "SimPipeline":
+        self._command_list.append((sha, *self._client.split_keys_and_args(numkeys, keys_and_args)))
+        return self
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        command_list, self._command_list = self._command_list, []
+        await self._client.round_trip()
+        result_list: List[Any] = []
+        for sha, keys, args in command_list:
+            try:
+                result_list.append(self._client.server.evalsha(sha, keys, args))
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                result_list.append(e)
+        await self._client.round_trip()
+        return result_list
+
+
+class SimRedis(object):
+    """The redis client of a simulated process, it implements the calls made by the locks and the manager"""
+
+    def __init__(self, server: SimRedisServer, rtt: float = 0.0002) -> None:
+        """rtt: the round trip time(second) between the process and redis"""
+        self.server = server
+        self.rtt = rtt
+
+    def get_encoder(self) -> Encoder:
+        return Encoder("utf-8", "strict", False)
+
+    def register_script(self, script: str) -> AsyncScript:
+        return AsyncScript(self, script)  # type: ignore
+
+    def pipeline(self, transaction: bool = True) -> SimPipeline:
+        return SimPipeline(self)
+
+    async def round_trip(self) -> None:
+        """half of a round trip, the command runs in the middle of it"""
+        await asyncio.sleep(self.rtt / 2)
+
+    @staticmethod
+    def split_keys_and_args(numkeys: int, keys_and_args: Tuple[Any, ...]) -> Tuple[List[str], List[str]]:
+        return [str(key) for key in keys_and_args[:numkeys]], [str(arg) for arg in keys_and_args[numkeys:]]
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args: Any) -> Any:
+        keys, args = self.split_keys_and_args(numkeys, keys_and_args)
+        await self.round_trip()
+        result: Any = self.server.evalsha(sha, keys, args)
+        await self.round_trip()
+        return result
+
+    async def blpop(self, key_list: List[str], timeout: float = 0) -> Optional[List[bytes]]:
+        await self.round_trip()
+        self.server.command_cnt += 1
+        result: Optional[List[bytes]] = await self.server.blpop(key_list, timeout)
+        await self.round_trip()
+        return result
+
+
+#####################
+# simulated scripts #
+#####################
+# Line by line stand-ins of the Lua scripts, see the scripts for the meaning of KEYS and ARGV
+@sim_script(BaseLock.LUA_ACQUIRE_SCRIPT)
+def _lock_acquire(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    if server.exists(keys[0]) == 0:
+        server.hset(keys[0], args[0], 0)
+        server.pexpire(keys[0], args[1])
+        return None
+    return server.pttl(keys[0])
+
+
+@sim_script(BaseLock.LUA_RELEASE_SCRIPT)
+def _lock_release(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    if server.hexists(keys[0], args[0]) == 0:
+        return None
+    server.delete(keys[0])
+    server.lpush(keys[1], keys[0])
+    server.expire(keys[1], 3)
+    return 1
+
+
+@sim_script(BaseLock.LUA_EXTEND_SCRIPT)
+def _lock_extend(server: SimRedisServer, keys: List[str], args: List[str]) -> int:
+    if server.hexists(keys[0], args[0]) != 1:
+        return 0
+    if server.pttl(keys[0]) < 0:
+        return 0
+    server.pexpire(keys[0], args[1])
+    return 1
+
+
+@sim_script(ReadLock.LUA_ACQUIRE_SCRIPT)
+def _read_lock_acquire(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    now_ms: int = server.now_ms()
+    mode: Optional[str] = server.hget(keys[0], "mode")
+    blocked: bool = mode == "write"
+    if not blocked and args[2] != "reader" and server.exists(keys[2]) == 1:
+        blocked = args[2] == "writer" or server.exists(keys[4]) == 0
+    if blocked:
+        if args[2] == "phase":
+            server.set(keys[3], 1, px=args[1])
+        ttl: int = server.pttl(keys[0])
+        if ttl < 0:
+            ttl = server.pttl(keys[2])
+        return ttl
+
+    if mode is None:
+        server.hset(keys[0], "mode", "read")
+        server.delete(keys[1])
+    server.hincrby(keys[0], args[0], 1)
+    server.zadd(keys[1], now_ms + int(args[1]), args[0])
+    if server.pttl(keys[0]) < int(args[1]):
+        server.pexpire(keys[0], args[1])
+        server.pexpire(keys[1], args[1])
+    return None
+
+
+@sim_script(ReadLock.LUA_RELEASE_SCRIPT)
+def _read_lock_release(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    now_ms: int = server.now_ms()
+    if server.hget(keys[0], "mode") != "read":
+        return None
+    if server.hexists(keys[0], args[0]) == 0:
+        return None
+
+    if server.hincrby(keys[0], args[0], -1) > 0:
+        return 0
+    server.hdel(keys[0], args[0])
+    server.zrem(keys[1], args[0])
+    server.zremrangebyscore(keys[1], float("-inf"), now_ms)
+    reader_list: List[Tuple[str, float]] = server.zrange_withscores(keys[1])
+    if reader_list:
+        remain_time: int = int(reader_list[-1][1]) - now_ms
+        server.pexpire(keys[0], remain_time)
+        server.pexpire(keys[1], remain_time)
+        return 1
+
+    server.lpush(keys[4], keys[0])
+    server.expire(keys[4], 3)
+    server.delete(keys[0])
+    server.delete(keys[1])
+    server.delete(keys[2])
+    server.delete(keys[3])
+    return 1
+
+
+@sim_script(ReadLock.LUA_EXTEND_SCRIPT)
+def _read_lock_extend(server: SimRedisServer, keys: List[str], args: List[str]) -> int:
+    now_ms: int = server.now_ms()
+    if server.hexists(keys[0], args[0]) == 0:
+        return 0
+    expire_at: Optional[float] = server.zscore(keys[1], args[0])
+    if expire_at is None or expire_at < now_ms:
+        return 0
+    server.zadd(keys[1], now_ms + int(args[1]), args[0])
+    if server.pttl(keys[0]) < int(args[1]):
+        server.pexpire(keys[0], args[1])
+        server.pexpire(keys[1], args[1])
+    return 1
+
+
+@sim_script(WriteLock.LUA_ACQUIRE_SCRIPT)
+def _write_lock_acquire(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    mode: Optional[str] = server.hget(keys[0], "mode")
+    if mode is None and args[2] == "phase":
+        if server.exists(keys[2]) == 1:
+            server.delete(keys[2])
+            server.set(keys[3], 1, px=args[3])
+        if server.exists(keys[3]) == 1:
+            server.set(keys[1], "wait_write", px=args[1])
+            return server.pttl(keys[3])
+    if mode is None:
+        server.hset(keys[0], "mode", "write")
+        server.hset(keys[0], args[0], 1)
+        server.pexpire(keys[0], args[1])
+        return None
+    if args[2] != "reader":
+        server.set(keys[1], "wait_write", px=args[1])
+    return server.pttl(keys[0])
+
+
+@sim_script(WriteLock.LUA_RELEASE_SCRIPT)
+def _write_lock_release(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    if server.hget(keys[0], "mode") != "write":
+        return None
+    if server.hexists(keys[0], args[0]) == 0:
+        return None
+    server.lpush(keys[2], keys[0])
+    server.expire(keys[2], 3)
+    server.delete(keys[0])
+    server.delete(keys[1])
+    return 1
+
+
+@sim_script(WriteLock.LUA_EXTEND_SCRIPT)
+def _write_lock_extend(server: SimRedisServer, keys: List[str], args: List[str]) -> int:
+    if server.hget(keys[0], "mode") != "write":
+        return 0
+    if server.hexists(keys[0], args[0]) == 0:
+        return 0
+    server.pexpire(keys[0], args[1])
+    return 1
+
+
+@sim_script(Semaphore.LUA_ACQUIRE_SCRIPT)
+def _semaphore_acquire(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    now_ms: int = server.now_ms()
+    expired_cnt: int = server.zremrangebyscore(keys[0], float("-inf"), now_ms)
+    if server.zcard(keys[0]) < int(args[2]):
+        server.zadd(keys[0], now_ms + int(args[1]), args[0])
+        if server.pttl(keys[0]) < int(args[1]):
+            server.pexpire(keys[0], args[1])
+        if expired_cnt > 1:
+            for _ in range(2, expired_cnt + 1):
+                server.lpush(keys[1], keys[0])
+            server.expire(keys[1], 3)
+        return None
+    return int(server.zrange_withscores(keys[0])[0][1]) - now_ms
+
+
+@sim_script(Semaphore.LUA_RELEASE_SCRIPT)
+def _semaphore_release(server: SimRedisServer, keys: List[str], args: List[str]) -> Optional[int]:
+    if server.zrem(keys[0], args[0]) == 0:
+        return None
+    server.lpush(keys[1], keys[0])
+    server.expire(keys[1], 3)
+    return 1
+
+
+@sim_script(Semaphore.LUA_EXTEND_SCRIPT)
+def _semaphore_extend(server: SimRedisServer, keys: List[str], args: List[str]) -> int:
+    now_ms: int = server.now_ms()
+    expire_at: Optional[float] = server.zscore(keys[0], args[0])
+    if expire_at is None or expire_at < now_ms:
+        return 0
+    server.zadd(keys[0], now_ms + int(args[1]), args[0])
+    if server.pttl(keys[0]) < int(args[1]):
+        server.pexpire(keys[0], args[1])
+    return 1
+
+
+###########
+# harness #
+###########
+class SimReport(object):
+    def __init__(self, duration: float, client_num: int) -> None:
+        self.duration = duration
+        self.client_num = client_num
+        # completed critical sections of each client
+        self.completed_cnt_list: List[int] = [0] * client_num
+        # time(second) from the start of an acquire to entering the critical section
+        self.wait_time_list: List[float] = []
+        # time(second) the lock stays free between two holders while somebody waits for it
+        self.wake_latency_list: List[float] = []
+        # a writer entered a critical section together with another holder, or a semaphore was over its permits
+        self.violation_cnt: int = 0
+        # the lock expired before the holder released it
+        self.expired_cnt: int = 0
+        self.lost_cnt: int = 0
+        self.command_cnt: int = 0
+        self.metrics: LockMetrics = LockMetrics()
+        # real time(second) the simulation took
+        self.cost: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """completed critical sections per virtual second"""
+        return sum(self.completed_cnt_list) / self.duration
+
+    @property
+    def fairness(self) -> float:
+        """Jain's fairness index of the completed critical sections of the clients, 1 is perfectly fair"""
+        square_sum: int = sum(cnt * cnt for cnt in self.completed_cnt_list)
+        if not square_sum:
+            return 0.0
+        return sum(self.completed_cnt_list) ** 2 / (len(self.completed_cnt_list) * square_sum)
+
+    def print(self, title: str) -> None:
+        print(
+            f"{title} ops/sec:{self.throughput:.0f} fairness:{self.fairness:.3f}"
+            f" starved:{self.completed_cnt_list.count(0)}/{self.client_num} violation:{self.violation_cnt}"
+            f" expired:{self.expired_cnt}"
+            f" lost:{self.lost_cnt} command:{self.command_cnt} cost:{self.cost:.3f}s"
+        )
+        print(
+            f"    wakeup delivered:{self.metrics.wakeup_delivered_cnt} missed:{self.metrics.wakeup_missed_cnt}"
+            f" orphan:{self.metrics.wakeup_orphan_cnt}"
+        )
+        print_latency("    wait", self.wait_time_list)
+        print_latency("    wake latency", self.wake_latency_list)
+
+
+class _LockState(object):
+    """What the harness knows about a lock name"""
+
+    def __init__(self) -> None:
+        self.reader_cnt: int = 0
+        self.writer_cnt: int = 0
+        self.waiter_cnt: int = 0
+        # when the lock(or a permit) became free while somebody was waiting
+        self.free_time: Optional[float] = None
+
+
+def run_scenario(
+        client_num: int = 1000,
+        process_num: int = 10,
+        lock_num: int = 1,
+        duration: float = 10,
+        hold_time: float = 0.001,
+        think_time: float = 0.01,
+        read_ratio: float = 0.0,
+        permits: int = 0,
+        mixed: bool = False,
+        rw_policy: str = WRITER_PREFERRING,
+        timeout: int = 9,
+        rtt: float = 0.0002,
+        loss_rate: float = 0.0,
+        clock_drift: float = 0.0,
+        proxy_num: int = 8,
+        max_local_handoff: int = 0,
+        local_queue: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
+        seed: int = 0,
+) -> SimReport:
+    """
+    Every client loops for `duration` virtual seconds: it picks one of `lock_num` lock names, holds it for
+    an exponential time with mean `hold_time`, and thinks for an exponential time with mean `think_time`.
+    The clients are spread over `process_num` processes, each with its own Manager.
+    With read_ratio > 0 the clients use ReadLock and WriteLock, with permits > 0 they use a Semaphore
+    of `permits` permits, otherwise BaseLock. With permits > 0 and `mixed`, the odd lock names use BaseLock
+    instead, run it with proxy_num=1 so that the locks and the semaphores share the same proxy list.
+
+    The global `random` is seeded with `seed` too, since the retry policies jitter with it.
+    """
+    random.seed(seed)
+    rng: random.Random = random.Random(seed)
+    report: SimReport = SimReport(duration, client_num)
+    server: SimRedisServer = SimRedisServer(clock_drift=clock_drift, loss_rate=loss_rate, seed=seed)
+    lock_name_list: List[str] = [f"sim_lock_{i}" for i in range(lock_num)]
+    state_dict: Dict[str, _LockState] = {name: _LockState() for name in lock_name_list}
+    # how many holders each lock name allows at once, 0 means BaseLock or ReadLock/WriteLock
+    permits_dict: Dict[str, int] = {
+        name: 0 if mixed and i % 2 else permits for i, name in enumerate(lock_name_list)
+    }
+
+    async def _run_client(client_id: int, client: SimRedis, manager: Manager) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while loop.time() < duration:
+            name: str = lock_name_list[rng.randrange(lock_num)]
+            state: _LockState = state_dict[name]
+            name_permits: int = permits_dict[name]
+            if name_permits > 0:
+                lock: Any = Semaphore(client, manager, name, name_permits, timeout=timeout)  # type: ignore
+            elif read_ratio <= 0:
+                lock = BaseLock(client, manager, name, timeout=timeout)  # type: ignore
+            elif rng.random() < read_ratio:
+                lock = ReadLock(client, manager, name, timeout=timeout)  # type: ignore
+            else:
+                lock = WriteLock(client, manager, name, timeout=timeout)  # type: ignore
+            is_reader: bool = getattr(lock, "mode", "") == READ_MODE
+
+            start_time: float = loop.time()
+            state.waiter_cnt += 1
+            try:
+                async with lock:
+                    now: float = loop.time()
+                    state.waiter_cnt -= 1
+                    report.wait_time_list.append(now - start_time)
+                    if state.writer_cnt >= max(name_permits, 1) or (not is_reader and state.reader_cnt):
+                        report.violation_cnt += 1
+                    if state.free_time is not None:
+                        report.wake_latency_list.append(now - state.free_time)
+                        state.free_time = None
+                    if is_reader:
+                        state.reader_cnt += 1
+                    else:
+                        state.writer_cnt += 1
+
+                    await asyncio.sleep(rng.expovariate(1 / hold_time))
+
+                    if is_reader:
+                        state.reader_cnt -= 1
+                    else:
+                        state.writer_cnt -= 1
+                    if state.waiter_cnt and not state.reader_cnt and state.writer_cnt < max(name_permits, 1):
+                        if state.free_time is None:
+                            state.free_time = loop.time()
+            except LockNotOwnedError:
+                # the lock expired while being held
+                report.expired_cnt += 1
+            if loop.time() <= duration:
+                report.completed_cnt_list[client_id] += 1
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+
+    async def _main() -> None:
+        manager_list: List[Manager] = []
+        task_list: List[Any] = []
+        for i in range(process_num):
+            client: SimRedis = SimRedis(server, rtt=rtt)
+            manager: Manager = Manager(
+                client,  # type: ignore
+                proxy_num=proxy_num,
+                max_local_handoff=max_local_handoff,
+                local_queue=local_queue,
+                retry_policy=retry_policy,
+                rw_policy=rw_policy,
+                metrics=report.metrics,
+            )
+            manager.start()
+            manager_list.append(manager)
+            task_list.extend(
+                _run_client(client_id, client, manager) for client_id in range(i, client_num, process_num)
+            )
+        await asyncio.gather(*task_list)
+        for manager in manager_list:
+            manager.stop()
+        # wait for the proxies and the watch dogs to be cancelled
+        await asyncio.gather(
+            *[task for task in asyncio.all_tasks() if task is not asyncio.current_task()], return_exceptions=True
+        )
+
+    s_t: float = time.perf_counter()
+    loop: VirtualClockLoop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    # a release notified to a process without waiters is logged as an error, it is counted in the metrics
+    logging.disable(logging.ERROR)
+    try:
+        loop.run_until_complete(_main())
+    finally:
+        logging.disable(logging.NOTSET)
+        asyncio.set_event_loop(None)
+        loop.close()
+    report.cost = time.perf_counter() - s_t
+    report.lost_cnt = server.lost_cnt
+    report.command_cnt = server.command_cnt
+    return report
+
+
+def main() -> None:
+    print("-----contention-----")
+    for client_num in (10, 1000, 5000):
+        run_scenario(client_num=client_num).print(f"clients:{client_num}")
+    print("-----many locks-----")
+    run_scenario(client_num=1000, lock_num=50, duration=3, hold_time=0.01).print("locks:50")
+    print("-----local handoff-----")
+    run_scenario(max_local_handoff=16).print("max_local_handoff:16")
+    # every waiter is woken up by the proxy, instead of queueing behind the local waiter that competes in redis
+    run_scenario(local_queue=False).print("local_queue:False")
+    print("-----semaphore-----")
+    run_scenario(permits=32, hold_time=0.05).print("permits:32")
+    # a lock and a semaphore notify their waiters through the same proxy list
+    run_scenario(lock_num=2, permits=32, mixed=True, proxy_num=1, hold_time=0.05).print("mixed proxy_num:1")
+    print("-----rw lock-----")
+    run_scenario(client_num=1000, read_ratio=0.9).print(f"read_ratio:0.9 rw_policy:{WRITER_PREFERRING}")
+    print("-----message loss-----")
+    for loss_rate in (0.1, 0.5):
+        run_scenario(loss_rate=loss_rate).print(f"loss_rate:{loss_rate}")
+    print("-----clock drift-----")
+    # the watch dog renews a lock after a third of its timeout, the lock expires early on a fast redis clock
+    for clock_drift in (0.5, 3.0):
+        run_scenario(
+            client_num=20, duration=30, hold_time=0.5, think_time=0.1, timeout=1, clock_drift=clock_drift
+        ).print(f"clock_drift:{clock_drift}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""
+The locks for the synchronous workers(threads), e.g. a kombu consumer or a flask app.
+
+They run the same scripts as the asyncio locks and speak the same proxy protocol, so a sync worker and an
+asyncio worker can wait for the same lock and wake up each other. A process runs one SyncManager:
+a single wakeup thread BLPOPs all the proxy lists over one connection and wakes up the waiting threads,
+each waiter sleeps on its own threading.Condition, so a wakeup only wakes the threads it is meant for.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional
+from uuid import uuid1
+
+from redis import Redis
+from redis.exceptions import LockError, LockNotOwnedError
+
+from .base_lock import BaseLock
+from .core import WRITER_PREFERRING, AcquireLoop, LuaScriptMixin, Manager, WaiterQueue
+from .retry_policy import RetryPolicy
+from .rw_lock import ReadLock, WriteLock
+from .telemetry import LockKindMetrics, LockMetrics
+from .watch_dog import ExtendCommand, SyncWatchDogScheduler
+
+_PENDING: int = 0
+_WOKEN: int = 1
+_CANCELLED: int = 2
+
+
+class SyncWaiter(object):
+    """
+    A thread waiting for a wakeup.
+    It quacks like the asyncio.Future kept in the waiter table of Manager, so the wakeup policy is shared,
+    every method is called with the mutex of the SyncManager held.
+    """
+
+    def __init__(self, cond: threading.Condition) -> None:
+        self._cond = cond
+        self._state: int = _PENDING
+
+    def done(self) -> bool:
+        return self._state != _PENDING
+
+    def cancelled(self) -> bool:
+        return self._state == _CANCELLED
+
+    def cancel(self) -> bool:
+        if self._state != _PENDING:
+            return False
+        self._state = _CANCELLED
+        return True
+
+    def set_result(self, result: Any) -> None:
+        self._state = _WOKEN
+        self._cond.notify()
+
+
+class SyncManager(Manager):
+    watch_dog: SyncWatchDogScheduler
+
+    def __init__(
+            self,
+            client: Redis,
+            proxy_num: int = 8,
+            timeout: int = 5,
+            retry_policy: Optional[RetryPolicy] = None,
+            rw_policy: str = WRITER_PREFERRING,
+            phase_window: float = 0.1,
+            metrics: Optional[LockMetrics] = None,
+    ):
+        """
+        client: sync redis client, it is shared by all the threads
+        the other arguments are the same as Manager, Redis Cluster is not supported
+        """
+        super().__init__(
+            client,  # type: ignore
+            proxy_num=proxy_num,
+            timeout=timeout,
+            share_connection=True,
+            retry_policy=retry_policy,
+            rw_policy=rw_policy,
+            phase_window=phase_window,
+            metrics=metrics,
+        )
+        # guards the waiter table, the conditions of the waiters share it
+        self._mutex: threading.RLock = threading.RLock()
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _new_watch_dog(self) -> SyncWatchDogScheduler:
+        return SyncWatchDogScheduler(self.client)  # type: ignore
+
+    def time(self) -> float:
+        return time.monotonic()
+
+    ############
+    # listener #
+    ############
+    def listen(self, lock_name: str, lock_mode: str = "") -> SyncWaiter:  # type: ignore
+        with self._mutex:
+            if lock_name not in self.listener_dict:
+                self.listener_dict[lock_name] = WaiterQueue()
+            waiter: SyncWaiter = SyncWaiter(threading.Condition(self._mutex))
+            self.listener_dict[lock_name].append(lock_mode, waiter)  # type: ignore
+            return waiter
+
+    def acquire(  # type: ignore
+            self,
+            lock_name: str,
+            do_acquire: Callable[[], Optional[int]],
+            deadline: Optional[float],
+            lock_mode: str = "",
+    ) -> AcquireLoop:
+        """the blocking version of Manager.acquire, the thread sleeps in `wait` between two tries"""
+        acquire_loop: AcquireLoop = AcquireLoop(self, lock_name, lock_mode, deadline)
+        try:
+            while True:
+                if acquire_loop.should_try() and acquire_loop.on_result(do_acquire()):
+                    return acquire_loop
+                delay: Optional[float] = acquire_loop.get_delay()
+                if delay is None:
+                    return acquire_loop
+                self.wait(acquire_loop.listener, delay)  # type: ignore
+        finally:
+            acquire_loop.close()
+
+    def wait(self, waiter: SyncWaiter, timeout: Optional[float]) -> bool:
+        """block the thread until the waiter is woken up or timeout(second), return True if woken up"""
+        with self._mutex:
+            if not waiter.done():
+                waiter._cond.wait(timeout)
+            return waiter.done() and not waiter.cancelled()
+
+    def wakeup(self, lock_name: str) -> None:
+        with self._mutex:
+            super().wakeup(lock_name)
+
+    def give_up(self, lock_name: str, listener: Optional[SyncWaiter]) -> None:  # type: ignore
+        with self._mutex:
+            super().give_up(lock_name, listener)  # type: ignore
+
+    def empty(self, lock_name: str) -> bool:
+        with self._mutex:
+            return super().empty(lock_name)
+
+    #################
+    # wakeup thread #
+    #################
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                result: Optional[List[bytes]] = self.client.blpop(self._proxy_names, self.timeout)
+            except Exception as e:
+                logging.error(f"wakeup thread BLPOP failed, error:{e}")
+                self._stop_event.wait(1)
+                continue
+            if result is None:
+                continue
+            self.wakeup(result[1].decode())
+
+    def start(self) -> None:
+        if self._thread:
+            raise RuntimeError("wakeup thread already started")
+        self._thread = threading.Thread(target=self.run, name="lock-wakeup", daemon=True)
+        self._thread.start()
+        self.watch_dog.start()
+
+    def stop(self) -> None:
+        """wait for the wakeup thread to exit after its current BLPOP returns, the manager can be started again"""
+        if not self._thread or not self._thread.is_alive():
+            raise RuntimeError("wakeup thread not started")
+        self._stop_event.set()
+        self.watch_dog.stop()
+        self._thread.join()
+        self._thread = None
+        self._stop_event.clear()
+
+
+class SyncBaseLock(LuaScriptMixin):
+    """
+    The exclusive lock of the sync workers, it runs the scripts of BaseLock.
+    A lock object belongs to the thread that acquires it, the SyncManager and the client are shared.
+    """
+    mode: str = ""
+    metrics_kind: str = "sync_lock"
+    lua_acquire = None
+    lua_release = None
+    lua_extend = None
+    LUA_ACQUIRE_SCRIPT = BaseLock.LUA_ACQUIRE_SCRIPT
+    LUA_RELEASE_SCRIPT = BaseLock.LUA_RELEASE_SCRIPT
+    LUA_EXTEND_SCRIPT = BaseLock.LUA_EXTEND_SCRIPT
+
+    def __init__(
+            self,
+            client: Redis,
+            manager: SyncManager,
+            name: str,
+            timeout: int = 9,
+            blocking_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        timeout: the expiration time(second) of the lock, it is extended by the watch dog while the lock is held
+        blocking_timeout: the maximum time(second) to wait for the lock, None means wait forever
+        """
+        self._name = name
+        self._key: str = manager.key_layout.get_lock_key(name)
+        self._manager = manager
+        self._client = client
+        self._timeout = timeout
+        self._blocking_timeout = blocking_timeout
+        self._token: Optional[str] = None
+        self._metrics: LockKindMetrics = manager.metrics.get_kind(self.metrics_kind)
+        self._acquired_time: float = 0.0
+        self.register_scripts()
+
+    def __enter__(self):
+        if self.acquire():
+            self._manager.watch_dog.add(self)
+            return self
+        raise LockError("Unable to acquire lock within the time specified")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._manager.watch_dog.remove(self)
+        self.release()
+
+    @staticmethod
+    def _new_token() -> str:
+        return str(uuid1().hex) + str(threading.get_ident())
+
+    def _get_sub_key(self, suffix: str) -> str:
+        return self._manager.key_layout.get_sub_key(self._key, suffix)
+
+    ###########
+    # acquire #
+    ###########
+    def acquire(self) -> bool:
+        if self._token:
+            raise LockError("Lock already acquired")
+        start_time: float = self._manager.time()
+        deadline: Optional[float] = None
+        if self._blocking_timeout is not None:
+            deadline = start_time + self._blocking_timeout
+        token: str = self._new_token()
+        acquire_loop: AcquireLoop = self._manager.acquire(
+            self._key, lambda: self._do_acquire(token), deadline, self.mode
+        )
+        if acquire_loop.acquired:
+            self._token = token
+        self._acquired_time = self._manager.time()
+        self._metrics.on_acquire(self._acquired_time - start_time, acquire_loop.attempt, acquire_loop.acquired)
+        return acquire_loop.acquired
+
+    def _do_acquire(self, token: str) -> Optional[int]:
+        """return None if the lock was acquired, otherwise its ttl(millisecond)"""
+        return self.lua_acquire(
+            keys=[self._key, self._manager.get_proxy_name(self._key)],
+            args=[token, int(self._timeout * 1000)],
+            client=self._client,
+        )
+
+    ###########
+    # release #
+    ###########
+    def release(self) -> None:
+        token: Optional[str] = self._token
+        if token is None:
+            raise LockError("Cannot release an unlocked lock")
+        self._token = None
+        result: Optional[int] = self._do_release(token)
+        self._metrics.on_release(self._manager.time() - self._acquired_time, result is not None)
+        if result is None:
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+
+    def _do_release(self, token: str) -> Optional[int]:
+        return self.lua_release(
+            keys=[self._key, self._manager.get_proxy_name(self._key)], args=[token], client=self._client
+        )
+
+    #############
+    # watch dog #
+    #############
+    def _get_watch_interval(self) -> float:
+        return self._timeout / 3
+
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(self.lua_extend, [self._key], [self._token, int(self._timeout * 1000)])]
+
+
+class SyncReadLock(SyncBaseLock):
+    """The sync ReadLock, it shares the lock with the ReadLock of the asyncio workers"""
+    mode = "read"
+    metrics_kind = "sync_read"
+    LUA_ACQUIRE_SCRIPT = ReadLock.LUA_ACQUIRE_SCRIPT
+    LUA_RELEASE_SCRIPT = ReadLock.LUA_RELEASE_SCRIPT
+    LUA_EXTEND_SCRIPT = ReadLock.LUA_EXTEND_SCRIPT
+
+    def _do_acquire(self, token: str) -> Optional[int]:
+        return self.lua_acquire(
+            keys=[
+                self._key,
+                self._get_sub_key("readers"),
+                self._get_sub_key("write"),
+                self._get_sub_key("read_wait"),
+                self._get_sub_key("read_phase"),
+                self._manager.get_proxy_name(self._key),
+            ],
+            args=[token, int(self._timeout * 1000), self._manager.rw_policy],
+            client=self._client,
+        )
+
+    def _do_release(self, token: str) -> Optional[int]:
+        return self.lua_release(
+            keys=[
+                self._key,
+                self._get_sub_key("readers"),
+                self._get_sub_key("read_phase"),
+                self._get_sub_key("read_wait"),
+                self._manager.get_proxy_name(self._key),
+            ],
+            args=[token],
+            client=self._client,
+        )
+
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(
+            self.lua_extend, [self._key, self._get_sub_key("readers")], [self._token, int(self._timeout * 1000)]
+        )]
+
+
+class SyncWriteLock(SyncBaseLock):
+    """The sync WriteLock, it shares the lock with the WriteLock of the asyncio workers"""
+    mode = "write"
+    metrics_kind = "sync_write"
+    LUA_ACQUIRE_SCRIPT = WriteLock.LUA_ACQUIRE_SCRIPT
+    LUA_RELEASE_SCRIPT = WriteLock.LUA_RELEASE_SCRIPT
+    LUA_EXTEND_SCRIPT = WriteLock.LUA_EXTEND_SCRIPT
+
+    def _do_acquire(self, token: str) -> Optional[int]:
+        return self.lua_acquire(
+            keys=[
+                self._key,
+                self._get_sub_key("write"),
+                self._get_sub_key("read_wait"),
+                self._get_sub_key("read_phase"),
+                self._manager.get_proxy_name(self._key),
+            ],
+            args=[token, int(self._timeout * 1000), self._manager.rw_policy, int(self._manager.phase_window * 1000)],
+            client=self._client,
+        )
+
+    def _do_release(self, token: str) -> Optional[int]:
+        return self.lua_release(
+            keys=[self._key, self._get_sub_key("write"), self._manager.get_proxy_name(self._key)],
+            args=[token],
+            client=self._client,
+        )
+
+
+def demo(manager: SyncManager, client: Redis) -> None:
+    with SyncBaseLock(client, manager, "demo", timeout=3):
+        print(f"Timestamp:{time.time()} Thread:{threading.get_ident()}, run")
+        time.sleep(1)
+
+
+def main():
+    _redis = Redis()
+    manager = SyncManager(client=_redis)
+    manager.start()
+    thread_list: List[threading.Thread] = [threading.Thread(target=demo, args=(manager, _redis)) for _ in range(3)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    manager.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+from bisect import bisect_right
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+class Histogram(object):
+    """
+    HDR style log-linear histogram of durations.
+
+    Values are recorded in microseconds, every power of two range is split into 2 ** sub_bucket_bits linear
+    buckets, so the relative error is below 1 / 2 ** sub_bucket_bits whatever the magnitude.
+    Recording is a binary search over the precomputed bucket edges(done in C by bisect) and a list increment,
+    the count is summed at export time.
+    """
+    __slots__ = ("_sub_bucket_bits", "_linear_max", "_counts", "_edges", "sum")
+
+    def __init__(self, sub_bucket_bits: int = 3, max_bit_length: int = 40) -> None:
+        self._sub_bucket_bits: int = sub_bucket_bits
+        self._linear_max: int = 1 << (sub_bucket_bits + 1)
+        # values >= 2 ** max_bit_length us (~12 days) go to the last bucket
+        self._counts: List[int] = [0] * ((max_bit_length - sub_bucket_bits) << sub_bucket_bits)
+        # the exclusive upper edge(second) of each bucket, bucket i holds the durations in [edges[i-1], edges[i])
+        self._edges: List[float] = [
+            (self._get_upper_bound(index) + 1) / 1000000 for index in range(len(self._counts) - 1)
+        ] + [float("inf")]
+        self.sum: float = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def _get_upper_bound(self, index: int) -> int:
+        """the largest value(us) of the bucket"""
+        if index < self._linear_max:
+            return index
+        shift: int = (index >> self._sub_bucket_bits) - 1
+        mantissa: int = index - (shift << self._sub_bucket_bits)
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float) -> None:
+        self._counts[bisect_right(self._edges, seconds)] += 1
+        self.sum += seconds
+
+    def iter_bucket(self) -> Iterator[Tuple[float, int]]:
+        """yield (upper bound(second), count) of the non-empty buckets in order"""
+        for index, count in enumerate(self._counts):
+            if count:
+                yield self._get_upper_bound(index) / 1000000, count
+
+    def percentile(self, p: float) -> float:
+        """the upper bound(second) of the bucket that holds the p-th percentile"""
+        count: int = self.count
+        if not count:
+            return 0.0
+        target: float = count * p / 100
+        cumulative: int = 0
+        upper_bound: float = 0.0
+        for upper_bound, count in self.iter_bucket():
+            cumulative += count
+            if cumulative >= target:
+                break
+        return upper_bound
+
+
+class LockKindMetrics(object):
+    """
+    The metrics of one kind of lock, e.g. all the ReadLock of a Manager.
+    Every acquire and release is recorded in a histogram, so their totals are read from the histograms
+    at export time instead of being counted by the hooks
+    """
+    __slots__ = ("acquire_timeout_cnt", "retry_cnt", "reentry_cnt", "release_not_owned_cnt", "wait_time", "hold_time")
+
+    def __init__(self) -> None:
+        self.acquire_timeout_cnt: int = 0
+        self.retry_cnt: int = 0
+        self.reentry_cnt: int = 0
+        self.release_not_owned_cnt: int = 0
+        self.wait_time: Histogram = Histogram()
+        self.hold_time: Histogram = Histogram()
+
+    @property
+    def acquire_cnt(self) -> int:
+        return self.wait_time.count - self.acquire_timeout_cnt
+
+    @property
+    def release_cnt(self) -> int:
+        return self.hold_time.count
+
+    def on_acquire(self, wait_time: float, retry_cnt: int, acquired: bool) -> None:
+        if not acquired:
+            self.acquire_timeout_cnt += 1
+        if retry_cnt:
+            self.retry_cnt += retry_cnt
+        self.wait_time.record(wait_time)
+
+    def on_release(self, hold_time: float, owned: bool) -> None:
+        if not owned:
+            self.release_not_owned_cnt += 1
+        self.hold_time.record(hold_time)
+
+
+class LockMetrics(object):
+    """
+    The metrics of a Manager, the counters are plain attributes so that the hooks stay cheap,
+    use a MetricsSink to export them
+    """
+
+    def __init__(self) -> None:
+        self.kind_dict: Dict[str, LockKindMetrics] = {}
+        # the proxy popped a notification and woke up a waiter
+        self.wakeup_delivered_cnt: int = 0
+        # the proxy popped a notification but no waiter was waiting for it (already done or cancelled)
+        self.wakeup_missed_cnt: int = 0
+        # the proxy popped a notification of a lock this process does not listen to
+        self.wakeup_orphan_cnt: int = 0
+        self.local_handoff_cnt: int = 0
+        # counters and gauges read at export time, e.g. the watch dog metrics
+        self.counter_func_dict: Dict[str, Callable[[], float]] = {}
+        self.gauge_func_dict: Dict[str, Callable[[], float]] = {}
+
+    def get_kind(self, kind: str) -> LockKindMetrics:
+        if kind not in self.kind_dict:
+            self.kind_dict[kind] = LockKindMetrics()
+        return self.kind_dict[kind]
+
+    def register_counter(self, name: str, func: Callable[[], float]) -> None:
+        """func returns a value that only grows, the name should end with _total"""
+        self.counter_func_dict[name] = func
+
+    def register_gauge(self, name: str, func: Callable[[], float]) -> None:
+        self.gauge_func_dict[name] = func
+
+
+class MetricsSink(object):
+    def export(self, metrics: LockMetrics) -> object:
+        raise NotImplementedError()
+
+
+class PrometheusTextSink(MetricsSink):
+    """Render the metrics in the Prometheus text exposition format"""
+
+    def __init__(self, namespace: str = "redis_lock") -> None:
+        self.namespace = namespace
+
+    def _render_counter(self, name: str, value_list: List[Tuple[str, float]]) -> List[str]:
+        name = f"{self.namespace}_{name}"
+        line_list: List[str] = [f"# TYPE {name} counter"]
+        for label, value in value_list:
+            line_list.append(f"{name}{label} {value}")
+        return line_list
+
+    def _render_histogram(self, name: str, histogram_list: List[Tuple[str, Histogram]]) -> List[str]:
+        name = f"{self.namespace}_{name}"
+        line_list: List[str] = [f"# TYPE {name} histogram"]
+        for kind, histogram in histogram_list:
+            cumulative: int = 0
+            for upper_bound, count in histogram.iter_bucket():
+                cumulative += count
+                line_list.append(f'{name}_bucket{{kind="{kind}",le="{upper_bound}"}} {cumulative}')
+            line_list.append(f'{name}_bucket{{kind="{kind}",le="+Inf"}} {histogram.count}')
+            line_list.append(f'{name}_sum{{kind="{kind}"}} {histogram.sum}')
+            line_list.append(f'{name}_count{{kind="{kind}"}} {histogram.count}')
+        return line_list
+
+    def export(self, metrics: LockMetrics) -> str:
+        kind_list: List[Tuple[str, LockKindMetrics]] = sorted(metrics.kind_dict.items())
+        line_list: List[str] = []
+        for name, attr in (
+                ("acquire_total", "acquire_cnt"),
+                ("acquire_timeout_total", "acquire_timeout_cnt"),
+                ("retry_total", "retry_cnt"),
+                ("reentry_total", "reentry_cnt"),
+                ("release_total", "release_cnt"),
+                ("release_not_owned_total", "release_not_owned_cnt"),
+        ):
+            line_list.extend(self._render_counter(
+                name, [(f'{{kind="{kind}"}}', getattr(kind_metrics, attr)) for kind, kind_metrics in kind_list]
+            ))
+        line_list.extend(self._render_histogram(
+            "wait_seconds", [(kind, kind_metrics.wait_time) for kind, kind_metrics in kind_list]
+        ))
+        line_list.extend(self._render_histogram(
+            "hold_seconds", [(kind, kind_metrics.hold_time) for kind, kind_metrics in kind_list]
+        ))
+        line_list.extend(self._render_counter("wakeup_total", [
+            ('{result="delivered"}', metrics.wakeup_delivered_cnt),
+            ('{result="missed"}', metrics.wakeup_missed_cnt),
+            ('{result="orphan"}', metrics.wakeup_orphan_cnt),
+        ]))
+        line_list.extend(self._render_counter("local_handoff_total", [("", metrics.local_handoff_cnt)]))
+        for name, func in sorted(metrics.counter_func_dict.items()):
+            line_list.extend(self._render_counter(name, [("", func())]))
+        for name, func in sorted(metrics.gauge_func_dict.items()):
+            name = f"{self.namespace}_{name}"
+            line_list.append(f"# TYPE {name} gauge")
+            line_list.append(f"{name} {func()}")
+        return "\n".join(line_list) + "\n"
@@ -1,13 +1,194 @@
 import asyncio
+import heapq
+import itertools
+import logging
+import threading
 import time
-from typing import Optional, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
+from redis import Redis as SyncRedis
 from redis.asyncio import Redis
 from redis.asyncio.lock import Lock
+from redis.commands.core import AsyncScript
+
+# (script, keys, args) of a single extend call
+ExtendCommand = Tuple[AsyncScript, List[Any], List[Any]]
+
+
+class WatchDogScheduler(object):
+    """
+    One watch dog for all the locks held by a process.
+
+    Instead of a task and a timer per lock, the locks are kept in a heap ordered by their due time,
+    every tick the scheduler pops the due locks and renews them with one pipelined batch.
+
+    A lock plugs in by implementing:
+        _get_extend_command_list() -> List[ExtendCommand], the lock is renewed if every command returns true
+        _get_watch_interval() -> float, the interval(second) between two renewals
+    """
+
+    def __init__(self, client: Redis, tick: float = 0.1) -> None:
+        self._client = client
+        self._tick = tick
+        self._seq_iter: Iterator[int] = itertools.count()
+        # (due time, seq, lock), the entries of removed locks are skipped when popped
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq_dict: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # metrics
+        self.renewed_cnt: int = 0
+        self.failed_cnt: int = 0
+
+    @property
+    def held_cnt(self) -> int:
+        return len(self._seq_dict)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {"held": self.held_cnt, "renewed": self.renewed_cnt, "failed": self.failed_cnt}
+
+    def _time(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def add(self, lock: Any) -> None:
+        seq: int = next(self._seq_iter)
+        self._seq_dict[id(lock)] = seq
+        heapq.heappush(self._heap, (self._time() + lock._get_watch_interval(), seq, lock))
+
+    def remove(self, lock: Any) -> None:
+        self._seq_dict.pop(id(lock), None)
+
+    def _pop_due_lock_list(self) -> List[Any]:
+        now: float = self._time()
+        lock_list: List[Any] = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, lock = heapq.heappop(self._heap)
+            if self._seq_dict.get(id(lock)) == seq:
+                lock_list.append(lock)
+        return lock_list
+
+    async def _renew(self, lock_list: List[Any]) -> None:
+        command_list_list: List[List[ExtendCommand]] = [lock._get_extend_command_list() for lock in lock_list]
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for command_list in command_list_list:
+                    for script, keys, args in command_list:
+                        await script(keys=keys, args=args, client=pipe)
+                result_list: List[Any] = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            logging.error(f"Failed to extend {len(lock_list)} locks, error:{e}")
+            result_list = [0] * sum(len(command_list) for command_list in command_list_list)
+
+        index: int = 0
+        for lock, command_list in zip(lock_list, command_list_list):
+            lock_result_list: List[Any] = result_list[index:index + len(command_list)]
+            index += len(command_list)
+            if all(result and not isinstance(result, Exception) for result in lock_result_list):
+                self.renewed_cnt += 1
+            else:
+                self.failed_cnt += 1
+                logging.error(f"Failed to extend the lock:{getattr(lock, '_name', None) or getattr(lock, 'name')}")
+
+    async def run(self) -> None:
+        while True:
+            lock_list: List[Any] = self._pop_due_lock_list()
+            if lock_list:
+                await self._renew(lock_list)
+                # the lock may be released while being renewed
+                for lock in lock_list:
+                    seq: Optional[int] = self._seq_dict.get(id(lock))
+                    if seq is not None:
+                        heapq.heappush(self._heap, (self._time() + lock._get_watch_interval(), seq, lock))
+            await asyncio.sleep(self._tick)
+
+    def start(self) -> None:
+        if self._task:
+            raise RuntimeError("watch dog already started")
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if not self._task or self._task.done():
+            raise RuntimeError("watch dog not started")
+        self._task.cancel()
+
+
+class SyncWatchDogScheduler(WatchDogScheduler):
+    """The WatchDogScheduler of the sync locks, it renews the locks in a background thread"""
+
+    def __init__(self, client: SyncRedis, tick: float = 0.1) -> None:
+        super().__init__(client, tick)  # type: ignore
+        self._mutex: threading.Lock = threading.Lock()
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _time(self) -> float:
+        return time.monotonic()
+
+    def add(self, lock: Any) -> None:
+        with self._mutex:
+            super().add(lock)
+
+    def remove(self, lock: Any) -> None:
+        with self._mutex:
+            super().remove(lock)
+
+    def _pop_due_lock_list(self) -> List[Any]:
+        with self._mutex:
+            return super()._pop_due_lock_list()
+
+    def _renew_sync(self, lock_list: List[Any]) -> None:
+        command_list_list: List[List[ExtendCommand]] = [lock._get_extend_command_list() for lock in lock_list]
+        try:
+            with self._client.pipeline(transaction=False) as pipe:
+                for command_list in command_list_list:
+                    for script, keys, args in command_list:
+                        script(keys=keys, args=args, client=pipe)
+                result_list: List[Any] = pipe.execute(raise_on_error=False)
+        except Exception as e:
+            logging.error(f"Failed to extend {len(lock_list)} locks, error:{e}")
+            result_list = [0] * sum(len(command_list) for command_list in command_list_list)
+
+        index: int = 0
+        for lock, command_list in zip(lock_list, command_list_list):
+            lock_result_list: List[Any] = result_list[index:index + len(command_list)]
+            index += len(command_list)
+            if all(result and not isinstance(result, Exception) for result in lock_result_list):
+                self.renewed_cnt += 1
+            else:
+                self.failed_cnt += 1
+                logging.error(f"Failed to extend the lock:{lock._name}")
+
+    def run_sync(self) -> None:
+        while not self._stop_event.is_set():
+            lock_list: List[Any] = self._pop_due_lock_list()
+            if lock_list:
+                self._renew_sync(lock_list)
+                with self._mutex:
+                    for lock in lock_list:
+                        seq: Optional[int] = self._seq_dict.get(id(lock))
+                        if seq is not None:
+                            heapq.heappush(self._heap, (self._time() + lock._get_watch_interval(), seq, lock))
+            self._stop_event.wait(self._tick)
+
+    def start(self) -> None:
+        if self._thread:
+            raise RuntimeError("watch dog already started")
+        self._thread = threading.Thread(target=self.run_sync, name="lock-watch-dog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self._thread or not self._thread.is_alive():
+            raise RuntimeError("watch dog not started")
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self._stop_event.clear()
 
 
 class WithWatchDogLock(Lock):
     _watch_dog: Optional[asyncio.Future]
+    # if set, the lock is renewed by the scheduler instead of its own task
+    watch_dog_scheduler: Optional[WatchDogScheduler] = None
 
     async def _watch(self) -> None:
         while True:
@@ -15,10 +196,18 @@ class WithWatchDogLock(Lock):
             await asyncio.sleep(self.timeout / 3)
 
     def _cancel_watch_dog(self) -> None:
+        if self.watch_dog_scheduler:
+            self.watch_dog_scheduler.remove(self)
         _old_watch_dog: Optional[asyncio.Future] = getattr(self, "_watch_dog", None)
         if _old_watch_dog and not _old_watch_dog.cancelled():
             _old_watch_dog.cancel()
 
+    def _get_extend_command_list(self) -> List[ExtendCommand]:
+        return [(self.lua_extend, [self.name], [self.local.token, int(self.timeout * 1000), "1"])]
+
+    def _get_watch_interval(self) -> float:
+        return self.timeout / 3
+
     async def acquire(
             self,
             blocking: Optional[bool] = None,
@@ -28,7 +217,10 @@ class WithWatchDogLock(Lock):
         result = await super().acquire(blocking, blocking_timeout, token)
         if result:
             self._cancel_watch_dog()
-            self._watch_dog = asyncio.create_task(self._watch())
+            if self.watch_dog_scheduler:
+                self.watch_dog_scheduler.add(self)
+            else:
+                self._watch_dog = asyncio.create_task(self._watch())
         return result
 
     async def do_release(self, expected_token: bytes) -> None:
@@ -0,0 +1,94 @@
+"""
+Benchmarks for redis_rate_limiter, they need a local redis-server.
+
+    python -m example_python.redis_rate_limiter.benchmark
+"""
+import asyncio
+import time
+from typing import Callable, Dict, List
+
+from redis.asyncio import Redis
+
+from .rate_limiter import RateLimiter, SlidingWindowLog, TokenBucket
+
+LIMITER_DICT: Dict[str, Callable[[Redis, int], RateLimiter]] = {
+    "token_bucket": lambda client, prefetch: TokenBucket(
+        client, rate=1000000, capacity=1000000, prefix="bench_token_bucket", prefetch=prefetch
+    ),
+    "sliding_window": lambda client, prefetch: SlidingWindowLog(
+        client, limit=1000000, window=1, prefix="bench_sliding_window", prefetch=prefetch
+    ),
+}
+
+
+async def command_count(client: Redis) -> int:
+    return int((await client.info("stats"))["total_commands_processed"])
+
+
+async def clean(client: Redis) -> None:
+    key_list: List[bytes] = await client.keys("bench_*")
+    if key_list:
+        await client.delete(*key_list)
+
+
+###########
+# acquire #
+###########
+async def bench_acquire(
+        client: Redis, limiter_name: str, prefetch: int, task_num: int = 100, loop_num: int = 100
+) -> None:
+    """Checks per second of one name, and the redis commands they cost"""
+    await clean(client)
+    limiter: RateLimiter = LIMITER_DICT[limiter_name](client, prefetch)
+
+    async def _run() -> None:
+        for _ in range(loop_num):
+            await limiter.acquire("bench")
+
+    before_cnt: int = await command_count(client)
+    s_t: float = time.perf_counter()
+    await asyncio.gather(*[_run() for _ in range(task_num)])
+    cost: float = time.perf_counter() - s_t
+    # the info command itself is counted
+    cmd_cnt: int = await command_count(client) - before_cnt - 1
+    check_cnt: int = task_num * loop_num
+    print(
+        f"{limiter_name} prefetch:{prefetch} checks:{check_cnt} cost:{cost:.3f}s"
+        f" checks/sec:{check_cnt / cost:.0f} redis commands:{cmd_cnt}"
+    )
+
+
+################
+# acquire many #
+################
+async def bench_acquire_many(client: Redis, limiter_name: str, batch_size: int, loop_num: int = 200) -> None:
+    """Names checked per second when the names of a request are checked together"""
+    await clean(client)
+    limiter: RateLimiter = LIMITER_DICT[limiter_name](client, 0)
+    name_list: List[str] = [f"bench_{i}" for i in range(batch_size)]
+
+    s_t: float = time.perf_counter()
+    for _ in range(loop_num):
+        await limiter.acquire_many(name_list)
+    cost: float = time.perf_counter() - s_t
+    print(
+        f"{limiter_name} batch:{batch_size} cost:{cost:.3f}s"
+        f" names/sec:{batch_size * loop_num / cost:.0f} batches/sec:{loop_num / cost:.0f}"
+    )
+
+
+async def main() -> None:
+    client = Redis()
+    print("-----acquire-----")
+    for limiter_name in LIMITER_DICT:
+        for prefetch in (0, 10, 100):
+            await bench_acquire(client, limiter_name, prefetch)
+    print("-----acquire many-----")
+    for limiter_name in LIMITER_DICT:
+        for batch_size in (1, 10, 100):
+            await bench_acquire_many(client, limiter_name, batch_size)
+    await clean(client)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,273 @@
+"""
+Rate limiters kept in redis, every check is a single script call instead of `incrby` + `expire`.
+
+    TokenBucket: `rate` tokens per second are added to a bucket of `capacity` tokens, bursts up to capacity
+    SlidingWindowLog: at most `limit` tokens in any `window` seconds, the granted tokens are logged in a sorted set
+
+Both take the time from the redis server, so the clocks of the clients do not matter.
+
+A limiter can prefetch: a process leases a chunk of tokens with one call and hands them out locally,
+so most checks never touch redis. The price is accuracy: the leased tokens are only used for a limited
+time(see `_get_lease_time`) and the tokens left unused are lost, while the tokens used late may exceed the
+limit of the moment by at most the tokens leased out(prefetch per process and name).
+"""
+import asyncio
+from typing import Dict, List, Optional
+from uuid import uuid1
+
+from redis.asyncio import Redis
+
+from ..redis_distributed_lock.core import LuaScriptMixin
+
+
+class LocalLease(object):
+    """The tokens of a name leased by this process"""
+
+    def __init__(self, tokens: int, expire_time: float) -> None:
+        self.tokens: int = tokens
+        # the loop time after which the tokens must not be used any more
+        self.expire_time: float = expire_time
+
+
+class RateLimiter(LuaScriptMixin):
+    lua_acquire = None
+    LUA_ACQUIRE_SCRIPT = None
+
+    def __init__(self, client: Redis, prefix: str, max_tokens: int, prefetch: int = 0) -> None:
+        """
+        prefix: the prefix of the keys, the key of a name is `{prefix}:{name}`
+        max_tokens: the most tokens a single check can ask for
+        prefetch: how many tokens a process leases from redis at once, 0 means every check goes to redis
+        """
+        if prefetch > max_tokens:
+            raise ValueError(f"prefetch must not be greater than {max_tokens}")
+        self._client = client
+        self._prefix = prefix
+        self._max_tokens = max_tokens
+        self._prefetch = prefetch
+        self._lease_dict: Dict[str, LocalLease] = {}
+        # name -> the lease being fetched, the other checks of the name wait for it instead of fetching again
+        self._lease_future_dict: Dict[str, asyncio.Future] = {}
+        self.register_scripts()
+
+    def _get_key(self, name: str) -> str:
+        return f"{self._prefix}:{name}"
+
+    def _get_args(self, requested: int, minimum: int) -> list:
+        """the ARGV of the acquire script"""
+        raise NotImplementedError()
+
+    def _get_lease_time(self) -> float:
+        """how long(second) the leased tokens can be used"""
+        raise NotImplementedError()
+
+    ###########
+    # acquire #
+    ###########
+    async def acquire(self, name: str, tokens: int = 1) -> bool:
+        """take `tokens` tokens of the name, return False if the name is over its limit"""
+        if tokens > self._max_tokens:
+            raise ValueError(f"tokens must not be greater than {self._max_tokens}")
+        if tokens > self._prefetch:
+            return await self._do_acquire(name, tokens, tokens) > 0
+
+        while True:
+            if self._take_local(name, tokens):
+                return True
+            lease_future: Optional[asyncio.Future] = self._lease_future_dict.get(name)
+            if lease_future is None:
+                return await self._lease(name, tokens)
+            if not await asyncio.shield(lease_future):
+                return False
+
+    async def acquire_many(self, name_list: List[str], tokens: int = 1) -> List[bool]:
+        """take `tokens` tokens of every name, the names that are not served locally are checked in one round trip"""
+        if tokens > self._max_tokens:
+            raise ValueError(f"tokens must not be greater than {self._max_tokens}")
+        result_list: List[bool] = [False] * len(name_list)
+        index_list: List[int] = []
+        for index, name in enumerate(name_list):
+            if tokens <= self._prefetch and self._take_local(name, tokens):
+                result_list[index] = True
+            else:
+                index_list.append(index)
+        if not index_list:
+            return result_list
+
+        requested: int = max(self._prefetch, tokens)
+        send_time: float = asyncio.get_running_loop().time()
+        async with self._client.pipeline(transaction=False) as pipe:
+            for index in index_list:
+                await self.lua_acquire(
+                    keys=[self._get_key(name_list[index])], args=self._get_args(requested, tokens), client=pipe
+                )
+            granted_list: List[int] = await pipe.execute()
+        for index, granted in zip(index_list, granted_list):
+            if not granted:
+                continue
+            result_list[index] = True
+            if granted > tokens:
+                self._lease_dict[name_list[index]] = LocalLease(granted - tokens, send_time + self._get_lease_time())
+        return result_list
+
+    def _take_local(self, name: str, tokens: int) -> bool:
+        lease: Optional[LocalLease] = self._lease_dict.get(name)
+        if lease is None:
+            return False
+        if lease.expire_time <= asyncio.get_running_loop().time():
+            self._lease_dict.pop(name, None)
+            return False
+        if lease.tokens < tokens:
+            return False
+        lease.tokens -= tokens
+        return True
+
+    async def _lease(self, name: str, tokens: int) -> bool:
+        """lease a chunk of tokens of the name, `tokens` of them are taken by the caller"""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        lease_future: asyncio.Future = loop.create_future()
+        self._lease_future_dict[name] = lease_future
+        granted: int = 0
+        try:
+            send_time: float = loop.time()
+            granted = await self._do_acquire(name, self._prefetch, tokens)
+            if granted > tokens:
+                self._lease_dict[name] = LocalLease(granted - tokens, send_time + self._get_lease_time())
+        finally:
+            self._lease_future_dict.pop(name, None)
+            lease_future.set_result(granted > 0)
+        return granted > 0
+
+    async def _do_acquire(self, name: str, requested: int, minimum: int) -> int:
+        """return the number of tokens granted, between minimum and requested, or 0"""
+        return await self.lua_acquire(
+            keys=[self._get_key(name)], args=self._get_args(requested, minimum), client=self._client
+        )
+
+
+class TokenBucket(RateLimiter):
+    """
+    data struct
+    {prefix}:{name}: {"tokens": {tokens left}, "ts": {last update time(millisecond)}}
+
+    A bucket expires once it would be full again, a missing bucket is full
+    """
+
+    def __init__(
+            self, client: Redis, rate: float, capacity: int, prefix: str = "token_bucket", prefetch: int = 0
+    ) -> None:
+        """
+        rate: tokens added per second
+        capacity: the size of the bucket, that is the largest burst
+        """
+        self._rate = rate
+        self._capacity = capacity
+        super().__init__(client, prefix, capacity, prefetch=prefetch)
+
+    ###########
+    # acquire #
+    ###########
+    lua_acquire = None
+    # KEYS[1] - bucket name
+    # ARGV[1] - rate(tokens per second)
+    # ARGV[2] - capacity
+    # ARGV[3] - requested tokens
+    # ARGV[4] - minimum tokens, fewer tokens than that are not granted
+    # return the number of tokens granted
+    LUA_ACQUIRE_SCRIPT = """
+    local now = redis.call('time');
+    local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000);
+    local rate = tonumber(ARGV[1]);
+    local capacity = tonumber(ARGV[2]);
+    local bucket = redis.call('hmget', KEYS[1], 'tokens', 'ts');
+    local tokens = tonumber(bucket[1]);
+    if (tokens == nil) then
+        tokens = capacity;
+    else
+        tokens = math.min(capacity, tokens + math.max(now_ms - tonumber(bucket[2]), 0) * rate / 1000);
+    end;
+    local granted = math.min(tonumber(ARGV[3]), math.floor(tokens));
+    if (granted < tonumber(ARGV[4])) then
+        granted = 0;
+    end;
+    redis.call('hset', KEYS[1], 'tokens', tokens - granted, 'ts', now_ms);
+    redis.call('pexpire', KEYS[1], math.ceil((capacity - tokens + granted) * 1000 / rate) + 1);
+    return granted;
+    """
+
+    def _get_args(self, requested: int, minimum: int) -> list:
+        return [self._rate, self._capacity, requested, minimum]
+
+    def _get_lease_time(self) -> float:
+        # the bucket is full again after that time, the tokens used later would come on top of a full bucket
+        return self._capacity / self._rate
+
+
+class SlidingWindowLog(RateLimiter):
+    """
+    data struct
+    {prefix}:{name}: {"{call id}:{i}": grant time(millisecond)}
+
+    Every granted token is logged, the tokens older than the window are dropped on the next check
+    """
+
+    def __init__(
+            self, client: Redis, limit: int, window: float, prefix: str = "sliding_window", prefetch: int = 0
+    ) -> None:
+        """
+        limit: the most tokens granted in any window
+        window: the length(second) of the window
+        """
+        self._limit = limit
+        self._window = window
+        super().__init__(client, prefix, limit, prefetch=prefetch)
+
+    ###########
+    # acquire #
+    ###########
+    lua_acquire = None
+    # KEYS[1] - log name
+    # ARGV[1] - limit
+    # ARGV[2] - window(millisecond)
+    # ARGV[3] - requested tokens
+    # ARGV[4] - minimum tokens, fewer tokens than that are not granted
+    # ARGV[5] - unique id of the call, the tokens are logged as {id}:{i}
+    # return the number of tokens granted
+    LUA_ACQUIRE_SCRIPT = """
+    local now = redis.call('time');
+    local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000);
+    local window = tonumber(ARGV[2]);
+    redis.call('zremrangebyscore', KEYS[1], '-inf', now_ms - window);
+    local granted = math.min(tonumber(ARGV[3]), tonumber(ARGV[1]) - redis.call('zcard', KEYS[1]));
+    if (granted < tonumber(ARGV[4])) then
+        return 0;
+    end;
+    for i = 1, granted do
+        redis.call('zadd', KEYS[1], now_ms, ARGV[5] .. ':' .. i);
+    end;
+    redis.call('pexpire', KEYS[1], window);
+    return granted;
+    """
+
+    def _get_args(self, requested: int, minimum: int) -> list:
+        return [self._limit, int(self._window * 1000), requested, minimum, uuid1().hex]
+
+    def _get_lease_time(self) -> float:
+        # the leased tokens are logged when leased, using them after they left the window would exceed the limit
+        return self._window
+
+
+async def demo(limiter: RateLimiter) -> None:
+    for i in range(5):
+        print(f"request:{i} allowed:{await limiter.acquire('demo')}")
+    print(await limiter.acquire_many(["demo", "demo_1", "demo_2"]))
+
+
+async def main():
+    _redis = Redis()
+    await demo(TokenBucket(_redis, rate=1, capacity=3))
+    await demo(SlidingWindowLog(_redis, limit=3, window=1, prefetch=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,3 +1,10 @@
+import asyncio
+import time
+from array import array
+from typing import Optional
+
+from .clock import Clock, SleepWait, SystemClock, WaitStrategy
+
 # Twitter元年时间戳
 TWEPOCH = 1288834974657
 
@@ -8,7 +15,19 @@ class InvalidSystemClock(Exception):
 
 class SnowflakeWorker(object):
 
-    def __init__(self, area_id: int, worker_id: int, sequence: int = 0, area_id_bit: int = 3) -> None:
+    def __init__(
+            self,
+            area_id: int,
+            worker_id: int,
+            sequence: int = 0,
+            area_id_bit: int = 3,
+            clock: Optional[Clock] = None,
+            wait_strategy: Optional[WaitStrategy] = None,
+    ) -> None:
+        """
+        clock: 获取时间的时钟, 默认是系统时间
+        wait_strategy: 当前毫秒的序列号用完后等待下一毫秒的方式, 默认休眠
+        """
         # 区域id与服务器id的计算
         worker_id_bit: int = 10 - area_id_bit
         max_worker_id: int = -1 ^ (-1 << worker_id_bit)
@@ -18,16 +37,16 @@ class SnowflakeWorker(object):
         self.sequence_bit: int = 12
         self.worker_id_shift: int = self.sequence_bit
         self.main_id_shift: int = self.sequence_bit + worker_id_bit
-        self.timestamp_shift: int = self.sequence_bit + worker_id_bit + worker_id_bit
+        self.timestamp_shift: int = self.sequence_bit + worker_id_bit + area_id_bit
 
         # 序号循环掩码
-        self.sequence_mask: int = -1 ^ (-1 < self.sequence_bit)
+        self.sequence_mask: int = -1 ^ (-1 << self.sequence_bit)
 
         if worker_id > max_worker_id or worker_id < 0:
             raise ValueError(f"work id bit must between 0 and {max_worker_id}")
 
-        if area_id > max_area_id or area_id_bit < 0:
-            raise ValueError(f"area id bit must between 0 and {max}")
+        if area_id > max_area_id or area_id < 0:
+            raise ValueError(f"area id bit must between 0 and {max_area_id}")
 
         self.area_id: int = area_id
         self.worker_id: int = worker_id
@@ -36,17 +55,29 @@ class SnowflakeWorker(object):
         self.last_timestamp: int = -1  # 上次计算的时间戳
         self._diff_timestamp: int = 0  # 出现时间回拨时的差值
 
+        self.clock: Clock = clock or SystemClock()
+        self.wait_strategy: WaitStrategy = wait_strategy or SleepWait()
+
     def _gen_millisecond_timestamp(self) -> int:
         """获取当前时间的timestamp, 13位"""
-        return int(time.time() * 1000) + self._diff_timestamp
+        return self.clock.time_ms() + self._diff_timestamp
 
-    def get_id(self):
+    def _get_timestamp(self) -> int:
         timestamp: int = self._gen_millisecond_timestamp()
 
         # 出现时间回拨, 借用未来时间
         if timestamp < self.last_timestamp:
             self._diff_timestamp = self._diff_timestamp + (self.last_timestamp - timestamp)
             timestamp = self.last_timestamp
+        return timestamp
+
+    def _get_id_prefix(self, timestamp: int) -> int:
+        """id除了序列号以外的部分, 同一毫秒内的id都是该值加上序列号"""
+        return ((timestamp - TWEPOCH) << self.timestamp_shift) | (self.area_id << self.main_id_shift) | \
+               (self.worker_id << self.worker_id_shift)
+
+    def get_id(self):
+        timestamp: int = self._get_timestamp()
 
         # 如果是同一个时间内获取, 则使用序列号
         if timestamp == self.last_timestamp:
@@ -58,19 +89,71 @@ class SnowflakeWorker(object):
 
         self.last_timestamp = timestamp
 
-        return ((timestamp - TWEPOCH) << self.timestamp_shift) | (self.area_id << self.main_id_shift) | \
-               (self.worker_id << self.worker_id_shift) | self.sequence
-
-    def _get_next_millis(self, last_timestamp):
-        timestamp = self._gen_millisecond_timestamp()
-        while timestamp <= last_timestamp:
-            timestamp = self._gen_millisecond_timestamp()
-        return timestamp
+        return self._get_id_prefix(timestamp) | self.sequence
+
+    def get_ids(self, n: int) -> array:
+        """
+        批量获取n个id, 以int64数组返回
+        每次预留当前毫秒内剩余的整段序列号, 再一次性生成这一段的id, 而不是每个id都获取一次时间和拼接一次
+        """
+        id_array: array = array("q")
+        while len(id_array) < n:
+            timestamp: int = self._get_timestamp()
+            if timestamp == self.last_timestamp:
+                start: int = self.sequence + 1
+                # 当前毫秒的序列号已用完, 等待下一毫秒
+                if start > self.sequence_mask:
+                    timestamp = self._get_next_millis(self.last_timestamp)
+                    start = 0
+            else:
+                start = 0
+            end: int = min(start + n - len(id_array), self.sequence_mask + 1)
+            id_prefix: int = self._get_id_prefix(timestamp)
+            # 序列号在低位, 所以这一段id是连续的整数
+            id_array.extend(range(id_prefix + start, id_prefix + end))
+
+            self.sequence = end - 1
+            self.last_timestamp = timestamp
+        return id_array
+
+    def _get_next_millis(self, last_timestamp: int) -> int:
+        return self.wait_strategy.wait(self._gen_millisecond_timestamp, last_timestamp)
+
+    def _get_available(self) -> int:
+        """当前毫秒内还可以生成的id数"""
+        if self._get_timestamp() == self.last_timestamp:
+            return self.sequence_mask - self.sequence
+        return self.sequence_mask + 1
+
+
+class AsyncSnowflakeWorker(SnowflakeWorker):
+    """
+    在事件循环中使用的worker, 当前毫秒的序列号用完时, 通过`asyncio.sleep`等待下一毫秒, 而不是阻塞事件循环
+    只能在单个事件循环中使用, 检查与生成之间没有await, 所以不需要加锁
+    """
+
+    async def _wait_available(self) -> int:
+        available: int = self._get_available()
+        while not available:
+            await asyncio.sleep((self.last_timestamp - self._gen_millisecond_timestamp() + 1) / 1000)
+            available = self._get_available()
+        return available
+
+    async def get_id(self) -> int:  # type: ignore
+        await self._wait_available()
+        return super().get_id()
+
+    async def get_ids(self, n: int) -> array:  # type: ignore
+        id_array: array = array("q")
+        while len(id_array) < n:
+            # 每次只取当前毫秒内剩余的部分, 所以同步的get_ids不会等待
+            available: int = await self._wait_available()
+            id_array.extend(super().get_ids(min(available, n - len(id_array))))
+        return id_array
 
 
 if __name__ == '__main__':
     i = 0
-    import time
     while i < 3:
         worker = SnowflakeWorker(1, 2, 0)
         print(worker.get_id())
@@ -0,0 +1,129 @@
+"""
+snowflake的性能测试
+
+    python -m example_python.snowflake.benchmark
+"""
+import os
+import tempfile
+import threading
+import time
+from array import array
+from multiprocessing import get_context
+from typing import List, Tuple
+
+from . import SnowflakeWorker
+from .clock import Clock, CoarseClock, MonotonicClock, SleepWait, SpinWait, SystemClock, WaitStrategy, YieldWait
+from .codec import SnowflakeCodec
+from .concurrent import ConcurrentSnowflakeWorker, ProcessSnowflakeWorker
+
+
+def bench_get_id(n: int = 1000000) -> None:
+    """逐个调用get_id与批量调用get_ids生成n个id的耗时"""
+    worker: SnowflakeWorker = SnowflakeWorker(1, 1)
+    s_t: float = time.perf_counter()
+    id_list = [worker.get_id() for _ in range(n)]
+    get_id_cost: float = time.perf_counter() - s_t
+
+    worker = SnowflakeWorker(1, 2)
+    s_t = time.perf_counter()
+    id_array: array = worker.get_ids(n)
+    get_ids_cost: float = time.perf_counter() - s_t
+
+    assert len(set(id_list)) == n and len(set(id_array)) == n
+    print(f"get_id  n:{n} cost:{get_id_cost:.3f}s ids/sec:{n / get_id_cost:.0f}")
+    print(f"get_ids n:{n} cost:{get_ids_cost:.3f}s ids/sec:{n / get_ids_cost:.0f}")
+
+
+def bench_wait_strategy(clock: Clock, wait_strategy: WaitStrategy, n: int = 1000000) -> None:
+    """生成速度超过每毫秒4096个时序列号会用完, 比较不同时钟与等待策略的耗时以及等待时占用的cpu时间"""
+    worker: SnowflakeWorker = SnowflakeWorker(1, 1, clock=clock, wait_strategy=wait_strategy)
+    s_t: float = time.perf_counter()
+    cpu_s_t: float = time.process_time()
+    id_array: array = worker.get_ids(n)
+    cost: float = time.perf_counter() - s_t
+    cpu_cost: float = time.process_time() - cpu_s_t
+
+    assert len(set(id_array)) == n
+    print(
+        f"{type(clock).__name__} {type(wait_strategy).__name__} n:{n}"
+        f" cost:{cost:.3f}s cpu:{cpu_cost:.3f}s ids/sec:{n / cost:.0f}"
+    )
+
+
+def bench_decode(n: int = 1000000) -> None:
+    """逐个decode与decode_array批量解码n个id的耗时"""
+    id_array: array = SnowflakeWorker(1, 1).get_ids(n)
+    codec: SnowflakeCodec = SnowflakeCodec()
+    s_t: float = time.perf_counter()
+    for i in id_array:
+        codec.decode(i)
+    decode_cost: float = time.perf_counter() - s_t
+
+    s_t = time.perf_counter()
+    codec.decode_array(id_array)
+    decode_array_cost: float = time.perf_counter() - s_t
+    print(f"decode       n:{n} cost:{decode_cost:.3f}s ids/sec:{n / decode_cost:.0f}")
+    print(f"decode_array n:{n} cost:{decode_array_cost:.3f}s ids/sec:{n / decode_array_cost:.0f}")
+
+
+def bench_threads(thread_num: int, n: int = 200000) -> None:
+    """多个线程共用一个ConcurrentSnowflakeWorker, 每个线程生成n个id"""
+    worker: ConcurrentSnowflakeWorker = ConcurrentSnowflakeWorker(1, 3)
+    id_list_list: List[List[int]] = [[] for _ in range(thread_num)]
+
+    def _run(id_list: List[int]) -> None:
+        for _ in range(n):
+            id_list.append(worker.get_id())
+
+    thread_list: List[threading.Thread] = [threading.Thread(target=_run, args=(i,)) for i in id_list_list]
+    s_t: float = time.perf_counter()
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    cost: float = time.perf_counter() - s_t
+
+    assert len({i for id_list in id_list_list for i in id_list}) == thread_num * n
+    print(f"threads:{thread_num} n:{n} cost:{cost:.3f}s ids/sec:{thread_num * n / cost:.0f}")
+
+
+def _process_run(n: int, registry_path: str) -> Tuple[float, bytes]:
+    worker: ProcessSnowflakeWorker = ProcessSnowflakeWorker(1, registry_path=registry_path)
+    s_t: float = time.perf_counter()
+    id_array: array = array("q", [worker.get_id() for _ in range(n)])
+    cost: float = time.perf_counter() - s_t
+    worker.close()
+    return cost, id_array.tobytes()
+
+
+def bench_processes(process_num: int, n: int = 500000) -> None:
+    """
+    每个进程各自用一个ProcessSnowflakeWorker生成n个id, worker id由登记表自动分配
+    进程间没有共享的状态, 所以吞吐量随进程数(不超过cpu核数)近似线性增长
+    """
+    registry_path: str = os.path.join(tempfile.gettempdir(), f"snowflake_bench_{os.getpid()}.registry")
+    with get_context("fork").Pool(process_num) as pool:
+        result_list: List[Tuple[float, bytes]] = pool.starmap(_process_run, [(n, registry_path)] * process_num)
+    os.remove(registry_path)
+
+    id_set: set = set()
+    for _, id_bytes in result_list:
+        id_set.update(array("q", id_bytes))
+    assert len(id_set) == process_num * n
+    # 以最慢的进程为准
+    cost: float = max(cost for cost, _ in result_list)
+    print(f"processes:{process_num} n:{n} cost:{cost:.3f}s ids/sec:{process_num * n / cost:.0f}")
+
+
+if __name__ == '__main__':
+    bench_get_id()
+    for _clock in (SystemClock(), MonotonicClock(), CoarseClock()):
+        for _wait_strategy in (SpinWait(), YieldWait(), SleepWait()):
+            if isinstance(_clock, CoarseClock) and isinstance(_wait_strategy, SpinWait):
+                continue
+            bench_wait_strategy(_clock, _wait_strategy)
+    bench_decode()
+    for _thread_num in (1, 2, 4, 8):
+        bench_threads(_thread_num)
+    for _process_num in sorted({1, 2, 4, os.cpu_count() or 1}):
+        bench_processes(_process_num)
@@ -0,0 +1,117 @@
+"""
+snowflake使用的时钟与等待策略
+
+时钟:
+    SystemClock: 系统时间, 会受到时间回拨(如ntp校时)的影响
+    MonotonicClock: 创建时以系统时间为起点, 之后按单调时钟计时, 不会回拨, 但也不会跟随系统时间的校正
+    CoarseClock: 由后台线程定期刷新的缓存时间, 获取时间只是读取一个属性, 精度为刷新间隔
+
+等待策略(当前毫秒的序列号用完后, 如何等待下一毫秒):
+    SpinWait: 不停地获取时间直到进入下一毫秒, 延迟最低, 但会占满一个cpu核
+    YieldWait: 每次获取时间前让出cpu
+    SleepWait: 休眠到下一毫秒
+"""
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Optional
+
+
+class Clock(object):
+    def time_ms(self) -> int:
+        """当前时间的毫秒时间戳"""
+        raise NotImplementedError()
+
+
+class SystemClock(Clock):
+    def time_ms(self) -> int:
+        return int(time.time() * 1000)
+
+
+class MonotonicClock(Clock):
+    def __init__(self) -> None:
+        self._anchor_ms: int = int(time.time() * 1000)
+        self._anchor_monotonic: float = time.monotonic()
+
+    def time_ms(self) -> int:
+        return self._anchor_ms + int((time.monotonic() - self._anchor_monotonic) * 1000)
+
+
+class CoarseClock(Clock):
+    def __init__(self, interval: float = 0.001, clock: Optional[Clock] = None) -> None:
+        """
+        interval: 刷新间隔(秒), 受线程切换的影响, 实际的间隔可能更长(见sys.getswitchinterval)
+        clock: 实际获取时间的时钟, 默认是MonotonicClock
+
+        自旋等待会与刷新线程争抢GIL, 导致时间迟迟不更新, 所以不要与SpinWait一起使用
+        """
+        self._interval: float = interval
+        self._clock: Clock = clock or MonotonicClock()
+        self._now: int = self._clock.time_ms()
+        self._stop_event: threading.Event = threading.Event()
+        self._start()
+        _coarse_clock_set.add(self)
+
+    def _start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self._interval):
+            now: int = self._clock.time_ms()
+            # 只向前走
+            if now > self._now:
+                self._now = now
+
+    def time_ms(self) -> int:
+        return self._now
+
+    def stop(self) -> None:
+        """停止刷新, 之后时间不再变化"""
+        self._stop_event.set()
+        _coarse_clock_set.discard(self)
+
+
+# fork出的子进程没有刷新线程, 需要重新启动, 只注册一次钩子, 用WeakSet记录clock, 否则clock永远不会被回收
+_coarse_clock_set: "weakref.WeakSet[CoarseClock]" = weakref.WeakSet()
+
+
+def _restart_after_fork() -> None:
+    for coarse_clock in list(_coarse_clock_set):
+        coarse_clock._start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class WaitStrategy(object):
+    def wait(self, get_timestamp: Callable[[], int], last_timestamp: int) -> int:
+        """等待到`last_timestamp`之后的毫秒, 返回新的时间戳"""
+        raise NotImplementedError()
+
+
+class SpinWait(WaitStrategy):
+    def wait(self, get_timestamp: Callable[[], int], last_timestamp: int) -> int:
+        timestamp: int = get_timestamp()
+        while timestamp <= last_timestamp:
+            timestamp = get_timestamp()
+        return timestamp
+
+
+class YieldWait(WaitStrategy):
+    def wait(self, get_timestamp: Callable[[], int], last_timestamp: int) -> int:
+        timestamp: int = get_timestamp()
+        while timestamp <= last_timestamp:
+            # sleep(0)会释放GIL并让出cpu
+            time.sleep(0)
+            timestamp = get_timestamp()
+        return timestamp
+
+
+class SleepWait(WaitStrategy):
+    def wait(self, get_timestamp: Callable[[], int], last_timestamp: int) -> int:
+        timestamp: int = get_timestamp()
+        while timestamp <= last_timestamp:
+            time.sleep((last_timestamp - timestamp + 1) / 1000)
+            timestamp = get_timestamp()
+        return timestamp
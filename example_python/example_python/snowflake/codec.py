@@ -0,0 +1,113 @@
+"""
+snowflake id的编码与解码
+
+id的结构(从高位到低位): 时间戳(相对TWEPOCH的毫秒数) | 区域id | 服务器id | 序列号,
+时间戳在最高位, 所以按id排序就是按生成时间排序, 以id为主键时, 按时间查询可以直接转为id的范围查询,
+不需要额外的时间字段和索引:
+
+    start_id, end_id = codec.get_id_range(start_ms, end_ms)
+    SELECT * FROM t WHERE id >= start_id AND id < end_id
+"""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, NamedTuple, Sequence, Tuple
+
+from . import TWEPOCH, SnowflakeWorker
+
+
+class SnowflakeId(NamedTuple):
+    timestamp: int  # 毫秒时间戳
+    area_id: int
+    worker_id: int
+    sequence: int
+
+
+class SnowflakeCodec(object):
+    """与SnowflakeWorker使用相同的位布局, area_id_bit必须与生成id的worker一致"""
+
+    def __init__(self, area_id_bit: int = 3) -> None:
+        worker_id_bit: int = 10 - area_id_bit
+        self.sequence_bit: int = 12
+        self.worker_id_shift: int = self.sequence_bit
+        self.area_id_shift: int = self.sequence_bit + worker_id_bit
+        self.timestamp_shift: int = self.sequence_bit + worker_id_bit + area_id_bit
+
+        self.sequence_mask: int = -1 ^ (-1 << self.sequence_bit)
+        self.worker_id_mask: int = -1 ^ (-1 << worker_id_bit)
+        self.area_id_mask: int = -1 ^ (-1 << area_id_bit)
+
+    @classmethod
+    def from_worker(cls, worker: SnowflakeWorker) -> "SnowflakeCodec":
+        return cls(area_id_bit=worker.timestamp_shift - worker.main_id_shift)
+
+    ##########
+    # encode #
+    ##########
+    def encode(self, timestamp: int, area_id: int, worker_id: int, sequence: int = 0) -> int:
+        if timestamp < TWEPOCH:
+            raise ValueError(f"timestamp must not be less than {TWEPOCH}")
+        if area_id > self.area_id_mask or area_id < 0:
+            raise ValueError(f"area id bit must between 0 and {self.area_id_mask}")
+        if worker_id > self.worker_id_mask or worker_id < 0:
+            raise ValueError(f"work id bit must between 0 and {self.worker_id_mask}")
+        if sequence > self.sequence_mask or sequence < 0:
+            raise ValueError(f"sequence must between 0 and {self.sequence_mask}")
+        return ((timestamp - TWEPOCH) << self.timestamp_shift) | (area_id << self.area_id_shift) | \
+               (worker_id << self.worker_id_shift) | sequence
+
+    ##########
+    # decode #
+    ##########
+    def get_timestamp(self, snowflake_id: int) -> int:
+        return (snowflake_id >> self.timestamp_shift) + TWEPOCH
+
+    def decode(self, snowflake_id: int) -> SnowflakeId:
+        return SnowflakeId(
+            (snowflake_id >> self.timestamp_shift) + TWEPOCH,
+            (snowflake_id >> self.area_id_shift) & self.area_id_mask,
+            (snowflake_id >> self.worker_id_shift) & self.worker_id_mask,
+            snowflake_id & self.sequence_mask,
+        )
+
+    def decode_array(self, id_array: Sequence[int]) -> Tuple[array, array, array, array]:
+        """
+        批量解码, 返回时间戳, 区域id, 服务器id, 序列号四个int64数组
+        每个字段在一次推导式中算完, 不为每个id创建SnowflakeId
+        """
+        timestamp_shift, area_id_shift, worker_id_shift = self.timestamp_shift, self.area_id_shift, self.worker_id_shift
+        area_id_mask, worker_id_mask, sequence_mask = self.area_id_mask, self.worker_id_mask, self.sequence_mask
+        return (
+            array("q", [(i >> timestamp_shift) + TWEPOCH for i in id_array]),
+            array("q", [(i >> area_id_shift) & area_id_mask for i in id_array]),
+            array("q", [(i >> worker_id_shift) & worker_id_mask for i in id_array]),
+            array("q", [i & sequence_mask for i in id_array]),
+        )
+
+    def count_by_worker(self, id_array: Sequence[int]) -> Dict[Tuple[int, int], int]:
+        """按(区域id, 服务器id)统计id的数量"""
+        worker_id_shift, worker_id_bit = self.worker_id_shift, self.area_id_shift - self.worker_id_shift
+        main_id_mask: int = -1 ^ (-1 << (self.timestamp_shift - self.worker_id_shift))
+        counter: Counter = Counter([(i >> worker_id_shift) & main_id_mask for i in id_array])
+        return {
+            (main_id >> worker_id_bit, main_id & self.worker_id_mask): cnt for main_id, cnt in sorted(counter.items())
+        }
+
+    #########
+    # range #
+    #########
+    def get_min_id(self, timestamp: int) -> int:
+        """该毫秒生成的最小id, 早于该毫秒生成的id都比它小"""
+        return max(timestamp - TWEPOCH, 0) << self.timestamp_shift
+
+    def get_id_range(self, start_timestamp: int, end_timestamp: int) -> Tuple[int, int]:
+        """
+        生成时间在[start_timestamp, end_timestamp)内的id范围, 同样是左闭右开,
+        可以直接用于索引的范围扫描: id >= start_id AND id < end_id
+        """
+        return self.get_min_id(start_timestamp), self.get_min_id(end_timestamp)
+
+    def slice_by_time(self, sorted_id_array: Sequence[int], start_timestamp: int, end_timestamp: int) -> slice:
+        """已排序的id中, 生成时间在[start_timestamp, end_timestamp)内的部分"""
+        start_id, end_id = self.get_id_range(start_timestamp, end_timestamp)
+        return slice(bisect_left(sorted_id_array, start_id), bisect_left(sorted_id_array, end_id))
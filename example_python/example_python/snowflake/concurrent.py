@@ -0,0 +1,223 @@
+"""
+并发场景下的snowflake
+
+    ConcurrentSnowflakeWorker: 可以在多个线程间共享的worker
+    ProcessSnowflakeWorker: 每个进程从本机的worker id登记表自动领取worker id, 多进程(包括fork出的子进程)间的id不会重复,
+        登记表只在本机有效, 多台机器要使用不同的area_id, 否则不同机器的进程会领取到相同的worker id
+
+SnowflakeWorker直接修改`sequence`和`last_timestamp`, 多个线程共用时会生成重复的id,
+而不同进程要使用不同的worker_id, 否则同一毫秒内会生成相同的id.
+"""
+import fcntl
+import mmap
+import os
+import tempfile
+import threading
+import weakref
+from array import array
+from typing import Iterator, Optional
+
+from . import SnowflakeWorker
+from .clock import Clock, WaitStrategy
+
+
+class ConcurrentSnowflakeWorker(SnowflakeWorker):
+    """
+    线程安全的worker
+    每个线程持有一批自己的id, 取id时不需要加锁, 只有这批id用完时才加锁调用`get_ids`补充一批,
+    所以锁的竞争只有原来的1/batch_size.
+    代价是id只在单个线程内递增, 不同线程间的id不再严格按获取的先后排序(最多相差一批id的时间)
+    """
+
+    def __init__(
+            self,
+            area_id: int,
+            worker_id: int,
+            sequence: int = 0,
+            area_id_bit: int = 3,
+            clock: Optional[Clock] = None,
+            wait_strategy: Optional[WaitStrategy] = None,
+            batch_size: int = 64,
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError("batch size must be greater than 0")
+        super().__init__(
+            area_id, worker_id, sequence=sequence, area_id_bit=area_id_bit, clock=clock, wait_strategy=wait_strategy
+        )
+        self.batch_size: int = batch_size
+        self._lock: threading.Lock = threading.Lock()
+        # 每个线程剩余的id
+        self._local: threading.local = threading.local()
+
+    def get_id(self) -> int:
+        try:
+            return next(self._local.id_iter)
+        except (AttributeError, StopIteration):
+            pass
+        id_iter: Iterator[int] = iter(self.get_ids(self.batch_size))
+        self._local.id_iter = id_iter
+        return next(id_iter)
+
+    def get_ids(self, n: int) -> array:
+        with self._lock:
+            return super().get_ids(n)
+
+
+class WorkerIdRegistry(object):
+    """
+    本机的worker id登记表
+    登记表是一个映射到内存的文件, 每个worker id占两个int64槽位, 记录占用该worker id的进程pid,
+    以及它最后一次生成id的时间戳, 领取和归还都持有文件锁, 所以没有亲缘关系的进程也可以共用同一个登记表.
+    进程退出时不需要归还, 占用者已经不存在的槽位会被重新领取.
+    新的占用者要等到槽位记录的时间戳之后才能生成id, 否则同一毫秒内会与上一个占用者生成相同的id
+
+    登记表是本机的文件, 只保证同一台机器上的worker id不重复, 其他机器无法看到,
+    所以同一区域内的多台机器会领取到相同的worker id, 生成重复的id.
+
+    只支持posix系统(依赖fcntl)
+    """
+
+    def __init__(self, size: int, area_id: int = 0, path: Optional[str] = None) -> None:
+        """
+        size: worker id的数量
+        area_id: 登记表所属的区域, 每个区域的worker id是独立的
+        path: 登记表的路径, 默认是临时目录下的`snowflake_worker_id_{area_id}.registry`
+        """
+        self.size: int = size
+        self.path: str = path or os.path.join(tempfile.gettempdir(), f"snowflake_worker_id_{area_id}.registry")
+        self._fd: int = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        with self._locked():
+            if os.fstat(self._fd).st_size < size * 16:
+                os.ftruncate(self._fd, size * 16)
+        self._mmap: mmap.mmap = mmap.mmap(self._fd, size * 16)
+        # [pid, 最后的时间戳] * size
+        self._slot_view: memoryview = memoryview(self._mmap).cast("q")
+
+    def _locked(self) -> "_FileLock":
+        return _FileLock(self._fd)
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # 进程存在, 但属于其他用户
+            return True
+        return True
+
+    def acquire(self) -> int:
+        """为当前进程领取一个空闲的worker id"""
+        pid: int = os.getpid()
+        with self._locked():
+            for worker_id in range(self.size):
+                owner_pid: int = self._slot_view[worker_id * 2]
+                if owner_pid == 0 or (owner_pid != pid and not self._is_alive(owner_pid)):
+                    self._slot_view[worker_id * 2] = pid
+                    return worker_id
+        raise RuntimeError(f"all {self.size} worker ids of {self.path} are in use")
+
+    def get_last_timestamp(self, worker_id: int) -> int:
+        """上一个占用者最后一次生成id的时间戳, 没有则是-1"""
+        return self._slot_view[worker_id * 2 + 1] or -1
+
+    def set_last_timestamp(self, worker_id: int, timestamp: int) -> None:
+        """只有占用者会写自己的槽位, 所以不需要文件锁"""
+        self._slot_view[worker_id * 2 + 1] = timestamp
+
+    def release(self, worker_id: int) -> None:
+        """归还当前进程占用的worker id, 时间戳会保留给下一个占用者"""
+        with self._locked():
+            if self._slot_view[worker_id * 2] == os.getpid():
+                self._slot_view[worker_id * 2] = 0
+
+    def close(self) -> None:
+        self._slot_view.release()
+        self._mmap.close()
+        os.close(self._fd)
+
+
+class _FileLock(object):
+    def __init__(self, fd: int) -> None:
+        self._fd: int = fd
+
+    def __enter__(self) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class ProcessSnowflakeWorker(ConcurrentSnowflakeWorker):
+    """
+    多进程安全的worker, worker id从本机的登记表自动领取, 同一区域内最多同时运行2^(10-area_id_bit)个进程.
+    id只在本机内唯一, 每台机器要使用不同的area_id, 同一区域的多台机器会生成重复的id.
+    fork出的子进程会继承父进程的worker id和未用完的id, 所以子进程会丢弃它们并重新领取一个worker id
+
+    每生成一批id都会把最后的时间戳写入登记表(只是一次内存写入), 进程崩溃后, 领取它的worker id的进程也能从这个时间戳之后开始
+    """
+
+    def __init__(
+            self,
+            area_id: int,
+            area_id_bit: int = 3,
+            clock: Optional[Clock] = None,
+            wait_strategy: Optional[WaitStrategy] = None,
+            batch_size: int = 64,
+            registry_path: Optional[str] = None,
+    ) -> None:
+        """
+        registry_path: 登记表的路径, 默认按area_id区分, 不同区域的worker要使用不同的登记表
+        """
+        self.registry: WorkerIdRegistry = WorkerIdRegistry(
+            1 << (10 - area_id_bit), area_id=area_id, path=registry_path
+        )
+        super().__init__(
+            area_id,
+            self.registry.acquire(),
+            area_id_bit=area_id_bit,
+            clock=clock,
+            wait_strategy=wait_strategy,
+            batch_size=batch_size,
+        )
+        self._resume_from_registry()
+        _process_worker_set.add(self)
+
+    def _resume_from_registry(self) -> None:
+        # 从上一个占用者的时间戳继续, 并视为该毫秒的序列号已用完, 所以下一个id一定在它之后的毫秒生成
+        self.last_timestamp = self.registry.get_last_timestamp(self.worker_id)
+        self.sequence = self.sequence_mask
+
+    def get_ids(self, n: int) -> array:
+        with self._lock:
+            id_array: array = SnowflakeWorker.get_ids(self, n)
+            self.registry.set_last_timestamp(self.worker_id, self.last_timestamp)
+            return id_array
+
+    def _reset_after_fork(self) -> None:
+        # 子进程与父进程共享同一个打开的文件, 文件锁无法互斥, 所以要重新打开登记表
+        self.registry.close()
+        self.registry = WorkerIdRegistry(self.registry.size, path=self.registry.path)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.worker_id = self.registry.acquire()
+        self._resume_from_registry()
+
+    def close(self) -> None:
+        """归还worker id, 之后不能再使用该worker"""
+        _process_worker_set.discard(self)
+        self.registry.release(self.worker_id)
+        self.registry.close()
+
+
+# fork出的子进程要重置所有的worker, 只注册一次钩子, 用WeakSet记录worker, 否则worker永远不会被回收
+_process_worker_set: "weakref.WeakSet[ProcessSnowflakeWorker]" = weakref.WeakSet()
+
+
+def _reset_after_fork() -> None:
+    for worker in list(_process_worker_set):
+        worker._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,133 @@
+import random
+from typing import Any, Dict, Type
+
+import pytest
+
+from example_python.customer_python_dict import CompactCustomerDict, CustomerDict
+
+DICT_CLASS_LIST = [CustomerDict, CompactCustomerDict]
+
+
+def assert_same(customer_dict: CustomerDict, expect_dict: Dict[Any, Any]) -> None:
+    assert len(customer_dict) == len(expect_dict)
+    # the insertion order is kept as well
+    assert customer_dict.items() == list(expect_dict.items())
+    for key, value in expect_dict.items():
+        assert customer_dict[key] == value
+
+
+@pytest.mark.parametrize("incremental_resize", [False, True])
+@pytest.mark.parametrize("customer_dict_class", DICT_CLASS_LIST)
+def test_random_ops(customer_dict_class: Type[CustomerDict], incremental_resize: bool) -> None:
+    rng: random.Random = random.Random(0)
+    customer_dict: CustomerDict = customer_dict_class(incremental_resize=incremental_resize)
+    expect_dict: Dict[Any, Any] = {}
+    rehash_cnt: int = 0
+    for i in range(30000):
+        # the key space grows, so the dict keeps growing while deleting, and keys of different types collide
+        key: Any = rng.randrange(i // 3 + 10)
+        if rng.random() < 0.3:
+            key = str(key)
+        op: float = rng.random()
+        if op < 0.55:
+            customer_dict[key] = i
+            expect_dict[key] = i
+        elif op < 0.9:
+            if key in expect_dict:
+                del customer_dict[key]
+                del expect_dict[key]
+            else:
+                with pytest.raises(KeyError):
+                    del customer_dict[key]
+        elif key in expect_dict:
+            assert customer_dict[key] == expect_dict[key]
+        else:
+            with pytest.raises(KeyError):
+                customer_dict[key]
+        if customer_dict._old_index_array is not None:
+            rehash_cnt += 1
+    assert_same(customer_dict, expect_dict)
+    assert rehash_cnt > 0 if incremental_resize else rehash_cnt == 0
+
+
+@pytest.mark.parametrize("customer_dict_class", DICT_CLASS_LIST)
+def test_delete_all(customer_dict_class: Type[CustomerDict]) -> None:
+    """deleting without inserting compacts the dict as well"""
+    customer_dict: CustomerDict = customer_dict_class()
+    for i in range(100000):
+        customer_dict[i] = i
+    capacity: int = customer_dict._init_length
+    for i in range(99990):
+        del customer_dict[i]
+    assert customer_dict._init_length < capacity
+    assert customer_dict._used_count < 100000
+    assert_same(customer_dict, {i: i for i in range(99990, 100000)})
+
+
+@pytest.mark.parametrize("incremental_resize", [False, True])
+@pytest.mark.parametrize("customer_dict_class", DICT_CLASS_LIST)
+def test_update_and_merge(customer_dict_class: Type[CustomerDict], incremental_resize: bool) -> None:
+    rng: random.Random = random.Random(0)
+    item_list = [(rng.randrange(2000), i) for i in range(1500)]
+    other_item_list = [(str(rng.randrange(500)), i) for i in range(500)] + item_list[:300]
+
+    customer_dict: CustomerDict = customer_dict_class(incremental_resize=incremental_resize)
+    expect_dict: Dict[Any, Any] = {}
+    for key, value in item_list[:700]:
+        customer_dict[key] = value
+        expect_dict[key] = value
+    for key, _ in item_list[:200]:
+        if key in expect_dict:
+            del customer_dict[key]
+            del expect_dict[key]
+
+    # list, dict, iterator and CustomerDict
+    customer_dict.update(item_list[700:1000])
+    expect_dict.update(item_list[700:1000])
+    customer_dict.update(dict(item_list[1000:1200]))
+    expect_dict.update(dict(item_list[1000:1200]))
+    customer_dict.update(iter(item_list[1200:]))
+    expect_dict.update(iter(item_list[1200:]))
+    other_dict: CustomerDict = customer_dict_class.from_items(
+        other_item_list, incremental_resize=incremental_resize
+    )
+    customer_dict.update(other_dict)
+    expect_dict.update(other_item_list)
+    customer_dict.update(customer_dict)
+    assert_same(customer_dict, expect_dict)
+    assert_same(other_dict, dict(other_item_list))
+
+    merged_dict: CustomerDict = other_dict.merge(customer_dict)
+    assert isinstance(merged_dict, customer_dict_class)
+    expect_merged_dict: Dict[Any, Any] = dict(other_item_list)
+    expect_merged_dict.update(expect_dict)
+    assert_same(merged_dict, expect_merged_dict)
+    # merge does not change either side
+    assert_same(customer_dict, expect_dict)
+
+    # the dicts still work after the bulk inserts
+    for key, value in item_list:
+        merged_dict[key] = -value
+        expect_merged_dict[key] = -value
+    for key, _ in other_item_list:
+        if key in expect_merged_dict:
+            del merged_dict[key]
+            del expect_merged_dict[key]
+    assert_same(merged_dict, expect_merged_dict)
+
+
+@pytest.mark.parametrize("customer_dict_class", DICT_CLASS_LIST)
+def test_incremental_resize_step(customer_dict_class: Type[CustomerDict]) -> None:
+    """the rehash covers well under 1% of the writes"""
+    customer_dict: CustomerDict = customer_dict_class(incremental_resize=True)
+    rehash_cnt: int = 0
+    n: int = 200000
+    for i in range(n):
+        if customer_dict._old_index_array is not None:
+            rehash_cnt += 1
+        customer_dict[i] = i
+    assert rehash_cnt / n < 0.01
+    assert_same(customer_dict, {i: i for i in range(n)})
+
+    with pytest.raises(ValueError):
+        customer_dict_class(incremental_resize=True, resize_step=1)
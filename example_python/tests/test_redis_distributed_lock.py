@@ -0,0 +1,187 @@
+import asyncio
+from typing import Any, Coroutine, Dict, List, Optional
+
+import pytest
+from redis.asyncio.lock import LockNotOwnedError
+
+from example_python.redis_distributed_lock.base_lock import MultiLock
+from example_python.redis_distributed_lock.core import Manager
+from example_python.redis_distributed_lock.lease_lock import LeaseLock
+from example_python.redis_distributed_lock.retry_policy import FixedRetryPolicy
+from example_python.redis_distributed_lock.rw_lock import ReadLock, WriteLock
+from example_python.redis_distributed_lock.semaphore import Semaphore
+from example_python.redis_distributed_lock.simulator import (
+    SimRedis,
+    SimRedisServer,
+    SimReport,
+    VirtualClockLoop,
+    run_scenario,
+)
+
+
+def run(coro: Coroutine) -> Any:
+    """run the coroutine on the virtual clock of the simulator, so that sleeping costs no real time"""
+    loop: VirtualClockLoop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        result: Any = loop.run_until_complete(coro)
+        # wait for the proxies and the watch dogs stopped by the manager to be cancelled
+        loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+        return result
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class RecordRetryPolicy(FixedRetryPolicy):
+    def __init__(self) -> None:
+        super().__init__()
+        self.pttl_list: List[Optional[float]] = []
+
+    def get_delay(self, attempt: int, pttl: Optional[float], remaining: Optional[float]) -> float:
+        self.pttl_list.append(pttl)
+        return super().get_delay(attempt, pttl, remaining)
+
+
+def test_rw_lock_retry_policy_pttl() -> None:
+    """the retry policy gets the pttl of the lock in seconds"""
+
+    async def _main() -> None:
+        retry_policy: RecordRetryPolicy = RecordRetryPolicy()
+        client: SimRedis = SimRedis(SimRedisServer())
+        manager: Manager = Manager(client, retry_policy=retry_policy)  # type: ignore
+        manager.start()
+        writer: WriteLock = WriteLock(client, manager, "test", timeout=9)  # type: ignore
+        assert await writer.acquire()
+        assert not await ReadLock(client, manager, "test", timeout=9, blocking_timeout=0.5).acquire()  # type: ignore
+        assert not await WriteLock(client, manager, "test", timeout=9, blocking_timeout=0.5).acquire()  # type: ignore
+        await writer._release()
+        manager.stop()
+
+        assert retry_policy.pttl_list
+        for pttl in retry_policy.pttl_list:
+            assert pttl is not None and 8 < pttl <= 9
+
+    run(_main())
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"read_ratio": 0.8},
+        {"permits": 3},
+        {"permits": 3, "mixed": True, "proxy_num": 1, "lock_num": 4},
+    ],
+    ids=["base_lock", "rw_lock", "semaphore", "mixed"],
+)
+def test_mutual_exclusion_and_wakeup(kwargs: Dict[str, Any]) -> None:
+    """
+    no holder overlaps a writer and a semaphore never goes over its permits, every client gets the lock,
+    and the waiters are woken up by the releases instead of waiting for the retry policy
+    """
+    report: SimReport = run_scenario(client_num=20, process_num=2, duration=2, **kwargs)
+    assert report.violation_cnt == 0
+    assert report.expired_cnt == 0
+    assert min(report.completed_cnt_list) > 0
+    wake_latency_list: List[float] = sorted(report.wake_latency_list)
+    assert wake_latency_list
+    # a missed wakeup falls back to the retry policy, which sleeps up to 1 second
+    assert wake_latency_list[len(wake_latency_list) * 99 // 100] < 0.05
+
+
+def test_semaphore_permits() -> None:
+    async def _main() -> None:
+        client: SimRedis = SimRedis(SimRedisServer())
+        manager: Manager = Manager(client)  # type: ignore
+        manager.start()
+        holder_list: List[Semaphore] = [Semaphore(client, manager, "test", 3) for _ in range(3)]  # type: ignore
+        for holder in holder_list:
+            assert await holder.acquire()
+        assert not await Semaphore(client, manager, "test", 3, blocking_timeout=0.5).acquire()  # type: ignore
+
+        waiter: Semaphore = Semaphore(client, manager, "test", 3, blocking_timeout=5)  # type: ignore
+        task: asyncio.Task = asyncio.ensure_future(waiter.acquire())
+        await asyncio.sleep(0.5)
+        assert not task.done()
+        release_time: float = manager.time()
+        await holder_list[0]._release()
+        assert await task
+        assert manager.time() - release_time < 0.05
+
+        for holder in (*holder_list[1:], waiter):
+            await holder._release()
+        manager.stop()
+
+    run(_main())
+
+
+def test_multi_lock_mutual_exclusion() -> None:
+    """the batches lock their names in the same order, so overlapping batches neither overlap nor deadlock"""
+    fake_aioredis: Any = pytest.importorskip("fakeredis.aioredis")
+    holder_cnt_dict: Dict[str, int] = {"a": 0, "b": 0, "c": 0}
+    violation_list: List[str] = []
+
+    async def _hold(client: Any, manager: Manager, names: List[str]) -> None:
+        async with MultiLock(client, manager, names, timeout=3):
+            for name in names:
+                holder_cnt_dict[name] += 1
+                if holder_cnt_dict[name] > 1:
+                    violation_list.append(name)
+            await asyncio.sleep(0.005)
+            for name in names:
+                holder_cnt_dict[name] -= 1
+
+    async def _main() -> None:
+        client: Any = fake_aioredis.FakeRedis()
+        manager: Manager = Manager(client, timeout=1)
+        manager.start()
+        await asyncio.wait_for(
+            asyncio.gather(
+                *[_hold(client, manager, ["a", "b"]) for _ in range(5)],
+                *[_hold(client, manager, ["b", "a"]) for _ in range(5)],
+                *[_hold(client, manager, ["c", "b"]) for _ in range(5)],
+            ),
+            timeout=10,
+        )
+        manager.stop()
+
+    asyncio.run(_main())
+    assert not violation_list
+
+
+def test_lease_lock_fencing_token() -> None:
+    fake_aioredis: Any = pytest.importorskip("fakeredis.aioredis")
+
+    async def _main() -> None:
+        client: Any = fake_aioredis.FakeRedis()
+        manager: Manager = Manager(client, timeout=1)
+        manager.start()
+
+        # the tokens grow in the order the lock is acquired
+        token_list: List[int] = []
+
+        async def _hold() -> None:
+            async with LeaseLock(client, manager, "test", lease_time=3) as lock:
+                token_list.append(lock.fencing_token)
+                await asyncio.sleep(0.005)
+
+        await asyncio.wait_for(asyncio.gather(*[_hold() for _ in range(5)]), timeout=10)
+        assert token_list == sorted(token_list) and len(set(token_list)) == 5
+
+        # a holder whose lease expired can not write after the next holder
+        stale_lock: LeaseLock = LeaseLock(client, manager, "test", lease_time=0.1)
+        assert await stale_lock.acquire()
+        await asyncio.sleep(0.2)
+        assert not stale_lock.is_valid()
+        lock: LeaseLock = LeaseLock(client, manager, "test", lease_time=3, blocking_timeout=1)
+        assert await lock.acquire()
+        assert lock.fencing_token > stale_lock.fencing_token  # type: ignore
+        assert await lock.check_fencing_token("resource")
+        assert not await stale_lock.check_fencing_token("resource")
+        with pytest.raises(LockNotOwnedError):
+            await stale_lock.release()
+        await lock.release()
+        manager.stop()
+
+    asyncio.run(_main())
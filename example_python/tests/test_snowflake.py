@@ -0,0 +1,132 @@
+import random
+import threading
+from array import array
+from typing import List, Set
+
+import pytest
+
+from example_python.snowflake import TWEPOCH, SnowflakeWorker
+from example_python.snowflake.clock import Clock
+from example_python.snowflake.codec import SnowflakeCodec, SnowflakeId
+from example_python.snowflake.concurrent import ConcurrentSnowflakeWorker, ProcessSnowflakeWorker
+
+
+class ManualClock(Clock):
+    def __init__(self, timestamp: int) -> None:
+        self.timestamp = timestamp
+
+    def time_ms(self) -> int:
+        return self.timestamp
+
+
+def test_snowflake_worker_unique() -> None:
+    worker: SnowflakeWorker = SnowflakeWorker(1, 2)
+    id_list: List[int] = []
+    for _ in range(100):
+        id_list.append(worker.get_id())
+        id_list.extend(worker.get_ids(500))
+    assert len(set(id_list)) == len(id_list)
+    assert id_list == sorted(id_list)
+
+
+def test_snowflake_worker_clock_backwards() -> None:
+    """the worker borrows the future when the clock goes backwards, the ids still grow"""
+    clock: ManualClock = ManualClock(TWEPOCH + 10000)
+    worker: SnowflakeWorker = SnowflakeWorker(1, 2, clock=clock)
+    id_list: List[int] = [worker.get_id() for _ in range(10)]
+    clock.timestamp -= 5000
+    id_list.extend(worker.get_id() for _ in range(10))
+    id_list.extend(worker.get_ids(10))
+    assert len(set(id_list)) == len(id_list)
+    assert id_list == sorted(id_list)
+
+
+def test_concurrent_snowflake_worker_unique() -> None:
+    worker: ConcurrentSnowflakeWorker = ConcurrentSnowflakeWorker(1, 2, batch_size=16)
+    id_list_list: List[List[int]] = [[] for _ in range(4)]
+
+    def _run(id_list: List[int]) -> None:
+        for _ in range(2000):
+            id_list.append(worker.get_id())
+
+    thread_list: List[threading.Thread] = [threading.Thread(target=_run, args=(i,)) for i in id_list_list]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+
+    id_set: Set[int] = set()
+    for id_list in id_list_list:
+        # ids only grow within a thread
+        assert id_list == sorted(id_list)
+        id_set.update(id_list)
+    assert len(id_set) == 4 * 2000
+
+
+def test_process_snowflake_worker_registry(tmp_path) -> None:
+    registry_path: str = str(tmp_path / "worker_id.registry")
+    worker: ProcessSnowflakeWorker = ProcessSnowflakeWorker(1, registry_path=registry_path)
+    other_worker: ProcessSnowflakeWorker = ProcessSnowflakeWorker(1, registry_path=registry_path)
+    assert worker.worker_id != other_worker.worker_id
+    id_array: array = worker.get_ids(1000)
+    other_id_array: array = other_worker.get_ids(1000)
+    assert len(set(id_array) | set(other_id_array)) == 2000
+    other_worker.close()
+
+    # the next owner of the worker id starts after the last id of the previous owner
+    worker_id: int = worker.worker_id
+    last_id: int = worker.get_id()
+    worker.close()
+    next_worker: ProcessSnowflakeWorker = ProcessSnowflakeWorker(1, registry_path=registry_path)
+    assert next_worker.worker_id == worker_id
+    assert next_worker.get_id() > last_id
+    next_worker.close()
+
+
+@pytest.mark.parametrize("area_id_bit", [0, 3, 5])
+def test_codec_round_trip(area_id_bit: int) -> None:
+    codec: SnowflakeCodec = SnowflakeCodec(area_id_bit)
+    rng: random.Random = random.Random(0)
+    snowflake_id_list: List[SnowflakeId] = [
+        SnowflakeId(
+            TWEPOCH + rng.randrange(1 << 40),
+            rng.randrange(1 << area_id_bit),
+            rng.randrange(1 << (10 - area_id_bit)),
+            rng.randrange(1 << 12),
+        )
+        for _ in range(1000)
+    ]
+    id_list: List[int] = [codec.encode(*snowflake_id) for snowflake_id in snowflake_id_list]
+    assert [codec.decode(i) for i in id_list] == snowflake_id_list
+    timestamp_array, area_id_array, worker_id_array, sequence_array = codec.decode_array(id_list)
+    assert list(zip(timestamp_array, area_id_array, worker_id_array, sequence_array)) == snowflake_id_list
+
+    with pytest.raises(ValueError):
+        codec.encode(TWEPOCH, 1 << area_id_bit, 0)
+    with pytest.raises(ValueError):
+        codec.encode(TWEPOCH, 0, 1 << (10 - area_id_bit))
+
+
+def test_codec_decode_worker_id() -> None:
+    worker: SnowflakeWorker = SnowflakeWorker(3, 17, area_id_bit=4)
+    codec: SnowflakeCodec = SnowflakeCodec.from_worker(worker)
+    id_array: array = worker.get_ids(5000)
+    for snowflake_id in map(codec.decode, id_array):
+        assert (snowflake_id.area_id, snowflake_id.worker_id) == (3, 17)
+    assert codec.count_by_worker(id_array) == {(3, 17): 5000}
+
+
+def test_codec_slice_by_time() -> None:
+    codec: SnowflakeCodec = SnowflakeCodec()
+    rng: random.Random = random.Random(0)
+    id_list: List[int] = sorted(
+        codec.encode(TWEPOCH + rng.randrange(100), rng.randrange(8), rng.randrange(128), rng.randrange(4096))
+        for _ in range(1000)
+    )
+    start_timestamp, end_timestamp = TWEPOCH + 30, TWEPOCH + 60
+    start_id, end_id = codec.get_id_range(start_timestamp, end_timestamp)
+    id_slice: slice = codec.slice_by_time(id_list, start_timestamp, end_timestamp)
+    assert id_list[id_slice] == [
+        i for i in id_list if start_timestamp <= codec.get_timestamp(i) < end_timestamp
+    ]
+    assert all(start_id <= i < end_id for i in id_list[id_slice])